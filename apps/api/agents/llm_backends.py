@@ -0,0 +1,179 @@
+"""
+LLM backends behind agents/llm_client.py.
+
+GeminiBackend talks to the real API. FakeLLMBackend is a deterministic local
+stand-in for benchmarks, load tests and CI: no network, configurable latency
+distribution and error rate, and grades derived from a hash of each student
+response, so the same response always gets the same score (whether graded
+alone or inside a batch).
+
+Selected with LLM_BACKEND=gemini|fake. Fake backend configuration (env):
+    FAKE_LLM_LATENCY_MS     median latency per call (default: 800)
+    FAKE_LLM_LATENCY_SIGMA  log-normal spread, 0 for constant latency (default: 0.5)
+    FAKE_LLM_ERROR_RATE     fraction of calls failing with 429 / 503 (default: 0.0)
+    FAKE_LLM_SEED           seed for latency / error sampling (default: 0)
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+from typing import AsyncIterator, Dict, Optional
+
+from google.api_core import exceptions as api_exceptions
+
+
+class LLMBackend:
+    """One raw generation call. Rate limiting and retries live in LLMClient."""
+    name = "base"
+    requires_api_key = True
+
+    async def generate_once(self, prompt: str, api_key: str, model_name: str, timeout: Optional[float] = None) -> str:
+        raise NotImplementedError
+
+    async def generate_stream(self, prompt: str, api_key: str, model_name: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Yields the text in chunks as the model produces it. Default: one chunk at the end."""
+        yield await self.generate_once(prompt, api_key, model_name, timeout=timeout)
+
+
+class GeminiBackend(LLMBackend):
+    """
+    One GenerativeServiceAsyncClient (one pooled gRPC channel) per API key and event loop.
+    """
+    name = "gemini"
+
+    def __init__(self):
+        self._clients: Dict[tuple, object] = {}
+
+    def _client(self, api_key: str):
+        from google.ai import generativelanguage as glm
+        key = (id(asyncio.get_running_loop()), api_key)
+        if key not in self._clients:
+            self._clients[key] = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+        return self._clients[key]
+
+    def _request(self, prompt: str, model_name: str):
+        from google.ai import generativelanguage as glm
+        return glm.GenerateContentRequest(
+            model=f"models/{model_name}",
+            contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])]
+        )
+
+    async def generate_once(self, prompt: str, api_key: str, model_name: str, timeout: Optional[float] = None) -> str:
+        # retry=None: backoff is handled by LLMClient, not by the gapic default policy
+        response = await self._client(api_key).generate_content(request=self._request(prompt, model_name), retry=None, timeout=timeout)
+        if not response.candidates:
+            raise ValueError(f"Model returned no candidates (feedback: {response.prompt_feedback})")
+        return "".join(part.text for part in response.candidates[0].content.parts)
+
+    async def generate_stream(self, prompt: str, api_key: str, model_name: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        stream = await self._client(api_key).stream_generate_content(request=self._request(prompt, model_name), retry=None, timeout=timeout)
+        received = False
+        async for response in stream:
+            for candidate in response.candidates[:1]:
+                text = "".join(part.text for part in candidate.content.parts)
+                if text:
+                    received = True
+                    yield text
+        if not received:
+            raise ValueError("Model returned no candidates")
+
+
+class FakeLLMBackend(LLMBackend):
+    """
+    Answers the grading, batch grading and rubric prompts with well-formed JSON.
+    """
+    name = "fake"
+    requires_api_key = False
+
+    STUDENT_PATTERN = re.compile(r'\*\*Student (\d+):\*\*\n"(.*?)"\n', re.DOTALL)
+    SINGLE_PATTERN = re.compile(r'\*\*Student Response:\*\*\s*"(.*?)"\s*\*\*Task', re.DOTALL)
+    MODEL_ANSWER_PATTERN = re.compile(r'Model Answer:\s*"(.*?)"\s*Output Format', re.DOTALL)
+    STREAM_CHUNK_CHARS = 64
+
+    def __init__(self, latency_ms: float = 800, latency_sigma: float = 0.5, error_rate: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    def _latency_seconds(self) -> float:
+        if self.latency_sigma <= 0:
+            return self.latency_ms / 1000.0
+        return self.random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000.0
+
+    async def generate_once(self, prompt: str, api_key: str, model_name: str, timeout: Optional[float] = None) -> str:
+        await asyncio.sleep(self._latency_seconds())
+        return self._answer(prompt)
+
+    async def generate_stream(self, prompt: str, api_key: str, model_name: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Same text and total latency as generate_once, delivered in chunks spread over that time."""
+        latency = self._latency_seconds()
+        text = self._answer(prompt)
+        chunks = [text[start:start + self.STREAM_CHUNK_CHARS] for start in range(0, len(text), self.STREAM_CHUNK_CHARS)]
+        for chunk in chunks:
+            await asyncio.sleep(latency / len(chunks))
+            yield chunk
+
+    def _answer(self, prompt: str) -> str:
+        self.calls += 1
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            error = self.random.choice([api_exceptions.TooManyRequests, api_exceptions.ServiceUnavailable])
+            raise error("Fake LLM backend injected failure")
+
+        if "Output JSON Array ONLY" in prompt:
+            students = self.STUDENT_PATTERN.findall(prompt)
+            return json.dumps([dict(self._grade(text), student=int(index)) for index, text in students])
+        single = self.SINGLE_PATTERN.search(prompt)
+        if single:
+            return json.dumps(self._grade(single.group(1)))
+        answer = self.MODEL_ANSWER_PATTERN.search(prompt)
+        return json.dumps(self._rubric(answer.group(1) if answer else prompt))
+
+    def _digest(self, text: str) -> bytes:
+        return hashlib.sha256(re.sub(r"\s+", " ", text).strip().encode()).digest()
+
+    def _grade(self, student_response: str) -> dict:
+        digest = self._digest(student_response)
+        content_score = 40 + digest[0] % 61
+        handwriting_score = 50 + digest[1] % 51
+        return {
+            "content_score": content_score,
+            "handwriting_score": handwriting_score,
+            "feedback": f"[fake] Deterministic grade {content_score}/100 for response {digest.hex()[:8]}.",
+            "criterion_breakdown": []
+        }
+
+    def _rubric(self, answer_text: str) -> dict:
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", answer_text) if s.strip()]
+        return {
+            "exam_id": "auto_generated",
+            "questions": [
+                {
+                    "id": str(index + 1),
+                    "question_text": f"Explain: {sentence[:60]}",
+                    "max_marks": 1 + self._digest(sentence)[0] % 5,
+                    "key_points": sentence.split()[:3],
+                    "partial_credit_rule": "Award marks per key point mentioned."
+                }
+                for index, sentence in enumerate(sentences or [answer_text])
+            ]
+        }
+
+
+def create_backend(name: Optional[str] = None) -> LLMBackend:
+    name = (name or os.getenv("LLM_BACKEND", "gemini")).lower()
+    if name == "fake":
+        return FakeLLMBackend(
+            latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", 800)),
+            latency_sigma=float(os.getenv("FAKE_LLM_LATENCY_SIGMA", 0.5)),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", 0.0)),
+            seed=int(os.getenv("FAKE_LLM_SEED", 0)),
+        )
+    if name == "gemini":
+        return GeminiBackend()
+    raise ValueError(f"Unknown LLM_BACKEND '{name}' (expected 'gemini' or 'fake')")
@@ -0,0 +1,184 @@
+"""
+Shared async LLM client.
+
+Every agent goes through one LLMClient, which delegates the raw call to a
+pluggable backend (agents/llm_backends.py: Gemini, or a deterministic fake for
+offline load testing). The Gemini backend keeps one pooled async client per API
+key instead of calling genai.configure() and building a model per request.
+Calls go through a global and a per-key concurrency limit and a per-key token
+bucket, and 429 / 5xx responses are retried with jittered exponential backoff.
+When retries run out an LLMUnavailableError is raised, so callers can requeue
+work instead of recording a zero score.
+
+Configuration (env):
+    LLM_BACKEND                  gemini | fake (default: gemini)
+    LLM_MAX_CONCURRENCY          in-flight calls per process (default: 16)
+    LLM_MAX_CONCURRENCY_PER_KEY  in-flight calls per API key (default: 8)
+    LLM_RATE_PER_MINUTE          sustained requests per minute per key (default: 60)
+    LLM_RATE_BURST               token bucket size (default: 10)
+    LLM_MAX_RETRIES              retries for 429 / 5xx (default: 5)
+    LLM_BACKOFF_BASE_SECONDS     first backoff step (default: 1.0)
+    LLM_BACKOFF_MAX_SECONDS      backoff cap (default: 30)
+    LLM_TIMEOUT_SECONDS          deadline per call (or whole stream) unless the caller sets one (default: 60)
+"""
+import asyncio
+import os
+import random
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from google.api_core import exceptions as api_exceptions
+
+from apps.api.agents.llm_backends import LLMBackend, create_backend
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+MAX_CONCURRENCY_PER_KEY = int(os.getenv("LLM_MAX_CONCURRENCY_PER_KEY", 8))
+RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", 60))
+RATE_BURST = int(os.getenv("LLM_RATE_BURST", 10))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 1.0))
+BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 30))
+# A call without a deadline can hang on a stuck connection while holding the concurrency slots
+TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 60))
+
+RETRYABLE_ERRORS = (
+    api_exceptions.TooManyRequests, # includes ResourceExhausted (quota)
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded, # also raised locally when a call overruns its deadline
+)
+
+
+class LLMUnavailableError(RuntimeError):
+    """The model could not be reached within the retry budget (quota, outage)."""
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, at most `capacity` banked.
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _KeyState:
+    """Concurrency limit and rate limiter for one API key."""
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENCY_PER_KEY)
+        self.bucket = TokenBucket(RATE_PER_MINUTE / 60.0, RATE_BURST)
+
+
+class LLMClient:
+    """
+    Process-wide entry point for text generation. State is kept per event loop because
+    gRPC aio channels and asyncio primitives are bound to the loop that created them.
+    """
+    def __init__(self, backend: Optional[LLMBackend] = None):
+        self.backend = backend or create_backend()
+        self._loops: Dict[int, Tuple[asyncio.Semaphore, Dict[str, _KeyState]]] = {}
+
+    def _state(self, api_key: str) -> Tuple[asyncio.Semaphore, _KeyState]:
+        loop_id = id(asyncio.get_running_loop())
+        if loop_id not in self._loops:
+            self._loops[loop_id] = (asyncio.Semaphore(MAX_CONCURRENCY), {})
+        global_semaphore, keys = self._loops[loop_id]
+        if api_key not in keys:
+            keys[api_key] = _KeyState()
+        return global_semaphore, keys[api_key]
+
+    async def generate(self, prompt: str, api_key: str, model_name: str, timeout: Optional[float] = None) -> str:
+        """
+        Returns the model's text for a single-turn prompt.
+        """
+        if not api_key and self.backend.requires_api_key:
+            raise ValueError("API Key is required/configured for real AI processing.")
+        global_semaphore, state = self._state(api_key or "")
+        timeout = timeout or TIMEOUT_SECONDS
+
+        for attempt in range(MAX_RETRIES + 1):
+            await state.bucket.acquire()
+            try:
+                async with global_semaphore, state.semaphore:
+                    # The backend passes the deadline to the API; wait_for also covers a backend that ignores it
+                    try:
+                        return await asyncio.wait_for(
+                            self.backend.generate_once(prompt, api_key, model_name, timeout=timeout), timeout
+                        )
+                    except asyncio.TimeoutError:
+                        raise api_exceptions.DeadlineExceeded(f"No response within {timeout}s")
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_RETRIES:
+                    raise LLMUnavailableError(f"LLM ({self.backend.name}) unavailable after {attempt + 1} attempts: {e}") from e
+                await asyncio.sleep(backoff_delay(attempt))
+
+    async def generate_stream(self, prompt: str, api_key: str, model_name: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Yields the model's text in chunks as it is generated. Same limits as generate(),
+        and the deadline covers the whole stream. Retries only happen before the first
+        chunk, a stream broken later raises as is.
+        """
+        if not api_key and self.backend.requires_api_key:
+            raise ValueError("API Key is required/configured for real AI processing.")
+        global_semaphore, state = self._state(api_key or "")
+        timeout = timeout or TIMEOUT_SECONDS
+
+        for attempt in range(MAX_RETRIES + 1):
+            await state.bucket.acquire()
+            started = False
+            try:
+                async with global_semaphore, state.semaphore:
+                    deadline = time.monotonic() + timeout
+                    chunks = self.backend.generate_stream(prompt, api_key, model_name, timeout=timeout).__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, deadline - time.monotonic()))
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            raise api_exceptions.DeadlineExceeded(f"Stream not finished within {timeout}s")
+                        started = True
+                        yield chunk
+                return
+            except RETRYABLE_ERRORS as e:
+                if started:
+                    raise
+                if attempt == MAX_RETRIES:
+                    raise LLMUnavailableError(f"LLM ({self.backend.name}) unavailable after {attempt + 1} attempts: {e}") from e
+                await asyncio.sleep(backoff_delay(attempt))
+
+    def requires_api_key(self) -> bool:
+        return self.backend.requires_api_key
+
+    def model_id(self, model_name: str) -> str:
+        """Backend-qualified model name, e.g. for cache keys (fake grades never mix with real ones)."""
+        return f"{self.backend.name}/{model_name}"
+
+    def default_api_key(self) -> Optional[str]:
+        """Server-side key for background grading; the fake backend needs none."""
+        return os.getenv("GEMINI_API_KEY") or (None if self.backend.requires_api_key else "offline")
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with +/-50% jitter so retries from many workers don't line up."""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.5)
+
+
+llm_client = LLMClient()
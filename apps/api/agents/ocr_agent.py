@@ -1,71 +1,295 @@
+"""
+OCR with Tesseract.
+
+The preferred engine is tesserocr (pip install tesserocr): one TessBaseAPI per
+process keeps the engine and traineddata loaded and receives page pixels
+straight from memory. OCRAgent lives for the lifetime of a pool process
+(workers.py), so the model is loaded once per process instead of once per page.
+Without tesserocr it falls back to pytesseract, which runs the tesseract CLI
+per page (temp file, traineddata reload), and to a mock when no Tesseract is
+installed at all. The engine is picked lazily on the first page, not at import.
+
+Pages are not OCR'd whole: a layout pass on the binarized image finds the
+blocks of handwriting (blank margins and gaps are skipped), each block is
+OCR'd on its own with a page segmentation mode suited to its size, in parallel
+threads, and questions are split on "1." / "10)" / "Q3" anchors in the text.
+
+Configuration (env):
+    OCR_ENGINE         auto | tesserocr | cli | mock (default: auto)
+    OCR_LANG           Tesseract language(s) (default: eng)
+    OCR_TESSDATA_PATH  tessdata directory for tesserocr (default: Tesseract's own)
+    OCR_REGION_THREADS regions OCR'd at once per page (default: 2)
+    OCR_MAX_REGIONS    above this many blocks the page is OCR'd whole (default: 40)
+"""
 import cv2
 import pytesseract
 import json
 import os
-from typing import Dict, Any
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 
-class OCRAgent:
-    def __init__(self):
-        # Check if tesseract is available in PATH
-        self.use_mock = False
+import numpy as np
+
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_TESSDATA_PATH = os.getenv("OCR_TESSDATA_PATH")
+OCR_REGION_THREADS = int(os.getenv("OCR_REGION_THREADS", 2))
+OCR_MAX_REGIONS = int(os.getenv("OCR_MAX_REGIONS", 40))
+
+# Tesseract configuration for block of text
+OEM = 3 # default (LSTM when available)
+PSM = 6 # assume a single uniform block of text
+PSM_SINGLE_LINE = 7
+
+# "1. ...", "10) ...", "Q3 ...", "Question 4: ..."; a bare number needs punctuation and must
+# not be a decimal ("3.5 kg"), so ordinary numbers in an answer don't start a new question
+QUESTION_PATTERN = re.compile(
+    r"^\s*(?:Q(?:uestion)?\s*\.?\s*(\d{1,3})\s*[.):\]]?|(\d{1,3})\s*[.):\]](?!\d))\s*(.*)$",
+    re.IGNORECASE
+)
+
+# Layout: a row holds text when at least this share of it is ink; lines closer than
+# REGION_GAP_LINES median line heights belong to the same block
+ROW_INK_FRACTION = 0.004
+MIN_LINE_HEIGHT = 5
+REGION_GAP_LINES = 2.5
+REGION_PADDING = 8
+
+
+def find_text_regions(binary: np.ndarray) -> List[Tuple[int, int, int, int, int]]:
+    """
+    Blocks of text on a binarized page (black ink on white), top to bottom, as
+    (x0, y0, x1, y1, line_count). Lines are found from the row ink profile and grouped
+    into blocks across small gaps; each block is trimmed to its ink horizontally.
+    """
+    if binary.ndim == 3:
+        binary = cv2.cvtColor(binary, cv2.COLOR_BGR2GRAY)
+    height, width = binary.shape
+    ink = (binary < 128).view(np.uint8)
+    # Speckle from thresholding paper texture isn't text
+    ink = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+
+    rows = np.count_nonzero(ink, axis=1) > max(2, ROW_INK_FRACTION * width)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.view(np.int8), [0]))))
+    lines = [(start, end) for start, end in zip(edges[::2], edges[1::2]) if end - start >= MIN_LINE_HEIGHT]
+    if not lines:
+        return []
+
+    line_height = float(np.median([end - start for start, end in lines]))
+    blocks = [[lines[0]]]
+    for line in lines[1:]:
+        if line[0] - blocks[-1][-1][1] <= REGION_GAP_LINES * line_height:
+            blocks[-1].append(line)
+        else:
+            blocks.append([line])
+
+    regions = []
+    for block in blocks:
+        y0, y1 = block[0][0], block[-1][1]
+        columns = np.flatnonzero(np.count_nonzero(ink[y0:y1], axis=0))
+        if not columns.size:
+            continue
+        regions.append((
+            max(0, int(columns[0]) - REGION_PADDING),
+            max(0, int(y0) - REGION_PADDING),
+            min(width, int(columns[-1]) + 1 + REGION_PADDING),
+            min(height, int(y1) + REGION_PADDING),
+            len(block)
+        ))
+    return regions
+
+
+def parse_answers(text: str) -> List[Dict[str, str]]:
+    """
+    Splits OCR text into answers at question-number anchors. Text before the first
+    anchor is kept under question_no "unknown"; a question left blank gets "".
+    """
+    structure = []
+    current_question = None
+    current_answer = []
+
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+
+        match = QUESTION_PATTERN.match(line)
+        if match:
+            if current_question is not None or current_answer:
+                structure.append({
+                    "question_no": current_question or "unknown",
+                    "answer_text": " ".join(current_answer)
+                })
+            current_question = match.group(1) or match.group(2)
+            current_answer = [match.group(3).strip()] if match.group(3).strip() else []
+        else:
+            current_answer.append(line)
+
+    # Append last
+    if current_question is not None or current_answer:
+        structure.append({
+            "question_no": current_question or "unknown",
+            "answer_text": " ".join(current_answer)
+        })
+    return structure
+
+
+class TesserocrEngine:
+    """
+    In-process Tesseract via tesserocr. The API object (and its loaded model) is reused
+    for every page; pixels are passed from the numpy buffer without temp files.
+    """
+    name = "tesserocr"
+
+    def __init__(self, lang: str = OCR_LANG, tessdata_path: Optional[str] = None):
+        import tesserocr
+        kwargs = {"lang": lang, "psm": PSM, "oem": OEM}
+        if tessdata_path:
+            kwargs["path"] = tessdata_path
+        self.api = tesserocr.PyTessBaseAPI(**kwargs)
+
+    def image_to_string(self, image: np.ndarray, psm: int = PSM) -> str:
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape
+        self.api.SetPageSegMode(psm)
+        self.api.SetImageBytes(image.tobytes(), width, height, 1, width)
+        return self.api.GetUTF8Text()
+
+    def close(self):
+        self.api.End()
+
+
+class TesseractCLIEngine:
+    """
+    pytesseract: one tesseract subprocess per page. Used when tesserocr isn't installed.
+    """
+    name = "cli"
+
+    def __init__(self, lang: str = OCR_LANG):
+        self.lang = lang
+        pytesseract.get_tesseract_version() # raises when the binary is missing
+
+    def image_to_string(self, image: Any, psm: int = PSM) -> str:
+        return pytesseract.image_to_string(image, lang=self.lang, config=f"--oem {OEM} --psm {psm}")
+
+    def close(self):
+        pass
+
+
+def create_engine(name: str = OCR_ENGINE):
+    """
+    Returns the configured OCR engine, or None for mock OCR.
+    """
+    if name == "mock":
+        return None
+    if name in ("auto", "tesserocr"):
+        try:
+            return TesserocrEngine(OCR_LANG, OCR_TESSDATA_PATH)
+        except Exception as e:
+            if name == "tesserocr":
+                raise
+            if not isinstance(e, ImportError):
+                print(f"Warning: tesserocr unavailable ({e}). Falling back to the tesseract CLI.")
+    if name in ("auto", "cli"):
         try:
-            pytesseract.get_tesseract_version()
+            return TesseractCLIEngine(OCR_LANG)
         except Exception:
-            print("Warning: Tesseract not found. Using Mock OCR.")
-            self.use_mock = True
+            if name == "cli":
+                raise
+    print("Warning: Tesseract not found. Using Mock OCR.")
+    return None
 
-    def extract_text(self, image: Any) -> str:
+
+class OCRAgent:
+    def __init__(self, engine_name: str = OCR_ENGINE, region_threads: int = OCR_REGION_THREADS):
+        self.engine_name = engine_name
+        self.region_threads = max(1, region_threads)
+        # An engine (TessBaseAPI) must not be shared between threads: one per thread
+        self._local = threading.local()
+        self._engines = []
+        self._lock = threading.Lock()
+        self._use_mock = None
+        self._region_pool = None
+
+    @property
+    def engine(self):
+        # Resolved on first use: constructing an agent stays free of subprocesses / model loads
+        if self._use_mock is None or not hasattr(self._local, "engine"):
+            engine = create_engine(self.engine_name) if self._use_mock is not True else None
+            with self._lock:
+                self._use_mock = engine is None
+                if engine is not None:
+                    self._engines.append(engine)
+            self._local.engine = engine
+        return self._local.engine
+
+    @property
+    def use_mock(self) -> bool:
+        if self._use_mock is None:
+            self.engine
+        return self._use_mock
+
+    def close(self):
+        if self._region_pool is not None:
+            self._region_pool.shutdown(wait=True)
+            self._region_pool = None
+        with self._lock:
+            for engine in self._engines:
+                engine.close()
+            self._engines = []
+        self._local = threading.local()
+        self._use_mock = None
+
+    def extract_text(self, image: Any, psm: int = PSM) -> str:
         """
         Raw text extraction.
         """
         if self.use_mock:
             return self._mock_ocr_response()
-        
-        # Tesseract configuration for block of text
-        custom_config = r'--oem 3 --psm 6' 
-        text = pytesseract.image_to_string(image, config=custom_config)
-        return text
+        return self.engine.image_to_string(image, psm=psm)
+
+    def _ocr_region(self, image: np.ndarray, region: Tuple[int, int, int, int, int]) -> str:
+        x0, y0, x1, y1, line_count = region
+        crop = image[y0:y1, x0:x1]
+        return self.extract_text(crop, psm=PSM_SINGLE_LINE if line_count == 1 else PSM)
+
+    def extract_regions_text(self, image: Any) -> str:
+        """
+        OCRs the text blocks found by find_text_regions, in parallel threads, and joins
+        them in reading order. Falls back to the whole page when the layout is unusable.
+        """
+        image = np.asarray(image)
+        regions = find_text_regions(image)
+        if not regions:
+            return ""
+        if len(regions) > OCR_MAX_REGIONS:
+            # Noisy photo (shadows, texture): one pass over the page is cheaper
+            return self.extract_text(image)
+
+        if self.region_threads == 1 or len(regions) == 1:
+            texts = [self._ocr_region(image, region) for region in regions]
+        else:
+            if self._region_pool is None:
+                self._region_pool = ThreadPoolExecutor(max_workers=self.region_threads, thread_name_prefix="ocr-region")
+            texts = list(self._region_pool.map(lambda region: self._ocr_region(image, region), regions))
+        return "\n\n".join(text.strip() for text in texts if text.strip())
 
     def extract_structured_data(self, image: Any) -> Dict[str, Any]:
         """
         Extracts text and converts to structured JSON.
         """
-        raw_text = self.extract_text(image)
-        
-        # Heuristic parsing (Simple MVP version)
-        # Assumes format "1. Answer..."
-        structure = []
-        lines = raw_text.split('\n')
-        current_question = "unknown"
-        current_answer = []
-
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Detect Question Number (e.g., "1.", "Q1", "2)")
-            if line[0].isdigit() and (line[1] == '.' or line[1] == ')'):
-                if current_answer:
-                    structure.append({
-                        "question_no": current_question,
-                        "answer_text": " ".join(current_answer)
-                    })
-                current_question = line.split(' ')[0].strip('.)')
-                current_answer = [line[len(current_question)+1:].strip()]
-            else:
-                current_answer.append(line)
-        
-        # Append last
-        if current_answer:
-            structure.append({
-                "question_no": current_question,
-                "answer_text": " ".join(current_answer)
-            })
+        if self.use_mock:
+            raw_text = self._mock_ocr_response()
+        else:
+            raw_text = self.extract_regions_text(image)
 
         return {
             "raw_text": raw_text,
-            "structured_response": structure
+            "structured_response": parse_answers(raw_text)
         }
 
     def _mock_ocr_response(self):
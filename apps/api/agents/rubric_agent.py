@@ -1,25 +1,81 @@
 import json
-import google.generativeai as genai
-from typing import Dict, Any, Optional
+import re
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 import os
+from apps.api.agents.llm_client import llm_client
+from apps.api.cache import rubric_generation_cache, rubric_generation_key
+
+QUESTIONS_PATTERN = re.compile(r'"questions"\s*:\s*\[')
+
+
+class QuestionStream:
+    """
+    Incremental parser for the rubric JSON as it streams in: feed() returns each
+    object of the "questions" array as soon as its closing brace arrives. Every
+    character is scanned once, however the text is split into chunks.
+    """
+    def __init__(self):
+        self.text = ""
+        self.pos = -1 # scan position inside the questions array; -1 until it is found
+        self.depth = 0
+        self.start = 0
+        self.in_string = False
+        self.escaped = False
+        self.done = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.text += chunk
+        if self.done:
+            return []
+        if self.pos < 0:
+            match = QUESTIONS_PATTERN.search(self.text)
+            if not match:
+                return []
+            self.pos = match.end()
+
+        questions = []
+        text = self.text
+        for index in range(self.pos, len(text)):
+            char = text[index]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if self.depth == 0:
+                    self.start = index
+                self.depth += 1
+            elif char in "}]":
+                if self.depth == 0:
+                    # End of the questions array
+                    self.done = True
+                    break
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        questions.append(json.loads(text[self.start:index + 1]))
+                    except ValueError:
+                        pass # left for the full parse at the end to report
+        self.pos = len(text)
+        return questions
+
 
 class RubricAgent:
+    MODEL_NAME = 'gemini-flash-latest'
+    TIMEOUT_SECONDS = 30
+
     def __init__(self):
         pass
 
-    def generate_rubric(self, model_answer_text: str, api_key: str) -> Dict[str, Any]:
-        """
-        Parses raw model answer text into a structured rubric using Gemini.
-        """
-        if not api_key:
-             raise ValueError("API Key is required for real AI processing.")
-        
-        genai.configure(api_key=api_key, transport='rest')
-        model = genai.GenerativeModel('gemini-flash-latest')
-
-        prompt = f"""
+    def _prompt(self, model_answer_text: str) -> str:
+        return f"""
         You are an educational expert. Convert the following "Model Answer" into a structured grading rubric.
-        
+
         Model Answer:
         "{model_answer_text}"
 
@@ -38,12 +94,59 @@ class RubricAgent:
         }}
         """
 
+    def _parse(self, response_text: str) -> Dict[str, Any]:
+        # Cleanup markdown if present
+        cleaned_text = response_text.replace("```json", "").replace("```", "").strip()
+        return json.loads(cleaned_text)
+
+    async def generate_rubric(self, model_answer_text: str, api_key: str) -> Dict[str, Any]:
+        """
+        Parses raw model answer text into a structured rubric using Gemini.
+        The same answer (up to whitespace) for the same model is served from the cache.
+        """
+        if not api_key and llm_client.requires_api_key():
+             raise ValueError("API Key is required for real AI processing.")
+
+        cache_key = rubric_generation_key(model_answer_text, llm_client.model_id(self.MODEL_NAME))
+        cached = await rubric_generation_cache.get_async(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            response = model.generate_content(prompt, request_options={'timeout': 30})
-            # Cleanup markdown if present
-            cleaned_text = response.text.replace("```json", "").replace("```", "").strip()
-            return json.loads(cleaned_text)
+            response_text = await llm_client.generate(self._prompt(model_answer_text), api_key, self.MODEL_NAME, timeout=self.TIMEOUT_SECONDS)
+            rubric = self._parse(response_text)
         except Exception as e:
             print(f"LLM Error: {e}")
             # Fallback for demo if quota exceeded or key invalid, but we try to warn
             raise e
+        await rubric_generation_cache.put_async(cache_key, rubric)
+        return rubric
+
+    async def stream_rubric(self, model_answer_text: str, api_key: str) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Like generate_rubric, but yields ("question", {...}) for each question as soon as
+        the model has finished writing it, then ("rubric", {...}) with the complete rubric.
+        Cached rubrics are replayed immediately.
+        """
+        if not api_key and llm_client.requires_api_key():
+             raise ValueError("API Key is required for real AI processing.")
+
+        cache_key = rubric_generation_key(model_answer_text, llm_client.model_id(self.MODEL_NAME))
+        rubric: Optional[Dict[str, Any]] = await rubric_generation_cache.get_async(cache_key)
+        if rubric is not None:
+            for question in rubric.get("questions", []):
+                yield "question", question
+            yield "rubric", rubric
+            return
+
+        parser = QuestionStream()
+        try:
+            async for chunk in llm_client.generate_stream(self._prompt(model_answer_text), api_key, self.MODEL_NAME, timeout=self.TIMEOUT_SECONDS):
+                for question in parser.feed(chunk):
+                    yield "question", question
+            rubric = self._parse(parser.text)
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            raise e
+        await rubric_generation_cache.put_async(cache_key, rubric)
+        yield "rubric", rubric
@@ -1,68 +1,116 @@
+import asyncio
 import json
-import google.generativeai as genai
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Union
+from apps.api.cache import grading_cache, grading_key
+from apps.api.compiled_rubrics import CompiledRubric, compile_rubric
+from apps.api.agents.llm_client import llm_client, LLMUnavailableError
+
+
+class GradingError(RuntimeError):
+    """The model answered, but no usable grade could be read from the answer."""
+
 
 class ScoringAgent:
+    MODEL_NAME = 'gemini-1.5-pro'
+
     def __init__(self):
         pass
 
-    def evaluate_submission(self, student_response: str, rubric: Dict[str, Any], api_key: str = None, reference_context: str = None) -> Dict[str, Any]:
+    def _reference_section(self, reference_context: Optional[str]) -> str:
+        if not reference_context:
+            return ""
+        return f"""
+            **REFERENCE / ANSWER KEY:**
+            This is a correct/perfect answer. Use this to judge the student's accuracy strictly.
+            "{reference_context}"
+            """
+
+    def _finalize(self, result: Dict[str, Any], handwriting_weight: float) -> Dict[str, Any]:
+        """
+        Calculates the final weighted score locally to ensure weights are respected.
+        """
+        c_score = float(result.get('content_score', 0))
+        h_score = float(result.get('handwriting_score', 0))
+
+        # Total = (Content Score * ((100-H_Weight)/100)) + (Handwriting Score * (H_Weight/100))
+        content_weight_factor = (100.0 - handwriting_weight) / 100.0
+        handwriting_weight_factor = handwriting_weight / 100.0
+
+        final_score = (c_score * content_weight_factor) + (h_score * handwriting_weight_factor)
+
+        result['final_score'] = round(final_score)
+        return result
+
+    def _is_valid_result(self, result: Any) -> bool:
+        if not isinstance(result, dict) or not isinstance(result.get('feedback'), str):
+            return False
+        for key in ('content_score', 'handwriting_score'):
+            try:
+                if not 0 <= float(result.get(key)) <= 100:
+                    return False
+            except (TypeError, ValueError):
+                return False
+        return True
+
+    async def evaluate_submission(self, student_response: str, rubric: Union[CompiledRubric, Dict[str, Any]], api_key: str = None, reference_context: str = None) -> Dict[str, Any]:
         """
         Evaluates a student submission against a weighted rubric using Gemini.
-        rubric: {
+        rubric: a CompiledRubric, or {
             "title": str,
             "criteria": [{"description": str, "weight": float}],
             "handwriting_weight": float
         }
         reference_context: Optional string containing a perfect answer or answer key.
+        Raises LLMUnavailableError when Gemini stays rate limited / down, and GradingError
+        when its answer is not a valid grade, instead of scoring 0.
         """
-        if not api_key:
+        if not api_key and llm_client.requires_api_key():
              raise ValueError("API Key is required/configured for real AI processing.")
 
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-pro')
-        
-        # Format criteria for the prompt
-        criteria_list = rubric.get('criteria', [])
-        # If criteria came from DB as string, parse it
-        if isinstance(criteria_list, str):
-            try:
-                criteria_list = json.loads(criteria_list)
-            except:
-                criteria_list = []
+        rubric = compile_rubric(rubric)
+        # Identical response + rubric + reference + model was graded before: skip the LLM
+        cache_key = grading_key(student_response, rubric, reference_context, llm_client.model_id(self.MODEL_NAME))
+        cached = await grading_cache.get_async(cache_key)
+        if cached is not None:
+            return cached
 
-        criteria_text = "\n".join([f"- {c.get('description', 'Criterion')} (Weight: {c.get('weight', 0)}%)" for c in criteria_list])
-        handwriting_weight = float(rubric.get('handwriting_weight', 0))
+        try:
+            result = await self._grade_one(student_response, rubric, api_key, reference_context)
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            print(f"Error in ScoringAgent: {e}")
+            raise GradingError(f"Error evaluating submission: {e}") from e
 
-        reference_section = ""
-        if reference_context:
-            reference_section = f"""
-            **REFERENCE / ANSWER KEY:**
-            This is a correct/perfect answer. Use this to judge the student's accuracy strictly.
-            "{reference_context}"
-            """
+        await grading_cache.put_async(cache_key, result, tag=rubric.tag)
+        return result
+
+    async def _grade_one(self, student_response: str, rubric: CompiledRubric, api_key: str, reference_context: Optional[str]) -> Dict[str, Any]:
+        criteria_text = rubric.criteria_text
+        handwriting_weight = rubric.handwriting_weight
+        reference_section = self._reference_section(reference_context)
 
         prompt = f"""
-        You are an expert strict exam grader. 
-        
+        You are an expert strict exam grader.
+
         **Rubric Criteria:**
         {criteria_text}
 
         {reference_section}
-        
+
         **Handwriting Policy:**
         - Evaluate the handwriting legibility on a scale of 0-100.
         - This contributes {handwriting_weight}% to the final score.
-        
+
         **Student Response:**
         "{student_response}"
-        
+
         **Task:**
         1. Evaluate the content against EACH rubric criterion. Assign a score (0-100) for each criterion based on correctness.
         2. Calculate 'content_score' (0-100) as the weighted average of the individual criterion scores.
         3. Evaluate 'handwriting_score' (0-100) based on legibility and neatness.
         4. Provide specific, constructive feedback explaining the score.
-        
+
         **Output JSON Format ONLY:**
         {{
             "content_score": <int 0-100>,
@@ -74,33 +122,120 @@ class ScoringAgent:
         }}
         """
 
+        response_text = await llm_client.generate(prompt, api_key, self.MODEL_NAME)
+        # Simple cleanup if the model returns markdown code blocks
+        text = response_text.replace('```json', '').replace('```', '').strip()
+        result = json.loads(text)
+        if not self._is_valid_result(result):
+            raise ValueError("Model returned an invalid grading result")
+        return self._finalize(result, handwriting_weight)
+
+    async def evaluate_batch(self, student_responses: List[str], rubric: Union[CompiledRubric, Dict[str, Any]], api_key: str = None, reference_context: str = None) -> List[Union[Dict[str, Any], GradingError]]:
+        """
+        Evaluates several submissions for the same rubric in one Gemini call.
+        The rubric, handwriting policy and answer key are sent once instead of per student.
+        Cached results are reused, only misses reach the model. Results come back in input order.
+        Items the model gets wrong are re-split and retried, down to single-submission calls;
+        an item that still fails comes back as a GradingError in its slot.
+        """
+        if not api_key and llm_client.requires_api_key():
+             raise ValueError("API Key is required/configured for real AI processing.")
+
+        rubric = compile_rubric(rubric)
+        keys = [grading_key(response, rubric, reference_context, llm_client.model_id(self.MODEL_NAME)) for response in student_responses]
+        results: List[Any] = await grading_cache.get_many_async(keys)
+        misses = [index for index, result in enumerate(results) if result is None]
+        if misses:
+            graded = await self._grade_batch([student_responses[index] for index in misses], rubric, api_key, reference_context)
+            for index, (result, error) in zip(misses, graded):
+                if error is None:
+                    await grading_cache.put_async(keys[index], result, tag=rubric.tag)
+                    results[index] = result
+                else:
+                    results[index] = GradingError(f"Error evaluating submission: {error}")
+        return results
+
+    async def _grade_batch(self, student_responses: List[str], rubric: CompiledRubric, api_key: str, reference_context: Optional[str]) -> List[tuple]:
+        """
+        Returns one (result, error) pair per response, re-splitting failed items.
+        """
+        if len(student_responses) == 1:
+            try:
+                return [(await self._grade_one(student_responses[0], rubric, api_key, reference_context), None)]
+            except LLMUnavailableError:
+                raise
+            except Exception as e:
+                print(f"Error in ScoringAgent: {e}")
+                return [(None, e)]
+
+        criteria_text = rubric.criteria_text
+        handwriting_weight = rubric.handwriting_weight
+        reference_section = self._reference_section(reference_context)
+        submissions_text = "\n".join(
+            f'**Student {index}:**\n"{response}"\n' for index, response in enumerate(student_responses)
+        )
+
+        prompt = f"""
+        You are an expert strict exam grader. Grade EACH of the {len(student_responses)} student responses below independently.
+
+        **Rubric Criteria:**
+        {criteria_text}
+
+        {reference_section}
+
+        **Handwriting Policy:**
+        - Evaluate the handwriting legibility on a scale of 0-100.
+        - This contributes {handwriting_weight}% to the final score.
+
+        **Student Responses:**
+        {submissions_text}
+
+        **Task (for every student):**
+        1. Evaluate the content against EACH rubric criterion. Assign a score (0-100) for each criterion based on correctness.
+        2. Calculate 'content_score' (0-100) as the weighted average of the individual criterion scores.
+        3. Evaluate 'handwriting_score' (0-100) based on legibility and neatness.
+        4. Provide specific, constructive feedback explaining the score.
+
+        **Output JSON Array ONLY, one object per student, in order:**
+        [
+            {{
+                "student": <student number>,
+                "content_score": <int 0-100>,
+                "handwriting_score": <int 0-100>,
+                "feedback": "<string>",
+                "criterion_breakdown": [
+                    {{ "criterion": "<description>", "score": <int>, "reason": "<string>" }}
+                ]
+            }}
+        ]
+        """
+
+        results: List[Optional[tuple]] = [None] * len(student_responses)
         try:
-            response = model.generate_content(prompt)
-            # Simple cleanup if the model returns markdown code blocks
-            text = response.text.replace('```json', '').replace('```', '').strip()
-            result = json.loads(text)
-            
-            # Calculate final weighted score locally for safety, or trust the model? 
-            # Let's calculate locally to ensure weights are respected.
-            
-            c_score = float(result.get('content_score', 0))
-            h_score = float(result.get('handwriting_score', 0))
-            
-            # Total = (Content Score * ((100-H_Weight)/100)) + (Handwriting Score * (H_Weight/100))
-            content_weight_factor = (100.0 - handwriting_weight) / 100.0
-            handwriting_weight_factor = handwriting_weight / 100.0
-            
-            final_score = (c_score * content_weight_factor) + (h_score * handwriting_weight_factor)
-            
-            result['final_score'] = round(final_score)
-            return result
-            
+            response_text = await llm_client.generate(prompt, api_key, self.MODEL_NAME)
+            text = response_text.replace('```json', '').replace('```', '').strip()
+            items = json.loads(text)
+            if isinstance(items, list):
+                for position, item in enumerate(items):
+                    index = item.get('student', position) if isinstance(item, dict) else position
+                    if isinstance(index, int) and 0 <= index < len(results) and results[index] is None and self._is_valid_result(item):
+                        item.pop('student', None)
+                        results[index] = (self._finalize(item, handwriting_weight), None)
+        except LLMUnavailableError:
+            raise
         except Exception as e:
-            print(f"Error in ScoringAgent: {e}")
-            # Fallback
-            return {
-                "content_score": 0,
-                "handwriting_score": 0,
-                "final_score": 0,
-                "feedback": f"Error evaluating submission: {str(e)}"
-            }
+            print(f"Error in ScoringAgent batch of {len(student_responses)}: {e}")
+
+        # Re-split whatever the model dropped or garbled and retry it in smaller batches
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            half = (len(missing) + 1) // 2
+            chunks = [chunk for chunk in (missing[:half], missing[half:]) if chunk]
+            retried = await asyncio.gather(*[
+                self._grade_batch([student_responses[index] for index in chunk], rubric, api_key, reference_context)
+                for chunk in chunks
+            ])
+            for chunk, chunk_results in zip(chunks, retried):
+                for index, result in zip(chunk, chunk_results):
+                    results[index] = result
+        return results
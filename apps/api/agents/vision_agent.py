@@ -1,9 +1,57 @@
 import cv2
+import hashlib
+import heapq
+import io
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Tuple
 import numpy as np
 
+# Resolution of the warped / binarized page handed to OCR. 200-300 DPI is what Tesseract wants;
+# anything above that is decoded, warped and thresholded for nothing.
+OUTPUT_DPI = int(os.getenv("VISION_OUTPUT_DPI", 200))
+# The page may be decoded down to this fraction of the output DPI; the warp scales it back up.
+# At 200 DPI a 12MP (4000px) photo is halved when the page spans most of the frame's long side;
+# at 1.0 it would need 4700px, so phone photos would always be decoded at full size.
+MIN_DECODE_SCALE = float(os.getenv("VISION_MIN_DECODE_SCALE", 0.8))
+PAGE_LONG_SIDE_INCHES = 11.69 # A4; Letter (11in) lands within a reduction step of it
+EDGE_DETECTION_HEIGHT = 500
+HEADER_BYTES = 256 * 1024 # enough for JPEG EXIF (APP1 <= 64KB) and PNG headers
+# Pixel comparison of duplicate candidates: pages resized to this width, compared in square blocks
+COMPARE_WIDTH = 320
+COMPARE_BLOCK = 8
+# Decode threads per process_batch call; imdecode, Canny and findContours release the GIL
+DECODE_THREADS = int(os.getenv("VISION_DECODE_THREADS", 2))
+
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+class _PageBuffers:
+    """
+    Flat uint8 scratch arrays reused across the pages of a batch. Each page gets a
+    contiguous view of the right shape; an array only grows when a page needs more room.
+    """
+    def __init__(self, capacity: int = 0):
+        self._flat = {}
+        self.capacity = capacity
+
+    def view(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        size = int(np.prod(shape))
+        flat = self._flat.get(name)
+        if flat is None or flat.size < size:
+            flat = np.empty(max(size, self.capacity * (shape[2] if len(shape) == 3 else 1)), np.uint8)
+            self._flat[name] = flat
+        return flat[:size].reshape(shape)
+
+
 class VisionAgent:
-    def __init__(self):
-        pass
+    def __init__(self, output_dpi: int = OUTPUT_DPI):
+        self.output_dpi = output_dpi
+        self.target_long_side = int(PAGE_LONG_SIDE_INCHES * output_dpi)
 
     def order_points(self, pts):
         """
@@ -18,9 +66,10 @@ class VisionAgent:
         rect[3] = pts[np.argmax(diff)]
         return rect
 
-    def four_point_transform(self, image, pts):
+    def perspective_matrix(self, pts, max_long_side: int = None):
         """
-        Apply perspective transform to flattened image.
+        Transform and output size (width, height) that flatten the quadrilateral `pts`.
+        With max_long_side the output is scaled down in the same warp (no second resize).
         """
         rect = self.order_points(pts)
         (tl, tr, br, bl) = rect
@@ -33,6 +82,11 @@ class VisionAgent:
         heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
         maxHeight = max(int(heightA), int(heightB))
 
+        if max_long_side and max(maxWidth, maxHeight) > max_long_side:
+            scale = max_long_side / float(max(maxWidth, maxHeight))
+            maxWidth = max(1, int(maxWidth * scale))
+            maxHeight = max(1, int(maxHeight * scale))
+
         dst = np.array([
             [0, 0],
             [maxWidth - 1, 0],
@@ -40,47 +94,148 @@ class VisionAgent:
             [0, maxHeight - 1]], dtype="float32")
 
         M = cv2.getPerspectiveTransform(rect, dst)
-        warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
-        return warped
+        return M, (maxWidth, maxHeight)
 
-    def process_image(self, image_bytes: bytes):
+    def four_point_transform(self, image, pts, max_long_side: int = None):
         """
-        Detects paper, crops it, and binarizes it for OCR.
+        Apply perspective transform to flattened image.
+        """
+        M, size = self.perspective_matrix(pts, max_long_side)
+        return cv2.warpPerspective(image, M, size)
+
+    def fingerprint(self, image_bytes: bytes):
+        """
+        Cheap identity for duplicate detection: sha256 of the raw bytes plus a 64-bit
+        difference hash (dHash) of a heavily downscaled grayscale decode, which survives
+        re-encoding and resizing of the same photo.
         """
-        # 1. Load Image
+        digest = hashlib.sha256(image_bytes).hexdigest()
         nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        small = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if small is None:
+            raise ValueError("Could not decode image")
+
+        thumb = cv2.resize(small, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (thumb[:, 1:] > thumb[:, :-1]).flatten()
+        phash = 0
+        for bit in bits:
+            phash = (phash << 1) | int(bit)
+        # Signed 64-bit so it fits an SQL BIGINT
+        if phash >= 1 << 63:
+            phash -= 1 << 64
+        return digest, phash
+
+    def page_difference(self, image_bytes: bytes, other_bytes: bytes) -> float:
+        """
+        Pixel-level check for duplicate candidates: both uploads in grayscale at
+        COMPARE_WIDTH px wide, absolute difference averaged over COMPARE_BLOCK px blocks;
+        returns the worst block (grey levels, 0-255). Re-encoded or resized copies of one
+        photo stay in the low single digits, while a changed word or digit in one block
+        is far above that. inf when the aspect ratios differ.
+        """
+        pages = []
+        for data in (image_bytes, other_bytes):
+            gray = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+            if gray is None:
+                raise ValueError("Could not decode image")
+            pages.append(gray)
+        (height, width), (other_height, other_width) = pages[0].shape, pages[1].shape
+        if abs(height / width - other_height / other_width) > 0.01 * height / width:
+            return float("inf")
+
+        size = (COMPARE_WIDTH, max(COMPARE_BLOCK, int(round(COMPARE_WIDTH * height / width))))
+        small, other = [cv2.resize(page, size, interpolation=cv2.INTER_AREA).astype(np.float32) for page in pages]
+        difference = cv2.absdiff(small, other)
+        blocks = cv2.resize(difference, (size[0] // COMPARE_BLOCK, size[1] // COMPARE_BLOCK), interpolation=cv2.INTER_AREA)
+        return float(blocks.max())
+
+    def decode_reduction(self, image_bytes: bytes) -> int:
+        """
+        Largest power-of-two reduction (1, 2, 4, 8) that keeps the page itself at no less
+        than MIN_DECODE_SCALE of the output DPI. The header rules out frames too small to
+        reduce; otherwise the page outline is found on a 1/8 decode and the factor is
+        picked from the page's size rather than the whole frame's.
+        """
+        try:
+            from PIL import Image
+            # Only the header is parsed; don't copy the whole (possibly shared-memory) buffer
+            with Image.open(io.BytesIO(memoryview(image_bytes)[:HEADER_BYTES])) as header:
+                long_side = max(header.size)
+        except Exception:
+            return 1
+        if self._reduction_for(long_side) == 1:
+            return 1
+
+        small = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_COLOR_8)
+        if small is None:
+            return 1
+        screen = self.find_page_contour(small)
+        if screen is not None:
+            _, size = self.perspective_matrix(screen)
+            # Back to full-resolution pixels; no outline means the page is the whole frame
+            long_side = max(size) * long_side / float(max(small.shape[:2]))
+        return self._reduction_for(long_side)
+
+    def _reduction_for(self, page_long_side: float) -> int:
+        for factor, _ in REDUCED_DECODE_FLAGS:
+            if page_long_side / factor >= self.target_long_side * MIN_DECODE_SCALE:
+                return factor
+        return 1
+
+    def decode(self, image_bytes: bytes):
+        """
+        Decodes at reduced resolution when the output DPI allows it. For JPEG, libjpeg
+        scales during the IDCT, so a 12MP photo never exists in memory at full size.
+        """
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        factor = self.decode_reduction(image_bytes)
+        flag = dict(REDUCED_DECODE_FLAGS).get(factor, cv2.IMREAD_COLOR)
+        image = cv2.imdecode(nparr, flag)
         if image is None:
             raise ValueError("Could not decode image")
+        return image
 
-        # Resize for faster processing (keep ratio)
-        ratio = image.shape[0] / 500.0
-        orig = image.copy()
-        image_resized = cv2.resize(image, (int(image.shape[1] / ratio), 500))
+    def find_page_contour(self, image):
+        """
+        Returns the page outline (4 points, in `image` coordinates) or None.
+        """
+        ratio = image.shape[0] / float(EDGE_DETECTION_HEIGHT)
+        small = cv2.resize(image, (max(1, int(image.shape[1] / ratio)), EDGE_DETECTION_HEIGHT))
 
-        # 2. Edge Detection
-        gray = cv2.cvtColor(image_resized, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
         gray = cv2.GaussianBlur(gray, (5, 5), 0)
         edged = cv2.Canny(gray, 75, 200)
 
-        # 3. Find Contours
-        contours, _ = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        contours = sorted(contours, key=cv2.contourArea, reverse=True)[:5]
-
-        screenCnt = None
-        for c in contours:
+        # findContours no longer modifies its input (OpenCV >= 3.2): no copy needed.
+        # Only the 5 largest matter, so select them without sorting every contour.
+        contours, _ = cv2.findContours(edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        for c in heapq.nlargest(5, contours, key=cv2.contourArea):
             peri = cv2.arcLength(c, True)
             approx = cv2.approxPolyDP(c, 0.02 * peri, True)
             if len(approx) == 4:
-                screenCnt = approx
-                break
+                return approx.reshape(4, 2) * ratio
+        return None
+
+    def process_image(self, image_bytes: bytes):
+        """
+        Detects paper, crops it, and binarizes it for OCR.
+        Output is sized for OUTPUT_DPI rather than the camera's full resolution.
+        """
+        # 1. Load Image (reduced resolution when possible)
+        image = self.decode(image_bytes)
+
+        # 2-3. Edge Detection & Contours on a 500px-high copy
+        screen = self.find_page_contour(image)
 
         # 4. Transform & Threshold
-        if screenCnt is not None:
-            warped = self.four_point_transform(orig, screenCnt.reshape(4, 2) * ratio)
+        if screen is not None:
+            warped = self.four_point_transform(image, screen, max_long_side=self.target_long_side)
+        elif max(image.shape[:2]) > self.target_long_side:
+            # Fallback if no contour found: whole frame, scaled to the output DPI
+            scale = self.target_long_side / float(max(image.shape[:2]))
+            warped = cv2.resize(image, (int(image.shape[1] * scale), int(image.shape[0] * scale)), interpolation=cv2.INTER_AREA)
         else:
-            # Fallback if no contour found
-            warped = orig
+            warped = image
 
         # Convert to grayscale and apply adaptive thresholding for "scanned document" look
         warped_gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
@@ -91,3 +246,73 @@ class VisionAgent:
         )
 
         return processed, warped # Return binarized and original warped color image
+
+    def _decode_and_detect(self, image_bytes: bytes):
+        image = self.decode(image_bytes)
+        return image, self.find_page_contour(image)
+
+    def _warp_into(self, image, screen, buffers: _PageBuffers):
+        """
+        process_image's transform & threshold, writing into the batch's reused buffers.
+        """
+        if screen is not None:
+            M, (width, height) = self.perspective_matrix(screen, max_long_side=self.target_long_side)
+            warped = cv2.warpPerspective(image, M, (width, height), dst=buffers.view("warped", (height, width, 3)))
+        elif max(image.shape[:2]) > self.target_long_side:
+            scale = self.target_long_side / float(max(image.shape[:2]))
+            width, height = int(image.shape[1] * scale), int(image.shape[0] * scale)
+            warped = cv2.resize(image, (width, height), dst=buffers.view("warped", (height, width, 3)), interpolation=cv2.INTER_AREA)
+        else:
+            warped = image
+
+        shape = warped.shape[:2]
+        warped_gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY, dst=buffers.view("gray", shape))
+        processed = cv2.adaptiveThreshold(
+            warped_gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2,
+            dst=buffers.view("processed", shape)
+        )
+        return processed, warped
+
+    def process_batch(self, images: Iterable[bytes], threads: int = DECODE_THREADS,
+                      return_exceptions: bool = False) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        process_image for many pages, yielding (processed, warped) in input order as each
+        page is ready, so the caller can OCR page 1 while later pages are still decoding.
+
+        Decoding and contour detection run `threads` pages ahead in a thread pool; warp and
+        threshold write into buffers preallocated for the output DPI and reused for every
+        page. Yielded arrays are only valid until the next page is requested: copy them
+        (or finish with them) before advancing the generator.
+
+        With return_exceptions a page that fails yields its exception instead of ending
+        the batch.
+        """
+        width = int(self.target_long_side / 1.414) # A4 portrait
+        buffers = _PageBuffers(capacity=self.target_long_side * width)
+        pages = iter(images)
+        with ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="vision-decode") as pool:
+            pending = deque()
+            for image_bytes in pages:
+                pending.append(pool.submit(self._decode_and_detect, image_bytes))
+                if len(pending) >= threads:
+                    break
+
+            try:
+                while pending:
+                    future = pending.popleft()
+                    next_page = next(pages, None)
+                    if next_page is not None:
+                        pending.append(pool.submit(self._decode_and_detect, next_page))
+                    try:
+                        image, screen = future.result()
+                        page = self._warp_into(image, screen, buffers)
+                        del image # the full decode is not kept alive while the caller works
+                    except Exception as e:
+                        if not return_exceptions:
+                            raise
+                        page = e
+                    yield page
+            finally:
+                # Error or caller stopped early: don't decode pages nobody will read
+                for future in pending:
+                    future.cancel()
@@ -0,0 +1,72 @@
+"""
+Page iterators for bulk uploads (multi-page PDF or ZIP of photos).
+
+Pages are yielded one at a time straight from the (disk-spooled) upload, so a
+40-page class set never sits in memory all at once.
+"""
+import os
+import zipfile
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+PDF_RENDER_DPI = int(os.getenv("BATCH_PDF_DPI", 200))
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+def detect_kind(fileobj: BinaryIO, filename: Optional[str] = None) -> str:
+    """Returns 'pdf' or 'zip' from the file's magic bytes, falling back to its extension."""
+    head = fileobj.read(4)
+    fileobj.seek(0)
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    if head.startswith(b"PK"):
+        return "zip"
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in (".pdf", ".zip"):
+        return ext[1:]
+    raise ValueError("Unsupported archive: expected a PDF or ZIP file")
+
+
+def iter_zip_pages(fileobj: BinaryIO) -> Iterator[Tuple[str, bytes]]:
+    with zipfile.ZipFile(fileobj) as archive:
+        members = sorted(
+            (m for m in archive.infolist()
+             if not m.is_dir()
+             and os.path.splitext(m.filename)[1].lower() in IMAGE_EXTENSIONS
+             and not os.path.basename(m.filename).startswith(".")),
+            key=lambda m: m.filename
+        )
+        for member in members:
+            yield member.filename, archive.read(member)
+
+
+def iter_pdf_pages(fileobj: BinaryIO, dpi: int = PDF_RENDER_DPI) -> Iterator[Tuple[str, bytes]]:
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        raise ValueError("PDF uploads need the 'pypdfium2' package installed")
+    import cv2
+
+    pdf = pdfium.PdfDocument(fileobj)
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            bitmap = page.render(scale=dpi / 72.0)
+            # Lossless re-encode so the vision stage sees the same bytes as a photo upload
+            ok, encoded = cv2.imencode(".png", bitmap.to_numpy())
+            bitmap.close()
+            page.close()
+            if not ok:
+                raise ValueError(f"Could not render PDF page {index + 1}")
+            yield f"page-{index + 1}", encoded.tobytes()
+    finally:
+        pdf.close()
+
+
+def iter_pages(fileobj: BinaryIO, filename: Optional[str] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yields (source_name, image_bytes) for every page in a PDF or ZIP upload.
+    """
+    kind = detect_kind(fileobj, filename)
+    if kind == "pdf":
+        return iter_pdf_pages(fileobj)
+    return iter_zip_pages(fileobj)
@@ -1,30 +1,46 @@
+"""
+Access tokens and the current-user dependencies (password hashing lives in
+passwords.py).
+
+Verified tokens are cached in-process (token -> user, bounded LRU with a short
+TTL that never outlives the token), so authenticated requests skip both the
+JWT check and the user query. Updates and deletes of a User drop its entries in
+this process; other processes see the change within the TTL. Tokens also carry
+the user id ("uid") so ownership checks can use get_current_user_id, which
+needs no database lookup at all.
+
+Configuration (env):
+    AUTH_USER_CACHE_TTL_SECONDS   lifetime of a cached token -> user entry (default: 60, 0 disables)
+    AUTH_USER_CACHE_SIZE          tokens kept (default: 4096)
+    AUTH_TOKEN_USER_ID            embed the user id claim in new tokens (default: 1)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Annotated, Union
+from typing import Annotated, Dict, Optional, Tuple, Union
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlmodel import Session
-from apps.api.database import get_session
+from sqlalchemy import event
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from apps.api.database import get_async_session
 from apps.api.models import User
+from apps.api.passwords import get_password_hash, verify_password # re-exported
 
 # Configuration
 SECRET_KEY = "CHANGE_THIS_IN_PRODUCTION_TO_A_LONG_RANDOM_STRING"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", 60))
+USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", 4096))
+TOKEN_USER_ID_CLAIM = os.getenv("AUTH_TOKEN_USER_ID", "1") != "0"
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-
 def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -36,12 +52,84 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
     return encoded_jwt
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], session: Session = Depends(get_session)):
-    credentials_exception = HTTPException(
+def token_claims(user: User) -> dict:
+    """Claims for a user's access token: the email, plus the user id unless disabled."""
+    claims = {"sub": user.email}
+    if TOKEN_USER_ID_CLAIM:
+        claims["uid"] = user.id
+    return claims
+
+
+class UserCache:
+    """
+    Thread-safe LRU of verified token -> user. Entries expire after ttl_seconds or at the
+    token's own expiry, whichever comes first. Users are kept as plain field snapshots
+    and handed out as fresh, session-less User objects.
+    """
+
+    def __init__(self, size: int = USER_CACHE_SIZE, ttl_seconds: float = USER_CACHE_TTL_SECONDS):
+        self.size = size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[User]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return User(**entry[1])
+
+    def put(self, token: str, user: User, token_expires_at: float):
+        if self.ttl_seconds <= 0:
+            return
+        expires_at = min(time.time() + self.ttl_seconds, token_expires_at)
+        with self._lock:
+            self._entries[token] = (expires_at, user.model_dump())
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            for token in [token for token, (_, user) in self._entries.items() if user["id"] == user_id]:
+                del self._entries[token]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], session: AsyncSession = Depends(get_async_session)):
+    user = user_cache.get(token)
+    if user is not None:
+        return user
+
+    credentials_exception = _credentials_exception()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -50,7 +138,25 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], sessio
     except JWTError:
         raise credentials_exception
     
-    user = session.query(User).filter(User.email == email).first()
+    user = (await session.exec(select(User).where(User.email == email))).first()
     if user is None:
         raise credentials_exception
+    user_cache.put(token, user, payload["exp"])
     return user
+
+
+async def get_current_user_id(token: Annotated[str, Depends(oauth2_scheme)], session: AsyncSession = Depends(get_async_session)) -> int:
+    """
+    The authenticated user's id for ownership checks. Read from the token's uid claim
+    without touching the database; older tokens without it fall back to get_current_user.
+    """
+    user = user_cache.get(token)
+    if user is not None:
+        return user.id
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise _credentials_exception()
+    if payload.get("uid") is not None:
+        return int(payload["uid"])
+    return (await get_current_user(token, session)).id
@@ -0,0 +1,114 @@
+"""
+Dashboard query benchmark: statements issued and latency of the /classes and
+/classes/{id}/students stats as class sizes grow, for the old per-row queries,
+the grouped aggregates and the materialized stats tables. Also checks that the
+three agree. Uses a throwaway SQLite database.
+
+    python -m apps.api.benchmarks.dashboard_bench --classes 10 --students 10 40 160 --exams 5
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, create_engine, func, select
+
+from apps.api import stats
+from apps.api.models import Classroom, Exam, Student, User
+
+
+def seed(engine, classes: int, students: int, exams: int) -> int:
+    rng = random.Random(0)
+    with Session(engine) as session:
+        teacher = User(email="bench@example.com", hashed_password="x")
+        session.add(teacher)
+        session.commit()
+        for c in range(classes):
+            classroom = Classroom(name=f"Class {c}", subject="Biology", teacher_id=teacher.id)
+            session.add(classroom)
+            session.flush()
+            roster = [Student(name=f"S{c}-{s}", roll_number=str(s), classroom_id=classroom.id) for s in range(students)]
+            session.add_all(roster)
+            session.flush()
+            session.add_all([
+                Exam(title="bench", image_url="", feedback="", score=rng.randint(0, 100),
+                     student_id=student.id, classroom_id=classroom.id)
+                for student in roster for _ in range(exams)
+            ])
+        session.commit()
+        return teacher.id
+
+
+def per_row(session, teacher_id: int):
+    """The previous implementation: one query per class and per student."""
+    result = []
+    for cls in session.exec(select(Classroom).where(Classroom.teacher_id == teacher_id)).all():
+        count = session.exec(select(func.count(Student.id)).where(Student.classroom_id == cls.id)).one()
+        avg = session.exec(select(func.avg(Exam.score)).where(Exam.classroom_id == cls.id)).one() or 0.0
+        averages = []
+        for student in session.exec(select(Student).where(Student.classroom_id == cls.id)).all():
+            averages.append(round(session.exec(select(func.avg(Exam.score)).where(Exam.student_id == student.id)).one() or 0.0, 1))
+        result.append((cls.id, count, round(avg, 1), averages))
+    return result
+
+
+def grouped(session, teacher_id: int):
+    result = []
+    for cls, count, avg in stats.classes_with_stats(session, teacher_id):
+        averages = [average for _, average in stats.students_with_stats(session, cls.id)]
+        result.append((cls.id, count, avg, averages))
+    return result
+
+
+def measure(engine, fn, teacher_id: int, repeat: int):
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        with Session(engine) as session:
+            result = fn(session, teacher_id)
+            queries = statements[0]
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn(session, teacher_id)
+            elapsed = (time.perf_counter() - start) / repeat
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return result, queries, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--classes", type=int, default=10)
+    parser.add_argument("--students", type=int, nargs="+", default=[10, 40, 160])
+    parser.add_argument("--exams", type=int, default=5, help="exams per student")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # Maintaining the tables while seeding also exercises the flush hook
+    stats.install()
+    print(f"{'students/class':>14} {'mode':>12} {'queries':>8} {'ms/load':>9}")
+    for students in args.students:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+            SQLModel.metadata.create_all(engine)
+            teacher_id = seed(engine, args.classes, students, args.exams)
+
+            results = {}
+            for mode, fn, materialized in (("per-row", per_row, False), ("grouped", grouped, False),
+                                           ("materialized", grouped, True)):
+                stats.ENABLED = materialized
+                results[mode], queries, elapsed = measure(engine, fn, teacher_id, args.repeat)
+                print(f"{students:>14} {mode:>12} {queries:>8} {elapsed * 1000:>9.1f}")
+            if not results["per-row"] == results["grouped"] == results["materialized"]:
+                print("  MISMATCH between modes")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+SQLite write benchmark: parallel "scan" transactions (read the job, insert an
+Exam and its images, update the job) against the legacy engine (rollback
+journal, default locking) and the one built by database.create_engine_from_env
+(WAL, synchronous=NORMAL, busy_timeout, pooled). Reports commits per second
+and transactions that failed with "database is locked".
+
+    python -m apps.api.benchmarks.db_write_bench --writers 1 4 8 16 --transactions 200
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from apps.api.database import create_engine_from_env
+from apps.api.models import Exam, ScanImage, ScanJob
+
+
+def scan_transaction(engine):
+    job_id = str(uuid.uuid4())
+    with Session(engine) as session:
+        session.add(ScanJob(id=job_id, status="running"))
+        session.commit()
+    with Session(engine) as session:
+        session.exec(select(ScanJob).where(ScanJob.id == job_id)).one()
+        exam = Exam(title="bench", image_url="", feedback="ok", score=80, ocr_content="Q1: x" * 50)
+        session.add(exam)
+        session.flush()
+        session.add_all([ScanImage(exam_id=exam.id, kind=kind, key=uuid.uuid4().hex, content_type="image/jpeg", size=1)
+                         for kind in ("original", "warped", "processed")])
+        session.exec(update(ScanJob).where(ScanJob.id == job_id).values(status="done", exam_id=exam.id))
+        session.commit()
+
+
+def run(engine, writers: int, transactions: int):
+    errors = [0]
+    lock = threading.Lock()
+
+    def writer(count: int):
+        for _ in range(count):
+            try:
+                scan_transaction(engine)
+            except OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                with lock:
+                    errors[0] += 1
+
+    per_writer = transactions // writers
+    threads = [threading.Thread(target=writer, args=(per_writer,)) for _ in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return (per_writer * writers - errors[0]) / elapsed, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--transactions", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'writers':>7} {'engine':>8} {'commits/s':>10} {'locked':>7}")
+    for writers in args.writers:
+        for name in ("legacy", "tuned"):
+            with tempfile.TemporaryDirectory() as directory:
+                url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+                if name == "legacy":
+                    engine = create_engine(url, connect_args={"check_same_thread": False})
+                else:
+                    engine = create_engine_from_env(url)
+                SQLModel.metadata.create_all(engine)
+                throughput, locked = run(engine, writers, args.transactions)
+                print(f"{writers:>7} {name:>8} {throughput:>10.0f} {locked:>7}")
+                engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
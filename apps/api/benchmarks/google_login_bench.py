@@ -0,0 +1,91 @@
+"""
+Google sign-in verification benchmark, fully local: a stand-in key set
+(google_auth.make_stand_in_keys) is served over HTTP with Cache-Control
+max-age, and tokens signed with it are verified
+  - per call, the old way: id_token.verify_token with a new Request, which
+    downloads the certs every time, and
+  - through google_auth.CertCache: fetched once over a pooled session,
+    then local signature checks only.
+
+    python -m apps.api.benchmarks.google_login_bench --tokens 200 --latency-ms 80
+
+--latency-ms delays each cert response to stand in for the round trip to Google.
+"""
+import argparse
+import asyncio
+import http.server
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def serve_certs(path: str, latency_ms: float, max_age: int):
+    with open(path, "rb") as f:
+        body = f.read()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency_ms / 1000)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Cache-Control", f"public, max-age={max_age}, must-revalidate, no-transform")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--max-age", type=int, default=21600)
+    args = parser.parse_args()
+
+    from google.auth import jwt
+    from google.auth.transport import requests as google_requests
+    from google.oauth2 import id_token
+    from apps.api import google_auth
+
+    with tempfile.TemporaryDirectory() as directory:
+        certs_path = os.path.join(directory, "certs.json")
+        signer = google_auth.make_stand_in_keys(certs_path)
+        server = serve_certs(certs_path, args.latency_ms, args.max_age)
+        url = f"http://127.0.0.1:{server.server_port}/oauth2/v1/certs"
+        now = int(time.time())
+        tokens = [
+            jwt.encode(signer, {"iss": "https://accounts.google.com", "aud": "bench-client", "sub": str(i),
+                                "email": f"user{i}@example.com", "iat": now, "exp": now + 3600}).decode()
+            for i in range(args.tokens)
+        ]
+
+        start = time.perf_counter()
+        for token in tokens:
+            id_token.verify_token(token, google_requests.Request(), audience="bench-client", certs_url=url)
+        per_call = (time.perf_counter() - start) / len(tokens)
+
+        cache = google_auth.CertCache(url=url, path=None)
+        google_auth.cert_cache = cache
+        start = time.perf_counter()
+        for token in tokens:
+            asyncio.run(google_auth.verify_id_token(token, audience="bench-client"))
+        cached = (time.perf_counter() - start) / len(tokens)
+        server.shutdown()
+
+    print(f"fetch per call : {per_call * 1000:7.2f} ms/verify, {len(tokens)} cert fetches")
+    print(f"CertCache      : {cached * 1000:7.2f} ms/verify, {cache.fetches} cert fetch(es), "
+          f"cached for {cache.expires_at - cache.fetched_at:.0f}s (Cache-Control max-age)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Login throughput benchmark: bursts of concurrent POST /auth/token against the
+app in-process (throwaway SQLite database), reporting logins per second, how
+many were turned away with 503, and the latency of a cheap endpoint probed
+while the burst runs (it should stay flat: bcrypt runs in the hashing pool, not
+on the event loop or the request threadpool).
+
+    python -m apps.api.benchmarks.login_bench --concurrency 1 8 32 128 --logins 64
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+
+async def burst(client, concurrency: int, logins: int, email: str):
+    semaphore = asyncio.Semaphore(concurrency)
+    outcomes = {"ok": 0, "busy": 0, "other": 0}
+    probe_latencies = []
+    done = asyncio.Event()
+
+    async def login():
+        async with semaphore:
+            response = await client.post("/auth/token", data={"username": email, "password": "correct horse"})
+        key = "ok" if response.status_code == 200 else "busy" if response.status_code == 503 else "other"
+        outcomes[key] += 1
+
+    async def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            await client.get("/")
+            probe_latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.02)
+
+    prober = asyncio.create_task(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*[login() for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await prober
+    return outcomes, elapsed, probe_latencies
+
+
+async def run(args):
+    import httpx
+    from apps.api import passwords
+    from apps.api.database import create_db_and_tables, engine
+    from apps.api.main import app
+    from apps.api.models import User
+    from sqlmodel import Session
+
+    create_db_and_tables()
+    email = "bench@example.com"
+    with Session(engine) as session:
+        session.add(User(email=email, hashed_password=passwords.get_password_hash("correct horse")))
+        session.commit()
+
+    start = time.perf_counter()
+    passwords.verify_password("correct horse", passwords.get_password_hash("correct horse"))
+    print(f"one bcrypt verify inline: {(time.perf_counter() - start) / 2 * 1000:.0f} ms; "
+          f"hash workers: {passwords.HASH_WORKERS}, max pending: {passwords.MAX_PENDING}")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await burst(client, 1, 2, email) # spawn and warm the hashing pool
+        print(f"{'concurrency':>11} {'logins/s':>9} {'ok':>5} {'503':>5} {'probe p50 ms':>13} {'probe p95 ms':>13}")
+        for concurrency in args.concurrency:
+            outcomes, elapsed, probes = await burst(client, concurrency, args.logins, email)
+            probes = sorted(probes) or [0.0]
+            p95 = probes[min(len(probes) - 1, int(len(probes) * 0.95))]
+            print(f"{concurrency:>11} {outcomes['ok'] / elapsed:>9.1f} {outcomes['ok']:>5} {outcomes['busy']:>5} "
+                  f"{statistics.median(probes) * 1000:>13.1f} {p95 * 1000:>13.1f}")
+    passwords.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--logins", type=int, default=64, help="logins per burst")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    # Set before the app is imported: the engines are built from DATABASE_URL at import
+    directory = tempfile.mkdtemp()
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(directory, 'login_bench.db')}")
+    main()
@@ -0,0 +1,83 @@
+"""
+OCR engine benchmark: per-page latency of each available engine (tesserocr,
+tesseract CLI) and throughput of the worker pool as processes are added.
+
+    python -m apps.api.benchmarks.ocr_bench --pages 24 --workers 1 2 4
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def make_page(index: int):
+    import cv2
+    import numpy as np
+    page = np.full((2338, 1653), 255, np.uint8)
+    for line in range(18):
+        text = f"{line + 1}. Page {index} answer about photosynthesis and ATP {line}"
+        cv2.putText(page, text, (90, 160 + line * 115), cv2.FONT_HERSHEY_SIMPLEX, 1.3, 0, 3)
+    return page
+
+
+def engine_latency(name: str, page, repeat: int):
+    from apps.api.agents.ocr_agent import create_engine
+    try:
+        engine = create_engine(name)
+    except Exception as e:
+        return None, str(e)
+    if engine is None:
+        return None, "no tesseract installed"
+    engine.image_to_string(page) # warm-up (model load for tesserocr)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        engine.image_to_string(page)
+    engine.close()
+    return (time.perf_counter() - start) / repeat, None
+
+
+def _ocr_page(index: int) -> int:
+    from apps.api import workers
+    return len(workers._ocr_agent.extract_text(make_page(index)))
+
+
+def pool_throughput(processes: int, pages: int) -> float:
+    from apps.api import workers
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=workers._init_process,
+        initargs=(os.getpid(),),
+    ) as pool:
+        list(pool.map(_ocr_page, range(processes))) # start and warm every process
+        start = time.perf_counter()
+        list(pool.map(_ocr_page, range(pages)))
+        return pages / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    page = make_page(0)
+    for name in ("tesserocr", "cli"):
+        latency, error = engine_latency(name, page, args.repeat)
+        if latency is None:
+            print(f"{name:10s} unavailable: {error}")
+        else:
+            print(f"{name:10s} {latency * 1000:8.1f} ms/page")
+
+    print(f"pool (OCR_ENGINE={os.getenv('OCR_ENGINE', 'auto')}, {os.cpu_count()} cores):")
+    baseline = None
+    for processes in args.workers:
+        rate = pool_throughput(processes, args.pages)
+        baseline = baseline or rate / processes
+        print(f"  {processes:2d} workers  {rate:7.2f} pages/s  scaling {rate / baseline / processes:4.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Offline load test for the scan pipeline (vision -> OCR -> grading -> save).
+
+Runs synthetic answer sheets through pipeline.process_page against the fake LLM
+backend, in a throwaway working directory, and reports throughput, latency
+percentiles, LLM calls and cache behaviour. No network or API key needed.
+
+    python -m apps.api.benchmarks.pipeline_load --pages 40 --concurrency 8 --latency-ms 800
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+
+def make_page(index: int) -> bytes:
+    import cv2
+    import numpy as np
+    image = np.full((1600, 1200, 3), 70, np.uint8)
+    cv2.rectangle(image, (120, 100), (1080, 1500), (240, 240, 240), -1)
+    for line in range(10):
+        text = f"{line + 1}. Student {index} answer line {line} about photosynthesis"
+        cv2.putText(image, text, (150, 200 + line * 120), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (20, 20, 20), 2)
+    ok, encoded = cv2.imencode(".jpg", image)
+    return encoded.tobytes()
+
+
+def setup_assessment():
+    import json
+    from sqlmodel import Session
+    from apps.api.database import engine, create_db_and_tables
+    from apps.api.models import User, Classroom, Rubric, Assessment
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        teacher = User(email="bench@example.com", hashed_password="!")
+        session.add(teacher)
+        session.commit()
+        classroom = Classroom(name="Bench", subject="Biology", teacher_id=teacher.id)
+        rubric = Rubric(
+            title="Bench rubric",
+            criteria=json.dumps([{"description": "Accuracy", "weight": 70}, {"description": "Clarity", "weight": 30}]),
+            handwriting_weight=10,
+            teacher_id=teacher.id
+        )
+        session.add(classroom)
+        session.add(rubric)
+        session.commit()
+        assessment = Assessment(title="Bench", classroom_id=classroom.id, rubric_id=rubric.id)
+        session.add(assessment)
+        session.commit()
+        return assessment.id
+
+
+async def run_pass(pages, assessment_id: int, concurrency: int):
+    from sqlmodel import Session
+    from apps.api import pipeline
+    from apps.api.database import engine
+
+    with Session(engine) as session:
+        context = pipeline.load_grading_context(session, assessment_id, with_roster=True)
+
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(index: int, contents: bytes):
+        nonlocal failures
+        async with limit:
+            start = time.perf_counter()
+            try:
+                await pipeline.process_page(contents, context, title=f"Bench {index}")
+            except Exception as e:
+                failures += 1
+                print(f"page {index} failed: {e}", file=sys.stderr)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(index, contents) for index, contents in enumerate(pages)])
+    return time.perf_counter() - start, latencies, failures
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8, help="pages in flight")
+    parser.add_argument("--passes", type=int, default=2, help="repeat passes show dedup / cache effects")
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    # Configure before any apps.api import reads the environment
+    os.environ.setdefault("LLM_BACKEND", "fake")
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["FAKE_LLM_LATENCY_SIGMA"] = str(args.latency_sigma)
+    os.environ["FAKE_LLM_ERROR_RATE"] = str(args.error_rate)
+    os.environ.setdefault("LLM_RATE_PER_MINUTE", "100000")
+    os.environ.setdefault("LLM_RATE_BURST", "1000")
+    os.environ.setdefault("LLM_BACKOFF_BASE_SECONDS", "0.05")
+    workdir = tempfile.mkdtemp(prefix="exam-eval-bench-")
+    os.chdir(workdir)
+
+    from apps.api import workers
+    from apps.api.agents.llm_client import llm_client
+    from apps.api.cache import grading_cache
+
+    pages = [make_page(index) for index in range(args.pages)]
+    assessment_id = setup_assessment()
+    print(f"backend={llm_client.backend.name} pages={args.pages} concurrency={args.concurrency} workdir={workdir}")
+
+    async def run():
+        for number in range(args.passes):
+            calls_before = getattr(llm_client.backend, "calls", 0)
+            elapsed, latencies, failures = await run_pass(pages, assessment_id, args.concurrency)
+            print(
+                f"pass {number + 1}: {args.pages / elapsed:.2f} pages/s  total {elapsed:.2f}s  "
+                f"p50 {statistics.median(latencies) * 1000:.0f}ms  p95 {percentile(latencies, 0.95) * 1000:.0f}ms  "
+                f"failed {failures}  llm calls {getattr(llm_client.backend, 'calls', 0) - calls_before}"
+            )
+        print(f"grading cache: {grading_cache.stats()}")
+
+    try:
+        asyncio.run(run())
+    finally:
+        workers.shutdown()
+
+
+if __name__ == "__main__":
+    main()
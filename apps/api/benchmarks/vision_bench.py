@@ -0,0 +1,146 @@
+"""
+Before / after benchmark for VisionAgent.process_image.
+
+Compares the previous full-resolution implementation (kept below as
+legacy_process_image) with the current one on a synthetic phone photo of an
+answer sheet, and reports time per megapixel and peak traced memory. With
+--batch N it also times N pages through process_image one by one against
+VisionAgent.process_batch.
+
+    python -m apps.api.benchmarks.vision_bench --megapixels 12 --repeat 10 --batch 16
+"""
+import argparse
+import math
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from apps.api.agents.vision_agent import VisionAgent
+
+
+def make_photo(megapixels: float, quality: int = 90) -> bytes:
+    """A skewed white page with text lines on a dark desk, JPEG-encoded like a phone camera."""
+    height = int(math.sqrt(megapixels * 1e6 * 3 / 4))
+    width = int(height * 4 / 3)
+    image = np.full((height, width, 3), 60, np.uint8)
+    page = np.array([
+        [width * 0.18, height * 0.06],
+        [width * 0.82, height * 0.09],
+        [width * 0.80, height * 0.95],
+        [width * 0.20, height * 0.92]], dtype=np.int32)
+    cv2.fillPoly(image, [page], (235, 235, 235))
+    scale = height / 1000.0
+    for line in range(24):
+        y = int(height * (0.12 + line * 0.032))
+        cv2.putText(image, f"{line + 1}. The quick brown fox answer {line}", (int(width * 0.24), y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7 * scale, (25, 25, 25), max(1, int(2 * scale)))
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes()
+
+
+def legacy_process_image(agent: VisionAgent, image_bytes: bytes):
+    """process_image as it was before the reduced-resolution pipeline."""
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+
+    ratio = image.shape[0] / 500.0
+    orig = image.copy()
+    image_resized = cv2.resize(image, (int(image.shape[1] / ratio), 500))
+
+    gray = cv2.cvtColor(image_resized, cv2.COLOR_BGR2GRAY)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    edged = cv2.Canny(gray, 75, 200)
+
+    contours, _ = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)[:5]
+
+    screenCnt = None
+    for c in contours:
+        peri = cv2.arcLength(c, True)
+        approx = cv2.approxPolyDP(c, 0.02 * peri, True)
+        if len(approx) == 4:
+            screenCnt = approx
+            break
+
+    if screenCnt is not None:
+        warped = agent.four_point_transform(orig, screenCnt.reshape(4, 2) * ratio)
+    else:
+        warped = orig
+
+    warped_gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+    processed = cv2.adaptiveThreshold(
+        warped_gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
+    )
+    return processed, warped
+
+
+def measure(fn, image_bytes: bytes, repeat: int):
+    fn(image_bytes) # warm-up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        processed, _ = fn(image_bytes)
+        timings.append(time.perf_counter() - start)
+
+    # tracemalloc sees numpy allocations, so this is the pipeline's peak working set
+    tracemalloc.start()
+    fn(image_bytes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sorted(timings)[len(timings) // 2], peak, processed.shape
+
+
+def measure_batch(agent: VisionAgent, pages):
+    start = time.perf_counter()
+    for page in pages:
+        agent.process_image(page)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in agent.process_batch(pages):
+        pass
+    batched = time.perf_counter() - start
+    return sequential, batched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=0, help="pages for the process_batch comparison")
+    parser.add_argument("--dpi", type=int, default=None, help="output DPI (default: VISION_OUTPUT_DPI)")
+    args = parser.parse_args()
+
+    agent = VisionAgent(output_dpi=args.dpi) if args.dpi else VisionAgent()
+    photo = make_photo(args.megapixels)
+    header = cv2.imdecode(np.frombuffer(photo, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    megapixels = header.shape[0] * header.shape[1] * 64 / 1e6
+    print(f"input ~{megapixels:.1f} MP jpeg ({len(photo) / 1e6:.1f} MB), output dpi {agent.output_dpi}")
+
+    rows = [
+        ("legacy", lambda data: legacy_process_image(agent, data)),
+        ("current", agent.process_image),
+    ]
+    baseline = None
+    for name, fn in rows:
+        median, peak, shape = measure(fn, photo, args.repeat)
+        baseline = baseline or median
+        print(
+            f"{name:8s} {median * 1000:8.1f} ms/page  {median * 1000 / megapixels:6.1f} ms/MP  "
+            f"peak {peak / 1e6:7.1f} MB  output {shape[1]}x{shape[0]}  speedup {baseline / median:4.1f}x"
+        )
+
+    if args.batch:
+        sequential, batched = measure_batch(agent, [photo] * args.batch)
+        print(
+            f"batch of {args.batch}: process_image {sequential * 1000 / args.batch:.1f} ms/page  "
+            f"process_batch {batched * 1000 / args.batch:.1f} ms/page  speedup {sequential / batched:4.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Persistent result caches (SQLite table + in-process LRU).
+
+Entries are content addressed: the key is a hash of everything that can change
+the answer, so editing a rubric or reference simply stops matching the old
+entries, which then age out through TTL / size eviction. Rubric edits and
+deletes through the ORM drop their grading entries right away by tag
+(compiled_rubrics.py).
+
+Configuration (env):
+    RESULT_CACHE_DB              SQLite file for all caches (default: result_cache.db)
+    GRADING_CACHE_ENABLED        set to 0 to disable grading cache (default: 1)
+    GRADING_CACHE_TTL_SECONDS    entry lifetime (default: 7 days)
+    GRADING_CACHE_MAX_ENTRIES    rows kept on disk before LRU eviction (default: 50000)
+    GRADING_CACHE_LRU_SIZE       entries kept in memory (default: 1024)
+    RUBRIC_GEN_CACHE_ENABLED     set to 0 to disable the rubric generation cache (default: 1)
+    RUBRIC_GEN_CACHE_TTL_SECONDS entry lifetime (default: 30 days)
+    RUBRIC_GEN_CACHE_MAX_ENTRIES rows kept on disk before LRU eviction (default: 5000)
+    RUBRIC_GEN_CACHE_LRU_SIZE    entries kept in memory (default: 256)
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+CACHE_DB = os.getenv("RESULT_CACHE_DB", "result_cache.db")
+
+
+class ResultCache:
+    """
+    Thread-safe key -> JSON value cache backed by one SQLite table, fronted by an LRU.
+    Code on the event loop uses the *_async methods, which keep SQLite off the loop.
+    """
+    PRUNE_EVERY = 100
+
+    def __init__(self, table: str, path: str = CACHE_DB, ttl_seconds: int = 7 * 24 * 3600,
+                 max_entries: int = 50000, lru_size: int = 1024, enabled: bool = True):
+        self.table = table
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lru_size = lru_size
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._puts = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                " key TEXT PRIMARY KEY,"
+                " tag TEXT,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{self.table}_accessed ON {self.table} (accessed_at)")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{self.table}_tag ON {self.table} (tag)")
+        return self._conn
+
+    def _from_memory(self, key: str, now: float) -> Optional[Any]:
+        # Caller holds the lock
+        entry = self._lru.get(key)
+        if entry is None or now - entry[1] >= self.ttl_seconds:
+            return None
+        self._lru.move_to_end(key)
+        self.hits += 1
+        return json.loads(entry[0])
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            value = self._from_memory(key, now)
+            if value is not None:
+                return value
+
+            row = self._db().execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] >= self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._db().execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            self._remember(key, row[0], row[1])
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, value: Any, tag: Optional[str] = None):
+        if not self.enabled:
+            return
+        now = time.time()
+        encoded = json.dumps(value)
+        with self._lock:
+            self._db().execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, tag, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, tag, encoded, now, now)
+            )
+            self._remember(key, encoded, now)
+            self._puts += 1
+            if self._puts % self.PRUNE_EVERY == 0:
+                self._prune(now)
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        """get() for the event loop: memory hits answer inline, SQLite is read in a thread."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._from_memory(key, time.time())
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self.get, key)
+
+    async def get_many_async(self, keys: List[str]) -> List[Optional[Any]]:
+        """get() for several keys; whatever is not in memory is read in one thread hop."""
+        if not self.enabled:
+            return [None] * len(keys)
+        with self._lock:
+            now = time.time()
+            values = [self._from_memory(key, now) for key in keys]
+        missing = [index for index, value in enumerate(values) if value is None]
+        if missing:
+            loaded = await asyncio.to_thread(lambda: [self.get(keys[index]) for index in missing])
+            for index, value in zip(missing, loaded):
+                values[index] = value
+        return values
+
+    async def put_async(self, key: str, value: Any, tag: Optional[str] = None):
+        """put() for the event loop: the SQLite write runs in a thread."""
+        if self.enabled:
+            await asyncio.to_thread(self.put, key, value, tag)
+
+    def invalidate_tag(self, tag: str) -> int:
+        """Drops every entry stored with this tag (e.g. all results for one rubric)."""
+        with self._lock:
+            keys = [row[0] for row in self._db().execute(f"SELECT key FROM {self.table} WHERE tag = ?", (tag,))]
+            self._db().execute(f"DELETE FROM {self.table} WHERE tag = ?", (tag,))
+            for key in keys:
+                self._lru.pop(key, None)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._db().execute(f"DELETE FROM {self.table}")
+            self._lru.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = self._db().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] if self.enabled else 0
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": size,
+                "memory_entries": len(self._lru),
+            }
+
+    def _remember(self, key: str, encoded: str, created_at: float):
+        self._lru[key] = (encoded, created_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _prune(self, now: float):
+        db = self._db()
+        expired = db.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        overflow = db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            db.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)", (overflow,)
+            )
+        self.evictions += expired + max(overflow, 0)
+
+
+def _digest(parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def normalize_text(text: Optional[str]) -> str:
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def rubric_tag(rubric: Dict[str, Any]) -> str:
+    """Stable hash of the parts of a rubric that affect grading."""
+    criteria = rubric.get("criteria", [])
+    if isinstance(criteria, str):
+        try:
+            criteria = json.loads(criteria)
+        except ValueError:
+            pass
+    return _digest([criteria, float(rubric.get("handwriting_weight", 0) or 0)])
+
+
+def grading_key(student_response: str, rubric: Any, reference_context: Optional[str], model_name: str) -> str:
+    """rubric: a rubric dict, or a CompiledRubric whose tag is already computed."""
+    return _digest([
+        normalize_text(student_response),
+        rubric_tag(rubric) if isinstance(rubric, dict) else rubric.tag,
+        normalize_text(reference_context),
+        model_name,
+    ])
+
+
+def rubric_generation_key(answer_text: str, model_name: str) -> str:
+    return _digest([normalize_text(answer_text), model_name])
+
+
+grading_cache = ResultCache(
+    "grading_cache",
+    ttl_seconds=int(os.getenv("GRADING_CACHE_TTL_SECONDS", 7 * 24 * 3600)),
+    max_entries=int(os.getenv("GRADING_CACHE_MAX_ENTRIES", 50000)),
+    lru_size=int(os.getenv("GRADING_CACHE_LRU_SIZE", 1024)),
+    enabled=os.getenv("GRADING_CACHE_ENABLED", "1") != "0",
+)
+
+rubric_generation_cache = ResultCache(
+    "rubric_generation_cache",
+    ttl_seconds=int(os.getenv("RUBRIC_GEN_CACHE_TTL_SECONDS", 30 * 24 * 3600)),
+    max_entries=int(os.getenv("RUBRIC_GEN_CACHE_MAX_ENTRIES", 5000)),
+    lru_size=int(os.getenv("RUBRIC_GEN_CACHE_LRU_SIZE", 256)),
+    enabled=os.getenv("RUBRIC_GEN_CACHE_ENABLED", "1") != "0",
+)
@@ -0,0 +1,184 @@
+"""
+Rubrics compiled once for grading.
+
+Rubric.criteria is stored as a JSON string. Grading used to json.loads it and
+re-render the criteria lines of the prompt for every submission; now a rubric
+is parsed once into an immutable CompiledRubric holding the rendered prompt
+fragment and the grading-cache tag, and kept in an in-process LRU keyed by
+(rubric id, version). The version is a digest of the stored fields, so a
+rubric row that changes simply compiles to a new entry; updates and deletes
+through the ORM also drop the old entries right away, together with the
+grading results cached under the rubric's old tag.
+
+Ad-hoc rubric dicts (POST /evaluate) compile the same way, keyed by their
+content, so every grading entry point works on CompiledRubric.
+
+Configuration (env):
+    RUBRIC_CACHE_SIZE   compiled rubrics kept in memory (default: 256)
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple, Union
+
+from sqlalchemy import event, inspect
+
+from apps.api.cache import grading_cache, rubric_tag
+from apps.api.models import Rubric
+
+RUBRIC_CACHE_SIZE = int(os.getenv("RUBRIC_CACHE_SIZE", 256))
+
+
+@dataclass(frozen=True)
+class Criterion:
+    description: str
+    weight: float
+
+
+@dataclass(frozen=True)
+class CompiledRubric:
+    id: Optional[int]
+    version: str
+    title: str
+    criteria: Tuple[Criterion, ...]
+    handwriting_weight: float
+    criteria_text: str # the "Rubric Criteria" lines of the grading prompt
+    tag: str # cache.rubric_tag of the rubric: part of every grading cache key
+
+    @property
+    def key(self) -> Tuple[Optional[int], str]:
+        return (self.id, self.version)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "title": self.title,
+            "criteria": [{"description": c.description, "weight": c.weight} for c in self.criteria],
+            "handwriting_weight": self.handwriting_weight,
+        }
+
+
+def _version(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _parse_criteria(criteria: Any) -> list:
+    # Stored rubrics carry criteria as a JSON string; entries that are not
+    # objects ({"description", "weight"}) are skipped
+    if isinstance(criteria, str):
+        try:
+            criteria = json.loads(criteria)
+        except ValueError:
+            criteria = []
+    return [c for c in criteria if isinstance(c, dict)] if isinstance(criteria, list) else []
+
+
+def _tag(criteria: list, handwriting_weight: float) -> str:
+    return rubric_tag({"criteria": criteria, "handwriting_weight": handwriting_weight})
+
+
+def _build(rubric_id: Optional[int], version: str, title: str, criteria: Any, handwriting_weight: Any) -> CompiledRubric:
+    parsed = _parse_criteria(criteria)
+    handwriting_weight = float(handwriting_weight or 0)
+    return CompiledRubric(
+        id=rubric_id,
+        version=version,
+        title=title or "",
+        criteria=tuple(Criterion(str(c.get("description", "Criterion")), float(c.get("weight", 0) or 0)) for c in parsed),
+        handwriting_weight=handwriting_weight,
+        criteria_text="\n".join(f"- {c.get('description', 'Criterion')} (Weight: {c.get('weight', 0)}%)" for c in parsed),
+        tag=_tag(parsed, handwriting_weight),
+    )
+
+
+class RubricCache:
+    """Thread-safe LRU of (rubric id, version) -> CompiledRubric."""
+
+    def __init__(self, size: int = RUBRIC_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[Optional[int], str], CompiledRubric]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compile(self, key: Tuple[Optional[int], str], build) -> CompiledRubric:
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+        compiled = build()
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def invalidate(self, rubric_id: int):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == rubric_id]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+rubric_cache = RubricCache()
+
+
+def compile_rubric(rubric: Union[Rubric, Dict[str, Any], CompiledRubric]) -> CompiledRubric:
+    """
+    Returns the compiled form of a Rubric row or a rubric dict
+    ({"title", "criteria": list or JSON string, "handwriting_weight"}).
+    Already compiled rubrics are returned unchanged.
+    """
+    if isinstance(rubric, CompiledRubric):
+        return rubric
+    if isinstance(rubric, Rubric):
+        version = _version(rubric.title, rubric.criteria, rubric.handwriting_weight)
+        return rubric_cache.get_or_compile(
+            (rubric.id, version),
+            lambda: _build(rubric.id, version, rubric.title, rubric.criteria, rubric.handwriting_weight),
+        )
+    version = _version(rubric.get("title"), rubric.get("criteria", []), rubric.get("handwriting_weight", 0))
+    return rubric_cache.get_or_compile(
+        (None, version),
+        lambda: _build(None, version, rubric.get("title"), rubric.get("criteria", []), rubric.get("handwriting_weight", 0)),
+    )
+
+
+@event.listens_for(Rubric, "after_update")
+@event.listens_for(Rubric, "after_delete")
+def _invalidate_compiled_rubric(mapper, connection, target):
+    rubric_cache.invalidate(target.id)
+
+
+def _stored_tag(target: Rubric) -> str:
+    """Grading-cache tag of the rubric as it was before the pending flush."""
+    state = inspect(target)
+
+    def stored(name: str):
+        history = state.attrs[name].history
+        return history.deleted[0] if history.deleted else getattr(target, name)
+
+    return _tag(_parse_criteria(stored("criteria")), float(stored("handwriting_weight") or 0))
+
+
+@event.listens_for(Rubric, "after_update")
+def _invalidate_graded_on_update(mapper, connection, target):
+    # A title-only edit keeps the tag and its grades. Rubrics with identical
+    # criteria share a tag, so their entries go too and are simply regraded.
+    tag = _stored_tag(target)
+    if tag != _tag(_parse_criteria(target.criteria), float(target.handwriting_weight or 0)):
+        grading_cache.invalidate_tag(tag)
+
+
+@event.listens_for(Rubric, "after_delete")
+def _invalidate_graded_on_delete(mapper, connection, target):
+    grading_cache.invalidate_tag(_stored_tag(target))
@@ -1,9 +1,141 @@
+"""
+Database engine and sessions.
+
+The engine is built from the environment by create_engine_from_env(). SQLite
+(the default) runs in WAL mode with synchronous=NORMAL, so readers never block
+on the scan writers and commits do not fsync the main file. A busy_timeout
+makes writers queue for the lock instead of failing with "database is locked".
+Postgres gets a sized pool with pre-ping, so connections dropped by the server
+or a proxy are replaced transparently.
+
+The routers use the async engine (get_async_session), driven by aiosqlite or
+asyncpg (install it for Postgres) for the same DATABASE_URL, so request
+handlers never block the event loop on database I/O. Background work (job
+runners, pipeline, re-grades) keeps the sync engine; helpers written for a
+sync Session run on an async one through AsyncSession.run_sync.
+
+Configuration (env):
+    DATABASE_URL             SQLAlchemy URL (default: sqlite:///database.db)
+    DB_POOL_SIZE             connections kept open (default: 5 for SQLite, 10 for Postgres)
+    DB_MAX_OVERFLOW          extra connections under load (default: 10 for SQLite, 20 for Postgres)
+    DB_POOL_TIMEOUT          seconds to wait for a free connection (default: 30)
+    DB_POOL_RECYCLE          reconnect connections older than this, in seconds (default: 1800)
+    DB_ECHO                  log SQL (default: 0)
+    SQLITE_BUSY_TIMEOUT_MS   wait for the write lock this long (default: 15000)
+    SQLITE_CACHE_SIZE_KB     page cache per connection (default: 65536)
+    SQLITE_MMAP_SIZE         bytes of the file to memory-map (default: 268435456)
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///database.db")
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+ECHO = os.getenv("DB_ECHO", "0") == "1"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 15000))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 65536))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+
+
+def _pool_setting(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL") # durable in WAL mode except on power loss
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
 
-sqlite_file_name = "database.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
+def async_url(url: str) -> str:
+    """The same database through its asyncio driver (aiosqlite / asyncpg)."""
+    parsed = make_url(url)
+    drivers = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+    driver = drivers.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for '{parsed.get_backend_name()}' databases")
+    return parsed.set(drivername=f"{parsed.get_backend_name()}+{driver}").render_as_string(hide_password=False)
 
-engine = create_engine(sqlite_url, connect_args={"check_same_thread": False})
+
+def create_engine_from_env(url: str = DATABASE_URL) -> Engine:
+    """Engine for the given URL with the pool and connection settings suited to its backend."""
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        memory = make_url(url).database in (None, "", ":memory:")
+        options = {
+            "connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        }
+        if memory:
+            # One shared connection, or every checkout would see a different empty database
+            options["poolclass"] = StaticPool
+        else:
+            options.update(
+                pool_size=_pool_setting("DB_POOL_SIZE", 5),
+                max_overflow=_pool_setting("DB_MAX_OVERFLOW", 10),
+                pool_timeout=POOL_TIMEOUT,
+            )
+        engine = create_engine(url, echo=ECHO, **options)
+        if not memory:
+            event.listen(engine, "connect", _set_sqlite_pragmas)
+        return engine
+
+    options = {
+        "pool_size": _pool_setting("DB_POOL_SIZE", 10),
+        "max_overflow": _pool_setting("DB_MAX_OVERFLOW", 20),
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+    if backend == "postgresql":
+        options["connect_args"] = {"application_name": "exam-evaluator-api"}
+    return create_engine(url, echo=ECHO, **options)
+
+
+def create_async_engine_from_env(url: str = DATABASE_URL) -> AsyncEngine:
+    """Async counterpart of create_engine_from_env, with the same pool and pragma settings."""
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        memory = make_url(url).database in (None, "", ":memory:")
+        options = {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+        if memory:
+            options["poolclass"] = StaticPool
+        else:
+            options.update(
+                poolclass=AsyncAdaptedQueuePool,
+                pool_size=_pool_setting("DB_POOL_SIZE", 5),
+                max_overflow=_pool_setting("DB_MAX_OVERFLOW", 10),
+                pool_timeout=POOL_TIMEOUT,
+            )
+        async_engine = create_async_engine(async_url(url), echo=ECHO, **options)
+        if not memory:
+            event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        return async_engine
+
+    options = {
+        "pool_size": _pool_setting("DB_POOL_SIZE", 10),
+        "max_overflow": _pool_setting("DB_MAX_OVERFLOW", 20),
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+    if backend == "postgresql":
+        options["connect_args"] = {"server_settings": {"application_name": "exam-evaluator-api"}}
+    return create_async_engine(async_url(url), echo=ECHO, **options)
+
+
+engine = create_engine_from_env()
+async_engine = create_async_engine_from_env()
 
 
 def create_db_and_tables():
@@ -13,3 +145,9 @@ def create_db_and_tables():
 def get_session():
     with Session(engine) as session:
         yield session
+
+
+async def get_async_session():
+    # Objects stay usable after commit; reloading expired attributes needs an explicit await
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
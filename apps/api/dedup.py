@@ -0,0 +1,102 @@
+"""
+Duplicate scan detection.
+
+Every processed page is recorded with the sha256 of its bytes and a perceptual
+hash. A re-upload (slow-connection retry, iOS resubmit, re-encoded copy) to the
+same assessment is matched against that index and reuses the stored warped
+image (a storage key, see storage.py) and OCR text instead of running vision
+and Tesseract again; the grade then comes from the grading cache.
+
+Only an exact byte match is trusted on its own. Exam pages share their printed
+layout, so pages with different handwriting are often only a few dHash bits
+apart: the perceptual hash merely shortlists candidates, and each one has to
+pass a pixel-level comparison with the stored original
+(VisionAgent.page_difference) before it counts as the same page. Matches never
+cross assessments.
+
+Configuration (env):
+    DEDUP_ENABLED               set to 0 to always reprocess (default: 1)
+    DEDUP_PHASH_MAX_DISTANCE    max differing dHash bits for a candidate (default: 4)
+    DEDUP_PHASH_SCAN_LIMIT      recent fingerprints of the assessment compared by phash (default: 2000)
+    DEDUP_PIXEL_CANDIDATES      closest candidates checked pixel by pixel (default: 3)
+    DEDUP_PIXEL_MAX_DIFF        max VisionAgent.page_difference for a match (default: 6)
+    DEDUP_LINK_EXISTING         default for linking duplicates to the existing exam (default: 0)
+"""
+import os
+from typing import List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from apps.api.models import ScanFingerprint, ScanImage
+
+ENABLED = os.getenv("DEDUP_ENABLED", "1") != "0"
+PHASH_MAX_DISTANCE = int(os.getenv("DEDUP_PHASH_MAX_DISTANCE", 4))
+PHASH_SCAN_LIMIT = int(os.getenv("DEDUP_PHASH_SCAN_LIMIT", 2000))
+PIXEL_CANDIDATES = int(os.getenv("DEDUP_PIXEL_CANDIDATES", 3))
+PIXEL_MAX_DIFF = float(os.getenv("DEDUP_PIXEL_MAX_DIFF", 6))
+LINK_EXISTING = os.getenv("DEDUP_LINK_EXISTING", "0") == "1"
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+def _same_assessment(assessment_id: Optional[int]):
+    if assessment_id is None:
+        return ScanFingerprint.assessment_id.is_(None)
+    return ScanFingerprint.assessment_id == assessment_id
+
+
+def find_exact(session: Session, sha256: str, assessment_id: Optional[int]) -> Optional[ScanFingerprint]:
+    """The latest scan of the same assessment with identical bytes."""
+    if not ENABLED:
+        return None
+    return session.exec(
+        select(ScanFingerprint)
+        .where(ScanFingerprint.sha256 == sha256, _same_assessment(assessment_id))
+        .order_by(ScanFingerprint.id.desc())
+    ).first()
+
+
+def near_candidates(session: Session, phash: int, assessment_id: Optional[int]) -> List[Tuple[int, str]]:
+    """
+    Shortlist for the pixel check: (fingerprint id, storage key of its original upload)
+    for the closest perceptual hashes of the same assessment, nearest first.
+    """
+    if not ENABLED or PIXEL_CANDIDATES <= 0:
+        return []
+    rows = session.exec(
+        select(ScanFingerprint.id, ScanFingerprint.phash, ScanFingerprint.exam_id)
+        .where(_same_assessment(assessment_id))
+        .order_by(ScanFingerprint.id.desc())
+        .limit(PHASH_SCAN_LIMIT)
+    ).all()
+    close = []
+    for fingerprint_id, candidate_phash, exam_id in rows:
+        distance = hamming_distance(candidate_phash, phash)
+        if exam_id is not None and distance <= PHASH_MAX_DISTANCE:
+            close.append((distance, -fingerprint_id, exam_id))
+    close = sorted(close)[:PIXEL_CANDIDATES]
+    if not close:
+        return []
+    originals = dict(session.exec(
+        select(ScanImage.exam_id, ScanImage.key)
+        .where(ScanImage.exam_id.in_([exam_id for _, _, exam_id in close]), ScanImage.kind == "original")
+    ).all())
+    return [(-negative_id, originals[exam_id]) for _, negative_id, exam_id in close if exam_id in originals]
+
+
+def record(session: Session, sha256: str, phash: int, assessment_id: Optional[int], exam_id: Optional[int],
+           warped_path: Optional[str], ocr_raw: Optional[str], ocr_content: Optional[str]) -> ScanFingerprint:
+    fingerprint = ScanFingerprint(
+        sha256=sha256,
+        phash=phash,
+        assessment_id=assessment_id,
+        exam_id=exam_id,
+        warped_path=warped_path,
+        ocr_raw=ocr_raw,
+        ocr_content=ocr_content
+    )
+    # Committed by the caller together with the Exam row
+    session.add(fingerprint)
+    return fingerprint
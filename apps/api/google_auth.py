@@ -0,0 +1,191 @@
+"""
+Google ID-token verification with cached signing certificates.
+
+google.oauth2.id_token.verify_oauth2_token downloads Google's certificates on
+every call. Here they are fetched through one pooled requests.Session, kept for
+the Cache-Control max-age Google sends (hours), and refreshed in the background
+shortly before they expire, so a sign-in is only a local signature check. A
+token signed with a key id the cache does not know (Google rotated early)
+triggers one refresh, at most once per GOOGLE_CERTS_MIN_REFRESH_SECONDS.
+
+For tests and offline development GOOGLE_CERTS_FILE points at a local key set
+in the format of Google's endpoint ({"<kid>": "-----BEGIN CERTIFICATE-----..."}),
+used instead of fetching; make_stand_in_keys() writes one and returns a signer
+for minting matching tokens.
+
+Configuration (env):
+    GOOGLE_CLIENT_ID                  expected audience; unset skips the audience check
+    GOOGLE_CERTS_URL                  (default: https://www.googleapis.com/oauth2/v1/certs)
+    GOOGLE_CERTS_FILE                 local stand-in key set; disables fetching
+    GOOGLE_CERTS_DEFAULT_MAX_AGE      seconds to keep certs sent without max-age (default: 3600)
+    GOOGLE_CERTS_REFRESH_MARGIN       refresh this long before expiry, in seconds (default: 300)
+    GOOGLE_CERTS_MIN_REFRESH_SECONDS  minimum gap between unknown-key refreshes (default: 60)
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import requests
+from google.auth import exceptions, jwt
+from requests.adapters import HTTPAdapter
+
+CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID") or None
+CERTS_URL = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs")
+CERTS_FILE = os.getenv("GOOGLE_CERTS_FILE") or None
+DEFAULT_MAX_AGE = int(os.getenv("GOOGLE_CERTS_DEFAULT_MAX_AGE", 3600))
+REFRESH_MARGIN = int(os.getenv("GOOGLE_CERTS_REFRESH_MARGIN", 300))
+MIN_REFRESH_SECONDS = int(os.getenv("GOOGLE_CERTS_MIN_REFRESH_SECONDS", 60))
+CLOCK_SKEW_SECONDS = 10
+FETCH_TIMEOUT_SECONDS = 10
+
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+_refresher: Optional[asyncio.Task] = None
+
+
+def max_age_from(cache_control: Optional[str], default: int = DEFAULT_MAX_AGE) -> int:
+    match = MAX_AGE_PATTERN.search(cache_control or "")
+    return int(match.group(1)) if match else default
+
+
+def _pooled_session() -> requests.Session:
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    return session
+
+
+class CertCache:
+    """Google's signing certificates (kid -> PEM), kept until their max-age runs out."""
+
+    def __init__(self, url: str = CERTS_URL, path: Optional[str] = CERTS_FILE):
+        self.url = url
+        self.path = path
+        self.certs: Dict[str, str] = {}
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+        self.fetches = 0
+        self._session: Optional[requests.Session] = None
+        self._lock = threading.Lock()
+
+    def _fetch(self) -> Tuple[Dict[str, str], float]:
+        if self.path:
+            with open(self.path) as f:
+                return json.load(f), float("inf")
+        if self._session is None:
+            self._session = _pooled_session()
+        response = self._session.get(self.url, timeout=FETCH_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return response.json(), max_age_from(response.headers.get("Cache-Control"))
+
+    def refresh(self, if_older_than: float = 0.0):
+        """Fetches the certs now (blocking). Skipped if another caller just did."""
+        with self._lock:
+            if self.certs and time.time() - self.fetched_at < if_older_than:
+                return
+            certs, max_age = self._fetch()
+            self.certs = certs
+            self.fetched_at = time.time()
+            self.expires_at = self.fetched_at + max_age
+            self.fetches += 1
+
+    def needs_refresh(self, kid: Optional[str]) -> bool:
+        if not self.certs or time.time() >= self.expires_at:
+            return True
+        return kid not in self.certs and time.time() - self.fetched_at >= MIN_REFRESH_SECONDS
+
+    def ensure(self, kid: Optional[str] = None):
+        """Blocking: makes sure the certs are current and, if possible, include kid."""
+        if not self.certs or time.time() >= self.expires_at:
+            self.refresh(if_older_than=1.0)
+        elif kid not in self.certs:
+            self.refresh(if_older_than=MIN_REFRESH_SECONDS)
+
+    def verify(self, token: str, audience: Optional[str] = CLIENT_ID) -> Mapping[str, Any]:
+        """Checks signature, expiry, audience and issuer against the cached certs (no I/O)."""
+        claims = jwt.decode(token, certs=self.certs, audience=audience, clock_skew_in_seconds=CLOCK_SKEW_SECONDS)
+        if claims.get("iss") not in GOOGLE_ISSUERS:
+            raise exceptions.GoogleAuthError(f"Wrong issuer '{claims.get('iss')}'")
+        return claims
+
+    async def run_refresher(self):
+        """Keeps the certs fresh once Google sign-in has been used in this process."""
+        while True:
+            delay = self.expires_at - REFRESH_MARGIN - time.time() if self.certs else MIN_REFRESH_SECONDS
+            await asyncio.sleep(max(delay, 1.0))
+            if not self.certs or self.path:
+                continue
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                # The current certs stay in use until they expire; retry soon
+                print(f"Warning: refreshing Google certificates failed ({e}); retrying.")
+                await asyncio.sleep(MIN_REFRESH_SECONDS)
+
+
+cert_cache = CertCache()
+
+
+async def verify_id_token(token: str, audience: Optional[str] = CLIENT_ID) -> Mapping[str, Any]:
+    """
+    Verifies a Google ID token. Only fetches (in a thread) when the cache is empty,
+    expired, or lacks the token's key. Raises ValueError / GoogleAuthError if invalid.
+    """
+    try:
+        kid = jwt.decode_header(token).get("kid")
+    except Exception as e:
+        raise ValueError(f"Malformed token: {e}")
+    if cert_cache.needs_refresh(kid):
+        await asyncio.to_thread(cert_cache.ensure, kid)
+    return cert_cache.verify(token, audience)
+
+
+def start_refresher():
+    global _refresher
+    if _refresher is None:
+        _refresher = asyncio.create_task(cert_cache.run_refresher())
+
+
+async def stop_refresher():
+    global _refresher
+    if _refresher is not None:
+        _refresher.cancel()
+        await asyncio.gather(_refresher, return_exceptions=True)
+        _refresher = None
+
+
+def make_stand_in_keys(path: str, kid: str = "local-stand-in"):
+    """
+    Writes a local key set (one self-signed RSA certificate) for GOOGLE_CERTS_FILE and
+    returns a google.auth.crypt signer whose tokens it accepts:
+    jwt.encode(signer, {"iss": "https://accounts.google.com", "email": ..., ...}).
+    """
+    from datetime import datetime, timedelta
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+    from google.auth import crypt
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, kid)])
+    now = datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+    with open(path, "w") as f:
+        json.dump({kid: certificate.public_bytes(serialization.Encoding.PEM).decode()}, f)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    return crypt.RSASigner.from_string(private_pem, key_id=kid)
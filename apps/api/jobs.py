@@ -0,0 +1,273 @@
+"""
+Durable scan job queue.
+
+Uploads are streamed into scan storage (storage.py) and recorded as ScanJob
+rows, then drained by background runners on the event loop. Claiming a job is
+a conditional UPDATE, so several uvicorn workers can share one database
+without double-processing, and a job whose lease expired (crash, restart) is
+picked up again. Bulk re-grades of an assessment (regrade.py) run on the same
+queue as jobs of kind "regrade".
+
+Configuration (env):
+    SCAN_JOB_RUNNERS        runners per process (default: 4)
+    SCAN_JOB_POLL_SECONDS   idle poll interval (default: 1.0)
+    SCAN_JOB_LEASE_SECONDS  running jobs older than this are reclaimed (default: 600)
+    SCAN_JOB_MAX_ATTEMPTS   attempts before a job is marked failed (default: 3)
+"""
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import or_, union_all, update
+from sqlmodel import Session, select
+
+from apps.api import pipeline, regrade, storage
+from apps.api.database import engine
+from apps.api.models import ScanJob
+
+RUNNERS = int(os.getenv("SCAN_JOB_RUNNERS", 4))
+POLL_SECONDS = float(os.getenv("SCAN_JOB_POLL_SECONDS", 1.0))
+LEASE_SECONDS = int(os.getenv("SCAN_JOB_LEASE_SECONDS", 600))
+MAX_ATTEMPTS = int(os.getenv("SCAN_JOB_MAX_ATTEMPTS", 3))
+
+_tasks: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+
+
+def enqueue_scan(session: Session, upload: storage.StoredObject, assessment_id: Optional[int] = None,
+                 student_id: Optional[int] = None, link_duplicates: bool = False) -> ScanJob:
+    """
+    Queues an upload that is already in storage. Returns immediately.
+    """
+    job = ScanJob(
+        id=str(uuid.uuid4()),
+        payload_path=upload.key,
+        assessment_id=assessment_id,
+        student_id=student_id,
+        link_duplicates=link_duplicates
+    )
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    notify()
+    return job
+
+
+def enqueue_regrade(session: Session, assessment_id: int) -> ScanJob:
+    """
+    Queues a re-grade of every exam in an assessment. A re-grade that is still queued
+    is reused: it reads the current rubric and reference when it starts.
+    """
+    pending = session.exec(
+        select(ScanJob).where(
+            ScanJob.kind == "regrade",
+            ScanJob.assessment_id == assessment_id,
+            ScanJob.status == "queued"
+        )
+    ).first()
+    if pending:
+        return pending
+
+    job = ScanJob(id=str(uuid.uuid4()), kind="regrade", assessment_id=assessment_id)
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    notify()
+    return job
+
+
+def notify():
+    """Wakes an idle runner in this process so new jobs start without waiting for the poll."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def runnable_filter(now: datetime):
+    """Queued jobs, and running jobs whose lease expired."""
+    stale = now - timedelta(seconds=LEASE_SECONDS)
+    return or_(
+        ScanJob.status == "queued",
+        (ScanJob.status == "running") & (ScanJob.updated_at < stale)
+    )
+
+
+def claim_candidates_query(now: datetime, limit: int = 5):
+    """
+    Oldest runnable jobs. One branch per status, so each reads the (status, created_at)
+    index in order and SQLite merges the two instead of sorting the unfinished jobs.
+    """
+    stale = now - timedelta(seconds=LEASE_SECONDS)
+    return union_all(
+        select(ScanJob.id, ScanJob.created_at).where(ScanJob.status == "queued"),
+        select(ScanJob.id, ScanJob.created_at).where(ScanJob.status == "running", ScanJob.updated_at < stale),
+    ).order_by("created_at").limit(limit)
+
+
+def claim_next_job() -> Optional[ScanJob]:
+    """
+    Atomically moves the oldest runnable job to 'running'. Safe across processes.
+    """
+    now = datetime.utcnow()
+    runnable = runnable_filter(now)
+    with Session(engine) as session:
+        candidates = [job_id for job_id, _ in session.execute(claim_candidates_query(now)).all()]
+        for job_id in candidates:
+            claimed = session.exec(
+                update(ScanJob)
+                .where(ScanJob.id == job_id, runnable)
+                .values(status="running", updated_at=now, attempts=ScanJob.attempts + 1)
+            )
+            session.commit()
+            if claimed.rowcount == 1:
+                return session.get(ScanJob, job_id)
+    return None
+
+
+def update_job(job_id: str, **values):
+    values["updated_at"] = datetime.utcnow()
+    with Session(engine) as session:
+        session.exec(update(ScanJob).where(ScanJob.id == job_id).values(**values))
+        session.commit()
+
+
+class ProgressWriter:
+    """
+    Progress callback for a running job. Updates are written in a thread, one at a time;
+    while a write is in flight newer updates replace each other, so a fast pipeline
+    never queues up database writes (or blocks the event loop on SQLite locks).
+    """
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.latest: Optional[Dict[str, Any]] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def __call__(self, stage: str, progress: float):
+        self.latest = {"stage": stage, "progress": progress}
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._write())
+
+    async def _write(self):
+        while self.latest is not None:
+            values, self.latest = self.latest, None
+            try:
+                await asyncio.to_thread(update_job, self.job_id, **values)
+            except Exception as e:
+                print(f"Warning: progress update for job {self.job_id} failed ({e}).")
+
+    async def close(self):
+        """Waits for the last progress write, so it cannot land after the final status."""
+        self.latest = None
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+
+
+async def process_scan_job(job: ScanJob, reporter: ProgressWriter) -> Dict[str, Any]:
+    """
+    Runs the stored upload through the pipeline, reporting progress on the job row.
+    """
+    original = await asyncio.to_thread(storage.store.head, job.payload_path)
+    if original is None:
+        raise FileNotFoundError(f"Upload {job.payload_path} is missing from storage")
+    contents = await asyncio.to_thread(storage.store.read_bytes, original.key)
+
+    context = await asyncio.to_thread(pipeline.load_context, job.assessment_id)
+
+    return await pipeline.process_page(
+        contents,
+        context,
+        student_id=job.student_id,
+        title=f"Scan {job.id[:8]}",
+        link_duplicates=job.link_duplicates,
+        original=original,
+        on_stage=reporter
+    )
+
+
+async def process_regrade_job(job: ScanJob, reporter: ProgressWriter) -> Dict[str, Any]:
+    reporter("grading", 0.0)
+    return await regrade.regrade_assessment(
+        job.assessment_id,
+        on_progress=lambda fraction: reporter("grading", fraction)
+    )
+
+
+async def _run_job(job: ScanJob):
+    reporter = ProgressWriter(job.id)
+    try:
+        if job.kind == "regrade":
+            result = await process_regrade_job(job, reporter)
+        else:
+            result = await process_scan_job(job, reporter)
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back instead of waiting for the lease to expire
+        await reporter.close()
+        await asyncio.to_thread(update_job, job.id, status="queued", stage=None, progress=0.0)
+        raise
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        await reporter.close()
+        if job.attempts >= MAX_ATTEMPTS:
+            await asyncio.to_thread(update_job, job.id, status="failed", error=str(e))
+        else:
+            await asyncio.to_thread(update_job, job.id, status="queued", stage=None, progress=0.0, error=str(e))
+        return
+
+    await reporter.close()
+    await asyncio.to_thread(
+        update_job,
+        job.id,
+        status="done",
+        stage=None,
+        progress=1.0,
+        exam_id=result.get("exam_id"),
+        result=json.dumps(result),
+        error=None
+    )
+
+
+async def _runner_loop():
+    while True:
+        job = await asyncio.to_thread(claim_next_job)
+        if job is None:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await _run_job(job)
+
+
+def start_runners(count: int = RUNNERS):
+    global _wakeup
+    _wakeup = asyncio.Event()
+    for _ in range(count):
+        _tasks.append(asyncio.create_task(_runner_loop()))
+
+
+async def stop_runners():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+
+def job_status(job: ScanJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "submission_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "attempts": job.attempts,
+        "exam_id": job.exam_id,
+        "error": job.error,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
@@ -2,15 +2,31 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from apps.api.database import create_db_and_tables
+from sqlmodel import Session
+from apps.api.database import create_db_and_tables, engine, async_engine
 
 load_dotenv()
+from apps.api import workers, jobs, transport, stats, migrations, passwords, google_auth
 from apps.api.routers import auth, scan, rubric, evaluate, classes, assessments, rubrics as rubric_router
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+    migrations.upgrade()
+    if stats.ENABLED:
+        with Session(engine) as session:
+            stats.rebuild(session)
+            session.commit()
+    transport.set_owner()
+    transport.sweep_orphans()
+    jobs.start_runners()
+    google_auth.start_refresher()
     yield
+    await google_auth.stop_refresher()
+    await jobs.stop_runners()
+    workers.shutdown()
+    passwords.shutdown()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Exam Evaluator API",
@@ -25,6 +41,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"], # keyset pagination of exam listings
 )
 
 # Include Routers
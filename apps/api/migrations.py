@@ -0,0 +1,98 @@
+"""
+Schema migrations.
+
+create_all() only creates tables that are missing; it never changes a table
+that already exists. Changes to existing databases are listed here as numbered
+migrations, applied in order at startup (after create_all) and recorded in the
+schema_migrations table, so each runs once per database. Statements are written
+to be idempotent (IF NOT EXISTS), because on a fresh database create_all has
+already built the current schema from models.py, and several API processes may
+start at once.
+
+    python -m apps.api.migrations            # apply pending migrations
+    python -m apps.api.migrations --status   # list applied / pending
+"""
+import argparse
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+from apps.api.database import engine as default_engine
+
+# (version, description, statements). Append only; never edit an applied migration.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "Indexes for exam, student, assessment, class, rubric and job lookups", [
+        "CREATE INDEX IF NOT EXISTS ix_classroom_teacher_id ON classroom (teacher_id)",
+        "CREATE INDEX IF NOT EXISTS ix_student_classroom_id ON student (classroom_id)",
+        "CREATE INDEX IF NOT EXISTS ix_rubric_teacher_id ON rubric (teacher_id)",
+        "CREATE INDEX IF NOT EXISTS ix_assessment_classroom_date ON assessment (classroom_id, date DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_exam_created_at ON exam (created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_exam_assessment_created ON exam (assessment_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_exam_student_score ON exam (student_id, score)",
+        "CREATE INDEX IF NOT EXISTS ix_exam_classroom_score ON exam (classroom_id, score)",
+        "CREATE INDEX IF NOT EXISTS ix_scanjob_status_created ON scanjob (status, created_at)",
+        # Fresh statistics so the planner knows the new indexes are selective
+        "ANALYZE",
+    ]),
+    (2, "Exam listing index covers the (created_at, id) keyset cursor", [
+        "CREATE INDEX IF NOT EXISTS ix_exam_assessment_created_id ON exam (assessment_id, created_at DESC, id DESC)",
+        "DROP INDEX IF EXISTS ix_exam_assessment_created",
+    ]),
+]
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def applied_versions(engine: Engine = default_engine) -> List[int]:
+    _metadata.create_all(engine)
+    with engine.connect() as connection:
+        return sorted(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def upgrade(engine: Engine = default_engine) -> List[int]:
+    """Applies pending migrations, each in its own transaction. Returns the versions applied."""
+    done = set(applied_versions(engine))
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in done:
+            continue
+        try:
+            with engine.begin() as connection:
+                for statement in statements:
+                    connection.exec_driver_sql(statement)
+                connection.execute(schema_migrations.insert().values(
+                    version=version, description=description, applied_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Another process recorded it first; its statements were idempotent anyway
+            continue
+        print(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply or list schema migrations.")
+    parser.add_argument("--status", action="store_true", help="list migrations without applying them")
+    args = parser.parse_args()
+
+    if args.status:
+        done = set(applied_versions())
+        for version, description, _ in MIGRATIONS:
+            print(f"{version:>4} {'applied' if version in done else 'pending':>8}  {description}")
+        return
+    if not upgrade():
+        print("Schema is up to date.")
+
+
+if __name__ == "__main__":
+    main()
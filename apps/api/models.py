@@ -1,5 +1,6 @@
 from datetime import datetime
 from typing import Optional
+from sqlalchemy import BigInteger, Index
 from sqlmodel import Field, SQLModel
 
 
@@ -23,21 +24,21 @@ class Classroom(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     subject: str
-    teacher_id: int = Field(foreign_key="user.id")
+    teacher_id: int = Field(foreign_key="user.id", index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Student(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     roll_number: str
-    classroom_id: int = Field(foreign_key="classroom.id")
+    classroom_id: int = Field(foreign_key="classroom.id", index=True)
 
 class Rubric(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
     criteria: str = Field(default="[]") # JSON string of criteria [{"description": "x", "weight": 10}]
     handwriting_weight: float = Field(default=0.0)
-    teacher_id: int = Field(foreign_key="user.id")
+    teacher_id: int = Field(foreign_key="user.id", index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Assessment(SQLModel, table=True):
@@ -57,8 +58,65 @@ class Exam(SQLModel, table=True):
     score: int
     content_score: int = Field(default=0)
     handwriting_score: int = Field(default=0)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
     user_id: Optional[int] = Field(default=None, foreign_key="user.id") # Teacher who scanned it
     student_id: Optional[int] = Field(default=None, foreign_key="student.id")
     classroom_id: Optional[int] = Field(default=None, foreign_key="classroom.id")
     assessment_id: Optional[int] = Field(default=None, foreign_key="assessment.id")
+
+class ScanJob(SQLModel, table=True):
+    id: str = Field(primary_key=True) # uuid4, doubles as the public submission_id
+    kind: str = Field(default="scan")
+    status: str = Field(default="queued", index=True) # queued | running | done | failed
+    stage: Optional[str] = Field(default=None)
+    progress: float = Field(default=0.0)
+    attempts: int = Field(default=0)
+    payload_path: Optional[str] = Field(default=None) # Storage key of the upload (see storage.py)
+    assessment_id: Optional[int] = Field(default=None, foreign_key="assessment.id")
+    student_id: Optional[int] = Field(default=None, foreign_key="student.id")
+    exam_id: Optional[int] = Field(default=None, foreign_key="exam.id")
+    link_duplicates: bool = Field(default=False) # Re-uploads reuse the existing Exam row
+    result: Optional[str] = Field(default=None) # JSON string
+    error: Optional[str] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ScanFingerprint(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sha256: str = Field(index=True) # Hash of the raw uploaded bytes
+    phash: int = Field(sa_type=BigInteger, index=True) # 64-bit dHash of the downscaled page
+    assessment_id: Optional[int] = Field(default=None, foreign_key="assessment.id", index=True)
+    exam_id: Optional[int] = Field(default=None, foreign_key="exam.id")
+    warped_path: Optional[str] = Field(default=None) # Storage key of the perspective-corrected color page
+    ocr_raw: Optional[str] = Field(default=None)
+    ocr_content: Optional[str] = Field(default=None) # Structured response JSON, as on Exam
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ScanImage(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    exam_id: Optional[int] = Field(default=None, foreign_key="exam.id", index=True)
+    kind: str # original | warped | processed (binarized)
+    key: str = Field(index=True) # Content-addressed storage key, e.g. "<sha256>.jpg"
+    content_type: str
+    size: int
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ClassroomStats(SQLModel, table=True):
+    # Materialized dashboard stats (see stats.py); only maintained with STATS_MATERIALIZED=1
+    classroom_id: int = Field(primary_key=True, foreign_key="classroom.id")
+    student_count: int = Field(default=0)
+    exam_count: int = Field(default=0)
+    score_sum: float = Field(default=0.0)
+
+class StudentStats(SQLModel, table=True):
+    student_id: int = Field(primary_key=True, foreign_key="student.id")
+    exam_count: int = Field(default=0)
+    score_sum: float = Field(default=0.0)
+
+# Composite indexes for the list, stats and queue queries. Databases created before
+# they existed get them (and any later schema change) through migrations.py.
+Index("ix_exam_assessment_created_id", Exam.assessment_id, Exam.created_at.desc(), Exam.id.desc())
+Index("ix_exam_student_score", Exam.student_id, Exam.score)
+Index("ix_exam_classroom_score", Exam.classroom_id, Exam.score)
+Index("ix_assessment_classroom_date", Assessment.classroom_id, Assessment.date.desc())
+Index("ix_scanjob_status_created", ScanJob.status, ScanJob.created_at)
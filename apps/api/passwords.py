@@ -0,0 +1,96 @@
+"""
+Password hashing off the event loop.
+
+bcrypt costs hundreds of milliseconds of CPU by design, so hashing and checking
+run in a small dedicated process pool instead of the request threadpool: a
+burst of logins uses at most AUTH_HASH_WORKERS cores and cannot starve the
+other endpoints. At most AUTH_HASH_MAX_PENDING operations may be running or
+queued; beyond that requests are turned away with 503 and Retry-After rather
+than piling up behind each other until clients time out.
+
+This module stays light (passlib only) because every pool process imports it.
+
+Configuration (env):
+    AUTH_HASH_WORKERS       processes for bcrypt (default: half the CPUs, at least 1)
+    AUTH_HASH_MAX_PENDING   hash / verify operations running or queued (default: 64)
+    AUTH_HASH_RETRY_AFTER   Retry-After seconds when the queue is full (default: 2)
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+MAX_PENDING = int(os.getenv("AUTH_HASH_MAX_PENDING", 64))
+RETRY_AFTER_SECONDS = int(os.getenv("AUTH_HASH_RETRY_AFTER", 2))
+
+# Stored for accounts that sign in through an identity provider: matches no password
+UNUSABLE_PASSWORD = "!"
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending = 0
+
+
+class HashQueueFull(RuntimeError):
+    pass
+
+
+def verify_password(plain_password, hashed_password) -> bool:
+    if not hashed_password or hashed_password == UNUSABLE_PASSWORD:
+        return False
+    try:
+        return pwd_context.verify(plain_password, hashed_password)
+    except ValueError:
+        # Not a hash passlib recognizes
+        return False
+
+
+def get_password_hash(password) -> str:
+    return pwd_context.hash(password)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: never fork a process that already runs an event loop and threads
+        _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def _run(fn, *args):
+    global _pending
+    if _pending >= MAX_PENDING:
+        raise HashQueueFull(f"{_pending} password operations already pending")
+    _pending += 1
+    try:
+        return await asyncio.wrap_future(get_pool().submit(fn, *args))
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    """bcrypt hash computed in the hashing pool. Raises HashQueueFull under overload."""
+    return await _run(get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    """Verifies in the hashing pool; unusable and unknown hashes fail without any work."""
+    if not hashed_password or hashed_password == UNUSABLE_PASSWORD:
+        return False
+    return await _run(verify_password, plain_password, hashed_password)
+
+
+def stats() -> dict:
+    return {"workers": HASH_WORKERS, "pending": _pending, "max_pending": MAX_PENDING}
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
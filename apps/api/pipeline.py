@@ -0,0 +1,277 @@
+"""
+Per-page scan pipeline shared by the job queue and the batch endpoint:
+duplicate check -> vision -> OCR -> (student lookup) -> grading -> save.
+"""
+import asyncio
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from sqlmodel import Session, select
+
+from apps.api import workers, dedup, transport, storage
+from apps.api.database import engine
+from apps.api.agents.llm_client import llm_client
+from apps.api.compiled_rubrics import CompiledRubric, compile_rubric
+from apps.api.models import Assessment, Exam, Rubric, ScanFingerprint, ScanImage, Student
+
+ROLL_NUMBER_PATTERN = re.compile(r"roll\s*(?:no|number|#)?\s*[.:#\-]?\s*([A-Za-z0-9][A-Za-z0-9\-/]*)", re.IGNORECASE)
+
+
+@dataclass
+class GradingContext:
+    assessment: Optional[Assessment] = None
+    rubric: Optional[CompiledRubric] = None
+    reference_context: Optional[str] = None
+    roster: Dict[str, int] = field(default_factory=dict) # normalized roll number -> student id
+
+    @property
+    def classroom_id(self) -> Optional[int]:
+        return self.assessment.classroom_id if self.assessment else None
+
+
+def normalize_roll_number(value: str) -> str:
+    return value.strip().lower().lstrip("0") or "0"
+
+
+def load_grading_context(session: Session, assessment_id: Optional[int], with_roster: bool = False) -> GradingContext:
+    """
+    Loads the rubric, reference answer and (optionally) class roster for an assessment once.
+    """
+    context = GradingContext()
+    assessment = session.get(Assessment, assessment_id) if assessment_id else None
+    if not assessment:
+        return context
+    context.assessment = assessment
+
+    # Get Rubric
+    if assessment.rubric_id:
+        rubric = session.get(Rubric, assessment.rubric_id)
+        if rubric:
+            # Parsed and rendered once per rubric version, not per page
+            context.rubric = compile_rubric(rubric)
+
+    # Get Reference Exam (Golden Key)
+    if assessment.reference_exam_id:
+        ref_exam = session.get(Exam, assessment.reference_exam_id)
+        if ref_exam and ref_exam.ocr_content:
+            context.reference_context = ref_exam.ocr_content
+
+    if with_roster:
+        students = session.exec(
+            select(Student.id, Student.roll_number).where(Student.classroom_id == assessment.classroom_id)
+        ).all()
+        context.roster = {normalize_roll_number(roll): student_id for student_id, roll in students}
+    return context
+
+
+def load_context(assessment_id: Optional[int], with_roster: bool = False) -> GradingContext:
+    """load_grading_context in its own session, for callers that run it in a thread."""
+    with Session(engine) as session:
+        return load_grading_context(session, assessment_id, with_roster)
+
+
+def match_student(context: GradingContext, raw_text: str, source_name: Optional[str] = None) -> Optional[int]:
+    """
+    Maps a page to a student by the roll number written on it, falling back to the file name.
+    """
+    if not context.roster:
+        return None
+    for match in ROLL_NUMBER_PATTERN.finditer(raw_text or ""):
+        student_id = context.roster.get(normalize_roll_number(match.group(1)))
+        if student_id:
+            return student_id
+    if source_name:
+        stem = os.path.splitext(os.path.basename(source_name))[0]
+        return context.roster.get(normalize_roll_number(stem))
+    return None
+
+
+def _load_exam(exam_id: int) -> Optional[Exam]:
+    with Session(engine) as session:
+        return session.get(Exam, exam_id)
+
+
+def _save_exam(title: str, original: storage.StoredObject, student_response: str, grading_result: Dict[str, Any],
+               student_id: Optional[int], assessment_id: Optional[int], classroom_id: Optional[int],
+               images: Dict[str, storage.StoredObject], sha256: str, phash: int, extracted_data: Dict[str, Any]) -> Exam:
+    """Writes the Exam row, its page images and the dedup fingerprint in one transaction."""
+    with Session(engine) as session:
+        exam = Exam(
+            title=title,
+            image_url=storage.url_for(original.key),
+            ocr_content=student_response, # Save the raw text for future reference!
+            feedback=grading_result.get("feedback", "Pending evaluation"),
+            score=grading_result.get("final_score", 0),
+            content_score=grading_result.get("content_score", 0),
+            handwriting_score=grading_result.get("handwriting_score", 0),
+            user_id=None,
+            student_id=student_id,
+            assessment_id=assessment_id,
+            classroom_id=classroom_id
+        )
+        session.add(exam)
+        session.flush()
+        for kind, stored in images.items():
+            session.add(ScanImage(
+                exam_id=exam.id, kind=kind, key=stored.key, content_type=stored.content_type, size=stored.size
+            ))
+        if dedup.ENABLED:
+            warped = images.get("warped")
+            dedup.record(
+                session, sha256, phash, assessment_id, exam.id, warped.key if warped else None,
+                extracted_data.get("raw_text"), student_response
+            )
+        session.commit()
+        session.refresh(exam)
+    return exam
+
+
+def _duplicate_lookup(sha256: str, phash: int, assessment_id: Optional[int]):
+    with Session(engine) as session:
+        exact = dedup.find_exact(session, sha256, assessment_id)
+        if exact is not None:
+            return exact, []
+        return None, dedup.near_candidates(session, phash, assessment_id)
+
+
+def _load_fingerprint(fingerprint_id: int) -> Optional[ScanFingerprint]:
+    with Session(engine) as session:
+        return session.get(ScanFingerprint, fingerprint_id)
+
+
+async def find_duplicate(image: Any, sha256: str, phash: int, assessment_id: Optional[int]) -> Optional[ScanFingerprint]:
+    """
+    Previous scan of this page in the same assessment: identical bytes, or a perceptual-hash
+    candidate that also passes the pixel comparison with its stored original.
+    """
+    if not dedup.ENABLED:
+        return None
+    exact, candidates = await asyncio.to_thread(_duplicate_lookup, sha256, phash, assessment_id)
+    if exact is not None:
+        return exact
+    for fingerprint_id, original_key in candidates:
+        try:
+            difference = await workers.run_page_difference(image, original_key)
+        except Exception as e:
+            print(f"Warning: duplicate check against {original_key} failed ({e}); processing the page.")
+            continue
+        if difference <= dedup.PIXEL_MAX_DIFF:
+            return await asyncio.to_thread(_load_fingerprint, fingerprint_id)
+    return None
+
+
+async def process_page(
+    contents: bytes,
+    context: GradingContext,
+    student_id: Optional[int] = None,
+    title: str = "Scan",
+    source_name: Optional[str] = None,
+    on_stage: Optional[Callable[[str, float], None]] = None,
+    link_duplicates: bool = dedup.LINK_EXISTING,
+    batch_vision: bool = False,
+    original: Optional[storage.StoredObject] = None,
+) -> Dict[str, Any]:
+    """
+    Runs one page through the pipeline and saves the Exam row.
+    Pages seen before skip vision and OCR; with link_duplicates a re-upload to the same
+    assessment returns the existing Exam instead of creating a new one.
+    batch_vision routes vision + OCR through VisionAgent.process_batch (bulk uploads).
+    original is the page's stored upload; pages without one are stored here first.
+    """
+    def report(stage: str, progress: float):
+        if on_stage:
+            on_stage(stage, progress)
+
+    assessment_id = context.assessment.id if context.assessment else None
+    if original is None:
+        original = await asyncio.to_thread(storage.store.put_bytes, contents)
+    images = {"original": original}
+
+    # Page bytes go to shared memory once and are read there by the fingerprint and
+    # vision workers; released as soon as OCR text exists
+    image = transport.put(contents, "upload")
+    try:
+        # 0. Duplicate check (byte hash + perceptual hash)
+        report("fingerprint", 0.05)
+        sha256, phash = await workers.run_fingerprint(image)
+        duplicate = await find_duplicate(image, sha256, phash, assessment_id)
+
+        if duplicate and link_duplicates and duplicate.exam_id:
+            existing = await asyncio.to_thread(_load_exam, duplicate.exam_id)
+            if existing:
+                return {
+                    "exam_id": existing.id,
+                    "student_id": existing.student_id,
+                    "status": "duplicate",
+                    "duplicate_of": existing.id,
+                    "score": existing.score,
+                    "feedback": existing.feedback,
+                    "image_url": existing.image_url,
+                    "extracted_data": {"raw_text": duplicate.ocr_raw, "structured_response": duplicate.ocr_content}
+                }
+
+        if duplicate:
+            # Same page was processed before: reuse its warped image and OCR text
+            warped = await asyncio.to_thread(storage.store.head, duplicate.warped_path) if duplicate.warped_path else None
+            if warped:
+                images["warped"] = warped
+            student_response = duplicate.ocr_content
+            extracted_data = {"raw_text": duplicate.ocr_raw, "structured_response": duplicate.ocr_content}
+        else:
+            # 1. Vision Processing
+            report("vision", 0.1)
+            if batch_vision:
+                # 1-2. Vision and OCR together, batched with the other pages in flight
+                extracted_data, page_images = await workers.run_vision_ocr(image)
+            else:
+                processed_img, page_images = await workers.run_vision(image)
+                try:
+                    # 2. OCR (Text Extraction)
+                    report("ocr", 0.4)
+                    extracted_data = await workers.run_ocr(processed_img)
+                finally:
+                    transport.release(processed_img)
+            images.update(page_images)
+            student_response = extracted_data.get("structured_response", "")
+            # If OCR returns a list/dict, convert to string for the scoring agent interface
+            if isinstance(student_response, (list, dict)):
+                student_response = json.dumps(student_response)
+    finally:
+        transport.release(image)
+
+    if student_id is None:
+        student_id = match_student(context, extracted_data.get("raw_text", ""), source_name)
+
+    # 3. AI Grading
+    grading_result = {}
+    if context.rubric:
+        api_key = llm_client.default_api_key()
+        if api_key:
+            report("grading", 0.6)
+            grading_result = await workers.run_grading(
+                student_response,
+                context.rubric,
+                api_key=api_key,
+                reference_context=context.reference_context
+            )
+
+    # 4. Save Record
+    report("saving", 0.9)
+    exam = await asyncio.to_thread(
+        _save_exam, title, original, student_response, grading_result, student_id, assessment_id,
+        context.classroom_id, images, sha256, phash, extracted_data
+    )
+
+    return {
+        "exam_id": exam.id,
+        "student_id": exam.student_id,
+        "status": "graded" if grading_result else "processed_no_grading",
+        "duplicate_of": duplicate.exam_id if duplicate else None,
+        "score": exam.score,
+        "feedback": exam.feedback,
+        "image_url": exam.image_url,
+        "extracted_data": extracted_data
+    }
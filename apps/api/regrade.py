@@ -0,0 +1,127 @@
+"""
+Bulk re-grading of an assessment after its rubric or reference answer changed.
+
+Runs as a ScanJob of kind "regrade" on the job queue (jobs.py), so progress is
+polled like a scan (GET /api/v1/scan/jobs/{job_id}) and an interrupted run is
+picked up again. Exams are re-scored from their stored Exam.ocr_content: no
+vision, no OCR. Responses go through workers.run_grading, i.e. the grading
+cache and the micro-batcher (several students per LLM call) under the grading
+concurrency limit, and each chunk of results is written back in one
+transaction.
+
+Configuration (env):
+    REGRADE_CHUNK_SIZE   exams graded concurrently and written per transaction (default: 50)
+"""
+import asyncio
+import os
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from apps.api import pipeline, stats, workers
+from apps.api.agents.llm_client import llm_client
+from apps.api.agents.scoring_agent import GradingError
+from apps.api.database import engine
+from apps.api.models import Exam
+
+CHUNK_SIZE = int(os.getenv("REGRADE_CHUNK_SIZE", 50))
+
+
+def _gradable(assessment_id: int, reference_exam_id: Optional[int]):
+    conditions = [Exam.assessment_id == assessment_id, Exam.ocr_content.is_not(None), Exam.ocr_content != ""]
+    if reference_exam_id:
+        # The answer key itself is not re-graded
+        conditions.append(Exam.id != reference_exam_id)
+    return conditions
+
+
+# Database work runs in threads (asyncio.to_thread), never on the event loop
+def _count(conditions) -> int:
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(Exam).where(*conditions)).one()
+
+
+def _read_chunk(conditions, last_id: int):
+    with Session(engine) as session:
+        return session.exec(
+            select(Exam.id, Exam.ocr_content)
+            .where(*conditions, Exam.id > last_id)
+            .order_by(Exam.id)
+            .limit(CHUNK_SIZE)
+        ).all()
+
+
+def _write_chunk(updates, classroom_id: Optional[int]):
+    with Session(engine) as session:
+        session.bulk_update_mappings(Exam, updates)
+        if stats.ENABLED:
+            # Bulk updates skip the flush hook that maintains the stats tables
+            stats.rebuild(session, [classroom_id])
+        session.commit()
+
+
+async def regrade_assessment(assessment_id: int, on_progress: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
+    """
+    Re-scores every exam of the assessment that has OCR text. Exams the model cannot
+    grade (GradingError) keep their previous score and are counted as failed.
+    Raises LLMUnavailableError if the model stays unreachable (the job is retried).
+    """
+    context = await asyncio.to_thread(pipeline.load_context, assessment_id)
+    if not context.assessment:
+        raise ValueError(f"Assessment {assessment_id} not found")
+    if not context.rubric:
+        raise ValueError("Assessment has no rubric to grade against")
+    conditions = _gradable(assessment_id, context.assessment.reference_exam_id)
+    total = await asyncio.to_thread(_count, conditions)
+
+    api_key = llm_client.default_api_key()
+    if not api_key:
+        raise ValueError("No API key configured for grading (GEMINI_API_KEY)")
+
+    regraded = failed = 0
+    last_id = 0
+    while True:
+        # Keyset pagination on id: each chunk is one short read and one write transaction
+        chunk = await asyncio.to_thread(_read_chunk, conditions, last_id)
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+
+        results = await asyncio.gather(*[
+            workers.run_grading(
+                ocr_content,
+                context.rubric,
+                api_key=api_key,
+                reference_context=context.reference_context
+            )
+            for _, ocr_content in chunk
+        ], return_exceptions=True)
+
+        updates = []
+        for (exam_id, _), result in zip(chunk, results):
+            if isinstance(result, GradingError):
+                failed += 1
+                continue
+            if isinstance(result, BaseException):
+                raise result
+            updates.append({
+                "id": exam_id,
+                "score": result.get("final_score", 0),
+                "content_score": result.get("content_score", 0),
+                "handwriting_score": result.get("handwriting_score", 0),
+                "feedback": result.get("feedback", "")
+            })
+        if updates:
+            await asyncio.to_thread(_write_chunk, updates, context.classroom_id)
+        regraded += len(updates)
+
+        if on_progress and total:
+            on_progress(min(1.0, (regraded + failed) / total))
+
+    return {
+        "assessment_id": assessment_id,
+        "exams": total,
+        "regraded": regraded,
+        "failed": failed
+    }
@@ -1,11 +1,18 @@
-from typing import List, Annotated
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlmodel import Session, select
-from apps.api.database import get_session
-from apps.api.models import User, Classroom, Assessment, Exam
-from apps.api.auth import get_current_user
+from typing import List, Annotated, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy import tuple_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from apps.api.database import get_async_session, async_engine
+from apps.api.models import Classroom, Assessment, Exam
+from apps.api.auth import get_current_user_id
+from apps.api import jobs
 from pydantic import BaseModel, Field
 from datetime import datetime
+import base64
+import json
 
 router = APIRouter(prefix="/assessments", tags=["Assessments"])
 
@@ -16,40 +23,40 @@ class AssessmentCreate(BaseModel):
     rubric_id: Annotated[int | None, Field(default=None)] = None
 
 @router.get("/", response_model=List[Assessment])
-def get_assessments(
+async def get_assessments(
     classroom_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session),
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session),
     offset: int = 0,
     limit: int = Query(default=100, le=100),
 ):
     """List assessments for a specific class"""
-    classroom = session.get(Classroom, classroom_id)
+    classroom = await session.get(Classroom, classroom_id)
     if not classroom:
         raise HTTPException(status_code=404, detail="Class not found")
-    if classroom.teacher_id != current_user.id:
+    if classroom.teacher_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    assessments = session.exec(
+    assessments = (await session.exec(
         select(Assessment)
         .where(Assessment.classroom_id == classroom_id)
         .order_by(Assessment.date.desc())
         .offset(offset)
         .limit(limit)
-    ).all()
+    )).all()
     return assessments
 
 @router.post("/", response_model=Assessment)
-def create_assessment(
+async def create_assessment(
     assessment_in: AssessmentCreate,
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session)
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Create a new assessment for a class"""
-    classroom = session.get(Classroom, assessment_in.classroom_id)
+    classroom = await session.get(Classroom, assessment_in.classroom_id)
     if not classroom:
         raise HTTPException(status_code=404, detail="Class not found")
-    if classroom.teacher_id != current_user.id:
+    if classroom.teacher_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
         
     assessment = Assessment(
@@ -59,62 +66,175 @@ def create_assessment(
         rubric_id=assessment_in.rubric_id
     )
     session.add(assessment)
-    session.commit()
-    session.refresh(assessment)
+    await session.commit()
+    await session.refresh(assessment)
+    return assessment
+
+# Columns left out of list views by fields=summary
+HEAVY_EXAM_FIELDS = {"ocr_content", "feedback"}
+EXAM_FIELDS = list(Exam.__table__.columns.keys())
+EXPORT_BATCH_SIZE = 500
+
+def exam_fields(fields: Optional[str]) -> List[str]:
+    """Columns selected for a fields= parameter: all (default), summary, or a comma-separated list."""
+    if not fields:
+        return EXAM_FIELDS
+    if fields == "summary":
+        return [name for name in EXAM_FIELDS if name not in HEAVY_EXAM_FIELDS]
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = set(requested) - set(EXAM_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown exam fields: {', '.join(sorted(unknown))}")
+    # The cursor columns are always included
+    return [name for name in EXAM_FIELDS if name in requested or name in ("id", "created_at")]
+
+def encode_cursor(created_at: datetime, exam_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), exam_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, exam_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(exam_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def exam_listing_query(assessment_id: int, fields: List[str], after: Optional[Tuple[datetime, int]] = None):
+    """
+    Exams of an assessment, newest first, as plain columns. Pages continue from the
+    (created_at, id) of the previous page's last row, read from the
+    (assessment_id, created_at DESC, id DESC) index: each page costs the same at any depth.
+    """
+    query = (
+        select(*[getattr(Exam, name) for name in fields])
+        .where(Exam.assessment_id == assessment_id)
+        .order_by(Exam.created_at.desc(), Exam.id.desc())
+    )
+    if after is not None:
+        query = query.where(tuple_(Exam.created_at, Exam.id) < after)
+    return query
+
+async def _owned_assessment(id: int, current_user_id: int, session: AsyncSession) -> Assessment:
+    assessment = await session.get(Assessment, id)
+    if not assessment:
+        raise HTTPException(status_code=404, detail="Assessment not found")
+
+    classroom = await session.get(Classroom, assessment.classroom_id)
+    if classroom.teacher_id != current_user_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
     return assessment
 
 @router.get("/{id}/exams")
-def get_assessment_exams(
+async def get_assessment_exams(
     id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session),
+    response: Response,
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     offset: int = 0,
-    limit: int = Query(default=100, le=100),
+    limit: int = Query(default=100, ge=1, le=500),
 ):
-    """List all exams (submissions) for a specific assessment"""
-    # Verify ownership
-    assessment = session.get(Assessment, id)
-    if not assessment:
-        raise HTTPException(status_code=404, detail="Assessment not found")
-        
-    classroom = session.get(Classroom, assessment.classroom_id)
-    if classroom.teacher_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    """
+    List exams (submissions) for a specific assessment, newest first.
+    Pass the X-Next-Cursor response header back as ?cursor= for the next page
+    (offset still works but gets slower with depth). fields=summary leaves out
+    ocr_content and feedback; fields=a,b,c selects columns.
+    """
+    await _owned_assessment(id, current_user_id, session)
 
-    exams = session.exec(
-        select(Exam)
-        .where(Exam.assessment_id == id)
-        .order_by(Exam.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-    ).all()
+    columns = exam_fields(fields)
+    query = exam_listing_query(id, columns, decode_cursor(cursor) if cursor else None)
+    if offset and not cursor:
+        query = query.offset(offset)
+    # One extra row tells whether there is a next page
+    rows = (await session.exec(query.limit(limit + 1))).all()
+    exams = [dict(zip(columns, row)) for row in rows[:limit]]
+    if len(rows) > limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(exams[-1]["created_at"], exams[-1]["id"])
     return exams
 
+@router.get("/{id}/exams/export")
+async def export_assessment_exams(
+    id: int,
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session),
+    fields: Optional[str] = None,
+):
+    """Stream every exam of the assessment as NDJSON (one exam per line), read in keyset batches"""
+    await _owned_assessment(id, current_user_id, session)
+    columns = exam_fields(fields)
+
+    async def lines():
+        after = None
+        while True:
+            # A short-lived session per batch: the request's session is closed while streaming
+            async with AsyncSession(async_engine) as batch_session:
+                rows = (await batch_session.exec(exam_listing_query(id, columns, after).limit(EXPORT_BATCH_SIZE))).all()
+            for row in rows:
+                yield json.dumps(jsonable_encoder(dict(zip(columns, row)))) + "\n"
+            if len(rows) < EXPORT_BATCH_SIZE:
+                break
+            after = (rows[-1][columns.index("created_at")], rows[-1][columns.index("id")])
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="assessment-{id}-exams.ndjson"'}
+    )
+
 class ReferenceUpdate(BaseModel):
     reference_exam_id: int
 
 @router.put("/{id}/reference")
-def set_reference_exam(
+async def set_reference_exam(
     id: int,
     ref_update: ReferenceUpdate,
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session)
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session),
+    regrade: bool = False,
 ):
-    """Set the reference exam (Golden Answer) for this assessment"""
-    assessment = session.get(Assessment, id)
+    """Set the reference exam (Golden Answer) for this assessment. With regrade=true, existing exams are re-graded against it."""
+    assessment = await session.get(Assessment, id)
     if not assessment:
         raise HTTPException(status_code=404, detail="Assessment not found")
         
-    classroom = session.get(Classroom, assessment.classroom_id)
-    if classroom.teacher_id != current_user.id:
+    classroom = await session.get(Classroom, assessment.classroom_id)
+    if classroom.teacher_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
         
     # Verify exam belongs to assessment
-    exam = session.get(Exam, ref_update.reference_exam_id)
+    exam = await session.get(Exam, ref_update.reference_exam_id)
     if not exam or exam.assessment_id != id:
          raise HTTPException(status_code=400, detail="Invalid reference exam")
 
     assessment.reference_exam_id = ref_update.reference_exam_id
     session.add(assessment)
-    session.commit()
-    return {"status": "success", "reference_exam_id": ref_update.reference_exam_id}
+    await session.commit()
+
+    response = {"status": "success", "reference_exam_id": ref_update.reference_exam_id}
+    if regrade:
+        response["regrade_job_id"] = (await session.run_sync(jobs.enqueue_regrade, id)).id
+    return response
+
+@router.post("/{id}/regrade", status_code=202)
+async def regrade_assessment(
+    id: int,
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Re-grade every exam of this assessment against its current rubric and reference exam.
+    Runs in the background; poll GET /api/v1/scan/jobs/{job_id} for progress.
+    """
+    assessment = await session.get(Assessment, id)
+    if not assessment:
+        raise HTTPException(status_code=404, detail="Assessment not found")
+
+    classroom = await session.get(Classroom, assessment.classroom_id)
+    if classroom.teacher_id != current_user_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if not assessment.rubric_id:
+        raise HTTPException(status_code=400, detail="Assessment has no rubric")
+
+    job = await session.run_sync(jobs.enqueue_regrade, id)
+    return {"job_id": job.id, "status": job.status}
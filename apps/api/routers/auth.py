@@ -1,39 +1,59 @@
+from contextlib import contextmanager
 from datetime import timedelta
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, select
-from apps.api.database import get_session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from apps.api.database import get_async_session
 from apps.api.models import User, UserCreate
-from apps.api.auth import get_password_hash, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user
+from apps.api.auth import create_access_token, token_claims, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user
+from apps.api import google_auth, passwords
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+@contextmanager
+def _hashing_capacity():
+    """Turns a full password-hashing queue into 503 + Retry-After"""
+    try:
+        yield
+    except passwords.HashQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many sign-ins in progress, please retry shortly",
+            headers={"Retry-After": str(passwords.RETRY_AFTER_SECONDS)},
+        )
+
 @router.post("/register", response_model=User)
-def register(user_in: UserCreate, session: Session = Depends(get_session)):
+async def register(user_in: UserCreate, session: AsyncSession = Depends(get_async_session)):
     # Check if user exists
-    existing_user = session.exec(select(User).where(User.email == user_in.email)).first()
+    existing_user = (await session.exec(select(User).where(User.email == user_in.email))).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
+    with _hashing_capacity():
+        hashed_password = await passwords.hash_password(user_in.password)
     user = User(
         email=user_in.email,
         full_name=user_in.full_name,
-        hashed_password=get_password_hash(user_in.password)
+        hashed_password=hashed_password
     )
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
     return user
 
 @router.post("/token")
-def login_for_access_token(
+async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
-    user = session.exec(select(User).where(User.email == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = (await session.exec(select(User).where(User.email == form_data.username))).first()
+    # bcrypt is deliberately slow; it runs in the bounded hashing pool
+    with _hashing_capacity():
+        valid = user is not None and await passwords.check_password(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -42,12 +62,12 @@ def login_for_access_token(
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data=token_claims(user), expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=User)
-def read_users_me(current_user: Annotated[User, Depends(get_current_user)]):
+async def read_users_me(current_user: Annotated[User, Depends(get_current_user)]):
     return current_user
 
 # Google Auth Schema
@@ -57,22 +77,19 @@ class GoogleToken(BaseModel):
     token: str
 
 @router.post("/google")
-def login_google(
+async def login_google(
     token_data: GoogleToken,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     try:
-        from google.oauth2 import id_token
-        from google.auth.transport import requests
+        from google.auth.exceptions import GoogleAuthError
         
-        # Verify the token
-        # GOOGLE_CLIENT_ID should ideally be an env var, but for now we verify audience if provided, 
-        # or just verify the signature against Google's certs.
-        id_info = id_token.verify_oauth2_token(
-            token_data.token, 
-            requests.Request(), 
-            audience=None # validation of audience happens on client side mostly, or we can hardcode if known
-        )
+        # Verify the token against Google's cached signing certs (google_auth.py);
+        # the audience is checked when GOOGLE_CLIENT_ID is set
+        try:
+            id_info = await google_auth.verify_id_token(token_data.token)
+        except GoogleAuthError as e:
+            raise ValueError(str(e))
         
         email = id_info.get("email")
         name = id_info.get("name")
@@ -81,30 +98,29 @@ def login_google(
             raise HTTPException(status_code=400, detail="Invalid Google Token: No email found")
             
         # Check if user exists
-        user = session.exec(select(User).where(User.email == email)).first()
+        user = (await session.exec(select(User).where(User.email == email))).first()
         
         if not user:
-            # Create new user automatically
-            # We generate a random password since they use Google to login
-            import secrets
-            random_password = secrets.token_urlsafe(16)
-            
+            # Create new user automatically. They sign in through Google, so the
+            # account gets no usable password (and no bcrypt work is spent on one)
             user = User(
                 email=email,
                 full_name=name,
-                hashed_password=get_password_hash(random_password)
+                hashed_password=passwords.UNUSABLE_PASSWORD
             )
             session.add(user)
-            session.commit()
-            session.refresh(user)
+            await session.commit()
+            await session.refresh(user)
             
         # Create Access Token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.email}, expires_delta=access_token_expires
+            data=token_claims(user), expires_delta=access_token_expires
         )
         return {"access_token": access_token, "token_type": "bearer"}
 
+    except HTTPException:
+        raise
     except ValueError as e:
          raise HTTPException(status_code=400, detail=f"Invalid Google Token: {str(e)}")
     except Exception as e:
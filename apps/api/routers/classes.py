@@ -1,9 +1,10 @@
 from typing import List, Annotated
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select, func
-from apps.api.database import get_session
-from apps.api.models import User, Classroom, Student, Exam, Assessment
-from apps.api.auth import get_current_user
+from sqlmodel.ext.asyncio.session import AsyncSession
+from apps.api.database import get_async_session
+from apps.api.models import Classroom, Student
+from apps.api.auth import get_current_user_id
+from apps.api import stats
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/classes", tags=["Classes"])
@@ -25,113 +26,83 @@ class StudentWithStats(Student):
     average_score: float
 
 @router.get("/", response_model=List[ClassroomWithStats])
-def get_classes(
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session)
+async def get_classes(
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session)
 ):
     """List all classes for the current teacher with basic stats"""
-    classes = session.exec(select(Classroom).where(Classroom.teacher_id == current_user.id)).all()
-    
-    results = []
-    for cls in classes:
-        # Get student count
-        student_count = session.exec(select(func.count(Student.id)).where(Student.classroom_id == cls.id)).one()
-        
-        # Get class average (from all exams in this class)
-        # Note: This is a simple average of all exams linked to this class
-        avg_score = session.exec(
-             select(func.avg(Exam.score)).where(Exam.classroom_id == cls.id)
-        ).one() or 0.0
-        
-        results.append(ClassroomWithStats(
-            **cls.dict(),
-            student_count=student_count,
-            average_score=round(avg_score, 1)
-        ))
-    
-    return results
+    return [
+        ClassroomWithStats(**cls.dict(), student_count=student_count, average_score=average_score)
+        for cls, student_count, average_score in await session.run_sync(stats.classes_with_stats, current_user_id)
+    ]
 
 @router.post("/", response_model=Classroom)
-def create_class(
+async def create_class(
     classroom_in: ClassroomCreate,
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session)
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Create a new class"""
     classroom = Classroom(
         name=classroom_in.name,
         subject=classroom_in.subject,
-        teacher_id=current_user.id
+        teacher_id=current_user_id
     )
     session.add(classroom)
-    session.commit()
-    session.refresh(classroom)
+    await session.commit()
+    await session.refresh(classroom)
     return classroom
 
 @router.get("/{class_id}", response_model=ClassroomWithStats)
-def get_class_detail(
+async def get_class_detail(
     class_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session)
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Get class details including stats"""
-    classroom = session.get(Classroom, class_id)
+    classroom = await session.get(Classroom, class_id)
     if not classroom:
         raise HTTPException(status_code=404, detail="Class not found")
-    if classroom.teacher_id != current_user.id:
+    if classroom.teacher_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized to view this class")
         
-    student_count = session.exec(select(func.count(Student.id)).where(Student.classroom_id == class_id)).one()
-    avg_score = session.exec(
-        select(func.avg(Exam.score)).where(Exam.classroom_id == class_id)
-    ).one() or 0.0
-    
+    [(_, student_count, average_score)] = await session.run_sync(stats.classes_with_stats, current_user_id, class_id)
     return ClassroomWithStats(
         **classroom.dict(),
         student_count=student_count,
-        average_score=round(avg_score, 1)
+        average_score=average_score
     )
 
 @router.get("/{class_id}/students", response_model=List[StudentWithStats])
-def get_class_students(
+async def get_class_students(
     class_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session)
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session)
 ):
     """List students in a class with their individual averages"""
-    classroom = session.get(Classroom, class_id)
+    classroom = await session.get(Classroom, class_id)
     if not classroom:
         raise HTTPException(status_code=404, detail="Class not found")
-    if classroom.teacher_id != current_user.id:
+    if classroom.teacher_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    students = session.exec(select(Student).where(Student.classroom_id == class_id)).all()
-    
-    results = []
-    for student in students:
-        avg = session.exec(
-            select(func.avg(Exam.score)).where(Exam.student_id == student.id)
-        ).one() or 0.0
-        
-        results.append(StudentWithStats(
-            **student.dict(),
-            average_score=round(avg, 1)
-        ))
-        
-    return results
+    return [
+        StudentWithStats(**student.dict(), average_score=average_score)
+        for student, average_score in await session.run_sync(stats.students_with_stats, class_id)
+    ]
 
 @router.post("/{class_id}/students", response_model=Student)
-def add_student(
+async def add_student(
     class_id: int,
     student_in: StudentCreate,
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session)
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Add a student to a class"""
-    classroom = session.get(Classroom, class_id)
+    classroom = await session.get(Classroom, class_id)
     if not classroom:
         raise HTTPException(status_code=404, detail="Class not found")
-    if classroom.teacher_id != current_user.id:
+    if classroom.teacher_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
         
     student = Student(
@@ -140,6 +111,6 @@ def add_student(
         classroom_id=class_id
     )
     session.add(student)
-    session.commit()
-    session.refresh(student)
+    await session.commit()
+    await session.refresh(student)
     return student
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Depends
 from pydantic import BaseModel
 from typing import Dict, List, Any, Optional
-from apps.api.agents.scoring_agent import ScoringAgent
-# Import the in-memory store from scan router
-from apps.api.routers.scan import submissions
+from sqlmodel.ext.asyncio.session import AsyncSession
+from apps.api.database import get_async_session
+from apps.api.models import ScanJob, Exam
+from apps.api.agents.scoring_agent import ScoringAgent, GradingError
+from apps.api.agents.llm_client import LLMUnavailableError
+from apps.api.cache import grading_cache
 
 class EvaluationRequest(BaseModel):
     rubric: Dict[str, Any]
@@ -11,18 +14,37 @@ class EvaluationRequest(BaseModel):
 router = APIRouter()
 scoring_agent = ScoringAgent()
 
+@router.get("/cache/stats")
+def get_cache_stats():
+    """Hit/miss counters and size of the grading result cache"""
+    return grading_cache.stats()
+
 @router.post("/{submission_id}")
-async def evaluate_submission(submission_id: str, request: EvaluationRequest, x_gemini_api_key: Optional[str] = Header(None)):
-    # Retrieve submission
-    submission = submissions.get(submission_id)
-    if not submission:
+async def evaluate_submission(
+    submission_id: str,
+    request: EvaluationRequest,
+    x_gemini_api_key: Optional[str] = Header(None),
+    session: AsyncSession = Depends(get_async_session)
+):
+    # Retrieve submission (the scan job id returned by /scan/upload)
+    job = await session.get(ScanJob, submission_id)
+    if not job:
         raise HTTPException(status_code=404, detail="Submission not found")
-        
-    student_data = submission["data"]["structured_response"]
-    
+    if job.status != "done" or not job.exam_id:
+        raise HTTPException(status_code=409, detail=f"Submission is not processed yet (status: {job.status})")
+
+    exam = await session.get(Exam, job.exam_id)
+    student_data = exam.ocr_content if exam else None
+    if not student_data:
+        raise HTTPException(status_code=404, detail="Submission has no extracted text")
+
     try:
-        results = scoring_agent.evaluate_submission(student_data, request.rubric, api_key=x_gemini_api_key)
+        results = await scoring_agent.evaluate_submission(student_data, request.rubric, api_key=x_gemini_api_key)
         return results
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except GradingError as e:
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
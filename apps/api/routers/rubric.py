@@ -1,6 +1,10 @@
+import json
 from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from apps.api.agents.rubric_agent import RubricAgent
+from apps.api.agents.llm_client import LLMUnavailableError
+from apps.api.cache import rubric_generation_cache
 from typing import Optional
 
 class RubricRequest(BaseModel):
@@ -9,15 +13,63 @@ class RubricRequest(BaseModel):
 router = APIRouter()
 rubric_agent = RubricAgent()
 
+def _generation_error(e: Exception) -> HTTPException:
+    if isinstance(e, LLMUnavailableError):
+        return HTTPException(status_code=503, detail=str(e))
+    import traceback
+    traceback.print_exc()
+    return HTTPException(status_code=500, detail=str(e))
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """Hit/miss counters and size of the rubric generation cache"""
+    return rubric_generation_cache.stats()
+
 @router.post("/generate")
-async def generate_rubric(request: RubricRequest, x_gemini_api_key: Optional[str] = Header(None)):
+async def generate_rubric(
+    request: RubricRequest,
+    x_gemini_api_key: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+    stream: bool = False
+):
+    """
+    Returns {"rubric": ...}. With stream=true (or Accept: text/event-stream) the response is
+    Server-Sent Events instead: one "question" event per question as the model writes it,
+    then a "rubric" event with the complete rubric, or an "error" event if generation fails midway.
+    """
     # API Key is passed via header
+    if stream or "text/event-stream" in (accept or ""):
+        return await _stream_rubric(request.answer_text, x_gemini_api_key)
 
     try:
         # Pass the key to the agent
-        rubric = rubric_agent.generate_rubric(request.answer_text, api_key=x_gemini_api_key)
+        rubric = await rubric_agent.generate_rubric(request.answer_text, api_key=x_gemini_api_key)
         return {"rubric": rubric}
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _generation_error(e)
+
+async def _stream_rubric(answer_text: str, api_key: Optional[str]) -> StreamingResponse:
+    events = rubric_agent.stream_rubric(answer_text, api_key=api_key)
+    # Wait for the first event so a missing key or an unreachable model is still a plain HTTP error
+    try:
+        first = await events.__anext__()
+    except Exception as e:
+        raise _generation_error(e)
+
+    async def frames():
+        try:
+            yield _sse(*first)
+            async for event, data in events:
+                yield _sse(event, data)
+        except Exception as e:
+            print(f"Rubric stream failed: {e}")
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
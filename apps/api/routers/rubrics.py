@@ -1,9 +1,10 @@
 from typing import List, Annotated
 from fastapi import APIRouter, Depends, HTTPException, Body
-from sqlmodel import Session, select
-from apps.api.database import get_session
-from apps.api.models import User, Rubric
-from apps.api.auth import get_current_user
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from apps.api.database import get_async_session
+from apps.api.models import Rubric
+from apps.api.auth import get_current_user_id
 from pydantic import BaseModel
 import json
 
@@ -19,18 +20,18 @@ class RubricCreate(BaseModel):
     handwriting_weight: float = 0.0
 
 @router.get("/", response_model=List[Rubric])
-def get_rubrics(
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session)
+async def get_rubrics(
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session)
 ):
     """List all rubrics for the logged-in teacher"""
-    return session.exec(select(Rubric).where(Rubric.teacher_id == current_user.id)).all()
+    return (await session.exec(select(Rubric).where(Rubric.teacher_id == current_user_id))).all()
 
 @router.post("/", response_model=Rubric)
-def create_rubric(
+async def create_rubric(
     rubric_in: RubricCreate,
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Session = Depends(get_session)
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Create a new rubric"""
     # Validate weights
@@ -44,9 +45,31 @@ def create_rubric(
         title=rubric_in.title,
         criteria=json.dumps([item.dict() for item in rubric_in.criteria]),
         handwriting_weight=rubric_in.handwriting_weight,
-        teacher_id=current_user.id
+        teacher_id=current_user_id
     )
     session.add(rubric)
-    session.commit()
-    session.refresh(rubric)
+    await session.commit()
+    await session.refresh(rubric)
+    return rubric
+
+@router.put("/{rubric_id}", response_model=Rubric)
+async def update_rubric(
+    rubric_id: int,
+    rubric_in: RubricCreate,
+    current_user_id: Annotated[int, Depends(get_current_user_id)],
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Replace a rubric's title, criteria and handwriting weight"""
+    rubric = await session.get(Rubric, rubric_id)
+    if not rubric:
+        raise HTTPException(status_code=404, detail="Rubric not found")
+    if rubric.teacher_id != current_user_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    rubric.title = rubric_in.title
+    rubric.criteria = json.dumps([item.dict() for item in rubric_in.criteria])
+    rubric.handwriting_weight = rubric_in.handwriting_weight
+    session.add(rubric)
+    await session.commit()
+    await session.refresh(rubric)
     return rubric
@@ -1,107 +1,200 @@
-from typing import Optional
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Form
-from sqlmodel import Session
-from apps.api.database import get_session
-from apps.api.models import Exam, Assessment, Rubric
-from apps.api.agents.vision_agent import VisionAgent
-from apps.api.agents.ocr_agent import OCRAgent
-import uuid
-import base64
+from typing import Optional, Iterator, Tuple
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Form, Header
+from fastapi.responses import StreamingResponse, Response
+from sqlmodel.ext.asyncio.session import AsyncSession
+from apps.api.database import get_async_session
+from apps.api.models import ScanJob
+from apps.api import jobs, pipeline, archives, dedup, workers, transport, storage
+import asyncio
+import json
+import os
+import re
 
 router = APIRouter()
-vision_agent = VisionAgent()
-ocr_agent = OCRAgent()
 
-# In-memory store for MVP
-submissions = {} 
+# Pages of one batch that may be decoded / in the pipeline at the same time;
+# by default enough to give every pool process a full vision batch
+BATCH_MAX_INFLIGHT_PAGES = int(os.getenv(
+    "BATCH_MAX_INFLIGHT_PAGES", max(8, workers.PROCESS_WORKERS * workers.VISION_BATCH_SIZE)
+))
 
-@router.post("/upload")
+@router.post("/upload", status_code=202)
 async def upload_scan(
     file: UploadFile = File(...),
     assessment_id: Optional[int] = Form(None),
     student_id: Optional[int] = Form(None),
-    session: Session = Depends(get_session)
+    link_duplicates: bool = Form(dedup.LINK_EXISTING),
+    session: AsyncSession = Depends(get_async_session)
 ):
-    submission_id = str(uuid.uuid4())
-    contents = await file.read()
-    
+    """Queue a scan for vision, OCR and grading. Poll /jobs/{job_id} for the result."""
+    # Streamed into storage in chunks (hashing as it goes) instead of read into memory
     try:
-        # 1. Vision Processing
-        processed_img, _ = vision_agent.process_image(contents)
-        
-        # 2. OCR (Text Extraction)
-        extracted_data = ocr_agent.extract_structured_data(processed_img)
-        student_response = extracted_data.get("structured_response", "")
-        # If OCR returns a list/dict, convert to string for the new scoring agent interface
-        if isinstance(student_response, list) or isinstance(student_response, dict):
-            import json
-            student_response = json.dumps(student_response)
-
-        # 3. Fetch Rubric & Configuration
-        rubric_dict = {}
-        reference_context = None
-
-        if assessment_id:
-            assessment = session.get(Assessment, assessment_id)
-            if assessment:
-                # Get Rubric
-                if assessment.rubric_id:
-                    rubric = session.get(Rubric, assessment.rubric_id)
-                    if rubric:
-                        rubric_dict = {
-                            "title": rubric.title,
-                            "criteria": rubric.criteria, # JSON string
-                            "handwriting_weight": rubric.handwriting_weight
-                        }
-
-                # Get Reference Exam (Golden Key)
-                if assessment.reference_exam_id:
-                    ref_exam = session.get(Exam, assessment.reference_exam_id)
-                    if ref_exam and ref_exam.ocr_content:
-                        reference_context = ref_exam.ocr_content
-
-        # 4. AI Grading
-        grading_result = {}
-        if rubric_dict:
-            import os
-            api_key = os.getenv("GEMINI_API_KEY") 
-            if api_key:
-                from apps.api.agents.scoring_agent import ScoringAgent
-                scorer = ScoringAgent()
-                grading_result = scorer.evaluate_submission(
-                    student_response, 
-                    rubric_dict, 
-                    api_key=api_key, 
-                    reference_context=reference_context
-                )
-        
-        # 5. Save Record
-        exam = Exam(
-            title=f"Scan {submission_id[:8]}",
-            image_url="s3_or_local_path_placeholder", # We aren't saving image file in this MVP step
-            ocr_content=student_response, # Save the raw text for future reference!
-            feedback=grading_result.get("feedback", "Pending evaluation"),
-            score=grading_result.get("final_score", 0),
-            content_score=grading_result.get("content_score", 0),
-            handwriting_score=grading_result.get("handwriting_score", 0),
-            user_id=None, 
-            student_id=student_id,
-            assessment_id=assessment_id,
-            classroom_id=assessment.classroom_id if assessment_id and assessment else None
-        )
-        session.add(exam)
-        session.commit()
-        session.refresh(exam)
-
-        return {
-            "submission_id": submission_id,
-            "exam_id": exam.id,
-            "status": "graded" if grading_result else "processed_no_grading",
-            "score": exam.score,
-            "feedback": exam.feedback
-        }
-        
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        upload = await asyncio.to_thread(storage.store.put_stream, file.file, file.content_type)
+    except storage.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    job = await session.run_sync(
+        jobs.enqueue_scan, upload, assessment_id=assessment_id, student_id=student_id, link_duplicates=link_duplicates
+    )
+    return {
+        "submission_id": job.id,
+        "job_id": job.id,
+        "status": job.status
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, session: AsyncSession = Depends(get_async_session)):
+    """Full job status including the grading result once done"""
+    job = await session.get(ScanJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.job_status(job)
+
+@router.get("/jobs/{job_id}/progress")
+async def get_job_progress(job_id: str, session: AsyncSession = Depends(get_async_session)):
+    """Lightweight progress for polling clients"""
+    job = await session.get(ScanJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress
+    }
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+@router.get("/images/{key}")
+async def get_image(key: str, range_header: Optional[str] = Header(None, alias="Range")):
+    """
+    Serves a stored scan image. Keys are content hashes, so responses are immutable;
+    single byte ranges are supported for partial / resumed downloads.
+    """
+    stored = await asyncio.to_thread(storage.store.head, key) if storage.is_valid_key(key) else None
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{stored.etag}"',
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    start, end, status_code = 0, stored.size - 1, 200
+    match = RANGE_PATTERN.match(range_header.strip()) if range_header else None
+    if match and (match.group(1) or match.group(2)):
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), stored.size - 1) if match.group(2) else stored.size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, stored.size - int(match.group(2)))
+        if start > end or start >= stored.size:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{stored.size}"})
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{stored.size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        storage.store.get_range(key, start, end),
+        status_code=status_code,
+        media_type=stored.content_type,
+        headers=headers
+    )
+
+@router.get("/transport/stats")
+def get_transport_stats():
+    """Shared-memory segments currently held by in-flight pages (should drain to zero)"""
+    return transport.stats()
+
+async def _stream_batch(pages: Iterator[Tuple[str, bytes]], context: pipeline.GradingContext, link_duplicates: bool):
+    """
+    Fans pages out through the pipeline and yields one NDJSON line per page as it finishes.
+    """
+    inflight = asyncio.Semaphore(BATCH_MAX_INFLIGHT_PAGES)
+    results: asyncio.Queue = asyncio.Queue()
+    tasks = set()
+
+    async def run_page(index: int, source: str, contents: bytes):
+        try:
+            result = await pipeline.process_page(
+                contents, context, title=f"Batch page {index}", source_name=source,
+                link_duplicates=link_duplicates, batch_vision=True
+            )
+            line = {
+                "page": index,
+                "source": source,
+                "exam_id": result["exam_id"],
+                "student_id": result["student_id"],
+                "status": result["status"],
+                "duplicate_of": result["duplicate_of"],
+                "score": result["score"],
+                "feedback": result["feedback"],
+                "image_url": result["image_url"]
+            }
+        except Exception as e:
+            line = {"page": index, "source": source, "status": "failed", "error": str(e)}
+        finally:
+            inflight.release()
+        await results.put(line)
+
+    async def feed():
+        total = 0
+        error = None
+        try:
+            while True:
+                await inflight.acquire()
+                item = await asyncio.to_thread(next, pages, None)
+                if item is None:
+                    inflight.release()
+                    break
+                total += 1
+                task = asyncio.create_task(run_page(total, *item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except Exception as e:
+            inflight.release()
+            error = str(e)
+        await results.put(("eof", total, error))
+
+    feeder = asyncio.create_task(feed())
+    emitted = failed = 0
+    total = None
+    error = None
+    try:
+        while total is None or emitted < total:
+            line = await results.get()
+            if isinstance(line, tuple):
+                _, total, error = line
+                continue
+            emitted += 1
+            failed += line["status"] == "failed"
+            yield json.dumps(line) + "\n"
+        summary = {"done": True, "pages": emitted, "failed": failed}
+        if error:
+            summary["error"] = error
+        yield json.dumps(summary) + "\n"
+    finally:
+        # Client went away or we are done: don't leave pages running in the background
+        feeder.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+@router.post("/batch")
+async def upload_batch(
+    file: UploadFile = File(...),
+    assessment_id: Optional[int] = Form(None),
+    link_duplicates: bool = Form(dedup.LINK_EXISTING),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Upload a whole class stack as one PDF or ZIP. Pages are mapped to students by roll
+    number and results stream back as NDJSON, one line per page as it finishes.
+    """
+    try:
+        # UploadFile is already spooled to disk; pages are read from it one at a time
+        pages = iter(archives.iter_pages(file.file, file.filename))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    context = await session.run_sync(pipeline.load_grading_context, assessment_id, with_roster=True)
+    return StreamingResponse(_stream_batch(pages, context, link_duplicates), media_type="application/x-ndjson")
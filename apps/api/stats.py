@@ -0,0 +1,236 @@
+"""
+Per-class and per-student score statistics for the dashboard endpoints.
+
+By default the stats are computed on read with grouped aggregates outer-joined
+to the classes / students, so a dashboard costs one query however many classes
+and students it shows. With STATS_MATERIALIZED=1 they are also kept in the
+ClassroomStats and StudentStats tables: a flush hook applies the delta of every
+Exam and Student insert, update and delete inside the same transaction, and the
+endpoints read them with a primary-key join. Writes that bypass the ORM unit of
+work (bulk UPDATEs) call rebuild() for the classes they touched; the API
+rebuilds everything at startup, so rows written while the option was off are
+picked up.
+
+Configuration (env):
+    STATS_MATERIALIZED   maintain and read the materialized stats tables (default: 0)
+"""
+import os
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, event, func, inspect, insert, or_
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, select
+
+from apps.api.models import Classroom, ClassroomStats, Exam, Student, StudentStats
+
+ENABLED = os.getenv("STATS_MATERIALIZED", "0") == "1"
+
+
+def _average(exam_count, score_sum) -> float:
+    return round(score_sum / exam_count, 1) if exam_count else 0.0
+
+
+def _student_counts(classroom_ids):
+    return (
+        select(Student.classroom_id.label("classroom_id"), func.count(Student.id).label("student_count"))
+        .where(Student.classroom_id.in_(classroom_ids))
+        .group_by(Student.classroom_id)
+        .subquery()
+    )
+
+
+def _exam_totals(key_column, keys):
+    return (
+        select(key_column.label("key"), func.count(Exam.id).label("exam_count"), func.sum(Exam.score).label("score_sum"))
+        .where(key_column.in_(keys))
+        .group_by(key_column)
+        .subquery()
+    )
+
+
+def _class_rows(classroom_ids):
+    """(classroom_id, student_count, exam_count, score_sum) for each class, in one grouped query."""
+    students = _student_counts(classroom_ids)
+    exams = _exam_totals(Exam.classroom_id, classroom_ids)
+    return (
+        select(
+            Classroom.id,
+            func.coalesce(students.c.student_count, 0),
+            func.coalesce(exams.c.exam_count, 0),
+            func.coalesce(exams.c.score_sum, 0)
+        )
+        .outerjoin(students, students.c.classroom_id == Classroom.id)
+        .outerjoin(exams, exams.c.key == Classroom.id)
+        .where(Classroom.id.in_(classroom_ids))
+    )
+
+
+def _student_rows(student_ids):
+    """(student_id, exam_count, score_sum) for each student, in one grouped query."""
+    exams = _exam_totals(Exam.student_id, student_ids)
+    return (
+        select(Student.id, func.coalesce(exams.c.exam_count, 0), func.coalesce(exams.c.score_sum, 0))
+        .outerjoin(exams, exams.c.key == Student.id)
+        .where(Student.id.in_(student_ids))
+    )
+
+
+def classes_with_stats(session: Session, teacher_id: int, class_id: Optional[int] = None) -> List[Tuple[Classroom, int, float]]:
+    """A teacher's classes (or one of them) as (classroom, student_count, average_score)."""
+    conditions = [Classroom.teacher_id == teacher_id]
+    if class_id is not None:
+        conditions.append(Classroom.id == class_id)
+
+    if ENABLED:
+        rows = session.exec(
+            select(Classroom, ClassroomStats.student_count, ClassroomStats.exam_count, ClassroomStats.score_sum)
+            .outerjoin(ClassroomStats, ClassroomStats.classroom_id == Classroom.id)
+            .where(*conditions)
+            .order_by(Classroom.id)
+        ).all()
+    else:
+        class_ids = select(Classroom.id).where(*conditions)
+        students = _student_counts(class_ids)
+        exams = _exam_totals(Exam.classroom_id, class_ids)
+        rows = session.exec(
+            select(Classroom, students.c.student_count, exams.c.exam_count, exams.c.score_sum)
+            .outerjoin(students, students.c.classroom_id == Classroom.id)
+            .outerjoin(exams, exams.c.key == Classroom.id)
+            .where(*conditions)
+            .order_by(Classroom.id)
+        ).all()
+    return [(classroom, student_count or 0, _average(exam_count, score_sum))
+            for classroom, student_count, exam_count, score_sum in rows]
+
+
+def students_with_stats(session: Session, class_id: int) -> List[Tuple[Student, float]]:
+    """The students of a class as (student, average_score over all their exams)."""
+    if ENABLED:
+        rows = session.exec(
+            select(Student, StudentStats.exam_count, StudentStats.score_sum)
+            .outerjoin(StudentStats, StudentStats.student_id == Student.id)
+            .where(Student.classroom_id == class_id)
+            .order_by(Student.id)
+        ).all()
+    else:
+        exams = _exam_totals(Exam.student_id, select(Student.id).where(Student.classroom_id == class_id))
+        rows = session.exec(
+            select(Student, exams.c.exam_count, exams.c.score_sum)
+            .outerjoin(exams, exams.c.key == Student.id)
+            .where(Student.classroom_id == class_id)
+            .order_by(Student.id)
+        ).all()
+    return [(student, _average(exam_count, score_sum)) for student, exam_count, score_sum in rows]
+
+
+def rebuild(session: Session, classroom_ids: Optional[Iterable[int]] = None):
+    """
+    Recomputes the materialized stats from the source rows, for everything or for some
+    classes (and every student with exams in them). Does not commit.
+    """
+    if classroom_ids is None:
+        class_ids = select(Classroom.id)
+        student_ids = select(Student.id)
+    else:
+        classroom_ids = list(classroom_ids)
+        class_ids = select(Classroom.id).where(Classroom.id.in_(classroom_ids))
+        student_ids = select(Student.id).where(or_(
+            Student.classroom_id.in_(classroom_ids),
+            Student.id.in_(select(Exam.student_id).where(Exam.classroom_id.in_(classroom_ids)))
+        ))
+
+    session.exec(delete(ClassroomStats).where(ClassroomStats.classroom_id.in_(class_ids)))
+    session.exec(insert(ClassroomStats).from_select(
+        ["classroom_id", "student_count", "exam_count", "score_sum"], _class_rows(class_ids)
+    ))
+    session.exec(delete(StudentStats).where(StudentStats.student_id.in_(student_ids)))
+    session.exec(insert(StudentStats).from_select(
+        ["student_id", "exam_count", "score_sum"], _student_rows(student_ids)
+    ))
+
+
+def _old_and_new(obj, name: str):
+    history = inspect(obj).attrs[name].history
+    new = history.added[0] if history.added else getattr(obj, name)
+    old = history.deleted[0] if history.deleted else new
+    return old, new
+
+
+def _upsert(connection, table, key_column: str, key: int, deltas: dict):
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    statement = dialect_insert(table).values({key_column: key, **deltas})
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[key_column],
+        set_={name: getattr(table.c, name) + value for name, value in deltas.items()}
+    ))
+
+
+def _before_flush(session, flush_context, instances):
+    classes = defaultdict(lambda: [0, 0, 0.0]) # classroom_id -> [students, exams, score sum]
+    students = defaultdict(lambda: [0, 0.0]) # student_id -> [exams, score sum]
+
+    def count_exam(classroom_id, student_id, score, sign):
+        if classroom_id is not None:
+            classes[classroom_id][1] += sign
+            classes[classroom_id][2] += sign * (score or 0)
+        if student_id is not None:
+            students[student_id][0] += sign
+            students[student_id][1] += sign * (score or 0)
+
+    for obj in session.new:
+        if isinstance(obj, Exam):
+            count_exam(obj.classroom_id, obj.student_id, obj.score, 1)
+        elif isinstance(obj, Student) and obj.classroom_id is not None:
+            classes[obj.classroom_id][0] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Exam):
+            count_exam(obj.classroom_id, obj.student_id, obj.score, -1)
+        elif isinstance(obj, Student) and obj.classroom_id is not None:
+            classes[obj.classroom_id][0] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Exam):
+            changes = [_old_and_new(obj, name) for name in ("classroom_id", "student_id", "score")]
+            if any(old != new for old, new in changes):
+                count_exam(*(old for old, _ in changes), -1)
+                count_exam(*(new for _, new in changes), 1)
+        elif isinstance(obj, Student):
+            old, new = _old_and_new(obj, "classroom_id")
+            if old != new:
+                if old is not None:
+                    classes[old][0] -= 1
+                if new is not None:
+                    classes[new][0] += 1
+
+    if not classes and not students:
+        return
+    connection = session.connection()
+    for classroom_id, (student_delta, exam_delta, score_delta) in classes.items():
+        if student_delta or exam_delta or score_delta:
+            _upsert(connection, ClassroomStats.__table__, "classroom_id", classroom_id,
+                    {"student_count": student_delta, "exam_count": exam_delta, "score_sum": score_delta})
+    for student_id, (exam_delta, score_delta) in students.items():
+        if exam_delta or score_delta:
+            _upsert(connection, StudentStats.__table__, "student_id", student_id,
+                    {"exam_count": exam_delta, "score_sum": score_delta})
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    pass
+
+
+def install():
+    """Starts maintaining the materialized stats on every flush."""
+    if event.contains(OrmSession, "before_flush", _before_flush):
+        return
+    # Load previous values on assignment so updates can subtract what they replace
+    for attribute in (Exam.score, Exam.student_id, Exam.classroom_id, Student.classroom_id):
+        event.listen(attribute, "set", _keep_old_value, active_history=True)
+    event.listen(OrmSession, "before_flush", _before_flush)
+
+
+if ENABLED:
+    install()
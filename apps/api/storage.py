@@ -0,0 +1,287 @@
+"""
+Scan image storage.
+
+Original uploads and the warped / binarized pages derived from them are kept
+content-addressed: an object's key is the sha256 of its bytes plus an extension
+for the content type (e.g. "3fa9...c1.jpg"), so identical uploads are stored
+once and a key never changes meaning. Objects are immutable; re-grading and
+re-OCR read them back instead of needing a new upload.
+
+Two backends share one small S3-style interface (put / head / get range /
+delete): LocalObjectStore keeps objects under STORAGE_DIR on local disk and is
+the default stand-in; S3ObjectStore talks to S3 or any S3-compatible server
+(MinIO, R2, ...) through boto3. Both lay keys out as ab/cd/<key>.
+
+Configuration (env):
+    STORAGE_BACKEND          local | s3 (default: local)
+    STORAGE_DIR              local root, also used for upload spooling (default: scan_store)
+    STORAGE_MAX_UPLOAD_BYTES reject uploads larger than this (default: 50 MB)
+    STORAGE_PAGE_IMAGES      also keep the warped and binarized pages (default: 1)
+    S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION   for the s3 backend
+"""
+import abc
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Optional
+
+BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+STORAGE_DIR = os.getenv("STORAGE_DIR", "scan_store")
+MAX_UPLOAD_BYTES = int(os.getenv("STORAGE_MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+PAGE_IMAGES = os.getenv("STORAGE_PAGE_IMAGES", "1") != "0"
+CHUNK_BYTES = 1024 * 1024
+
+KEY_PATTERN = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]{1,5}$")
+
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/tiff": ".tif",
+    "image/heic": ".heic",
+    "application/pdf": ".pdf",
+}
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class StoredObject:
+    key: str
+    size: int
+    content_type: str
+
+    @property
+    def etag(self) -> str:
+        return self.key.split(".", 1)[0]
+
+
+def sniff_content_type(head: bytes, declared: Optional[str] = None) -> Optional[str]:
+    """Content type from the file's magic bytes; the client's declared type is only a fallback."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"%PDF"):
+        return "application/pdf"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if head[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return declared
+
+
+def extension_for(content_type: Optional[str]) -> str:
+    return EXTENSIONS.get((content_type or "").split(";")[0].strip().lower(), ".bin")
+
+
+def content_type_for(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+def is_valid_key(key: str) -> bool:
+    return bool(KEY_PATTERN.match(key or ""))
+
+
+def shard_path(key: str) -> str:
+    return f"{key[:2]}/{key[2:4]}/{key}"
+
+
+def url_for(key: str) -> str:
+    """Public URL of an object, served by GET /api/v1/scan/images/{key}."""
+    return f"/api/v1/scan/images/{key}"
+
+
+def _spool(fileobj: BinaryIO, directory: str, max_bytes: int):
+    """
+    Copies a stream to a temp file chunk by chunk while hashing it.
+    Returns (temp path, sha256, size, first bytes).
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    fd, temp_path = tempfile.mkstemp(prefix=".upload-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = fileobj.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                if not head:
+                    head = bytes(chunk[:16])
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size, head
+
+
+class ObjectStore(abc.ABC):
+    """S3-style interface over immutable, content-addressed objects."""
+
+    @abc.abstractmethod
+    def put_stream(self, fileobj: BinaryIO, content_type: Optional[str] = None,
+                   max_bytes: int = MAX_UPLOAD_BYTES) -> StoredObject:
+        ...
+
+    @abc.abstractmethod
+    def put_bytes(self, data: bytes, content_type: Optional[str] = None) -> StoredObject:
+        ...
+
+    @abc.abstractmethod
+    def head(self, key: str) -> Optional[StoredObject]:
+        ...
+
+    @abc.abstractmethod
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Yields bytes start..end (inclusive, like an HTTP Range) in chunks."""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        ...
+
+    def read_bytes(self, key: str) -> bytes:
+        return b"".join(self.get_range(key))
+
+
+class LocalObjectStore(ObjectStore):
+    def __init__(self, root: str = STORAGE_DIR):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        if not is_valid_key(key):
+            raise KeyError(key)
+        return os.path.join(self.root, shard_path(key))
+
+    def _commit(self, temp_path: str, key: str):
+        final_path = self.path(key)
+        if os.path.exists(final_path):
+            # Same content already stored
+            os.remove(temp_path)
+            return
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(temp_path, final_path) # atomic: readers never see a partial object
+
+    def put_stream(self, fileobj: BinaryIO, content_type: Optional[str] = None,
+                   max_bytes: int = MAX_UPLOAD_BYTES) -> StoredObject:
+        temp_path, sha256, size, head = _spool(fileobj, self.root, max_bytes)
+        key = sha256 + extension_for(sniff_content_type(head, content_type))
+        self._commit(temp_path, key)
+        return StoredObject(key, size, content_type_for(key))
+
+    def put_bytes(self, data: bytes, content_type: Optional[str] = None) -> StoredObject:
+        key = hashlib.sha256(data).hexdigest() + extension_for(sniff_content_type(bytes(data[:16]), content_type))
+        if not os.path.exists(self.path(key)):
+            os.makedirs(self.root, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix=".put-", dir=self.root)
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            self._commit(temp_path, key)
+        return StoredObject(key, len(data), content_type_for(key))
+
+    def head(self, key: str) -> Optional[StoredObject]:
+        try:
+            size = os.path.getsize(self.path(key))
+        except (KeyError, OSError):
+            return None
+        return StoredObject(key, size, content_type_for(key))
+
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with open(self.path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_BYTES if remaining is None else min(CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3ObjectStore(ObjectStore):
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 spool_dir: str = STORAGE_DIR):
+        import boto3 # optional dependency, only needed for STORAGE_BACKEND=s3
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.spool_dir = spool_dir
+
+    def object_key(self, key: str) -> str:
+        if not is_valid_key(key):
+            raise KeyError(key)
+        return self.prefix + shard_path(key)
+
+    def _exists(self, key: str) -> bool:
+        return self.head(key) is not None
+
+    def put_stream(self, fileobj: BinaryIO, content_type: Optional[str] = None,
+                   max_bytes: int = MAX_UPLOAD_BYTES) -> StoredObject:
+        # The key is the content hash, so the stream is spooled locally before uploading
+        temp_path, sha256, size, head = _spool(fileobj, self.spool_dir, max_bytes)
+        key = sha256 + extension_for(sniff_content_type(head, content_type))
+        try:
+            if not self._exists(key):
+                self.client.upload_file(temp_path, self.bucket, self.object_key(key),
+                                        ExtraArgs={"ContentType": content_type_for(key)})
+        finally:
+            os.remove(temp_path)
+        return StoredObject(key, size, content_type_for(key))
+
+    def put_bytes(self, data: bytes, content_type: Optional[str] = None) -> StoredObject:
+        key = hashlib.sha256(data).hexdigest() + extension_for(sniff_content_type(bytes(data[:16]), content_type))
+        if not self._exists(key):
+            self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=data,
+                                   ContentType=content_type_for(key))
+        return StoredObject(key, len(data), content_type_for(key))
+
+    def head(self, key: str) -> Optional[StoredObject]:
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except (KeyError, ClientError):
+            return None
+        return StoredObject(key, response["ContentLength"], content_type_for(key))
+
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key), Range=byte_range)
+        yield from response["Body"].iter_chunks(CHUNK_BYTES)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+
+def create_store(backend: str = BACKEND) -> ObjectStore:
+    if backend == "local":
+        return LocalObjectStore(STORAGE_DIR)
+    if backend == "s3":
+        return S3ObjectStore(
+            bucket=os.environ["S3_BUCKET"],
+            prefix=os.getenv("S3_PREFIX", ""),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            region=os.getenv("S3_REGION"),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}' (expected 'local' or 's3')")
+
+
+store = create_store()
@@ -0,0 +1,103 @@
+"""
+Test setup. Configuration is read from the environment when the app modules are
+imported, so the tests run in a throwaway working directory, where the
+database, result cache and scan files land by default. The model is the
+deterministic fake backend (LLM_BACKEND=fake), so no API key or network is
+needed. Run from the repo root:
+
+    pytest apps/api/tests/
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+TEST_DIR = tempfile.mkdtemp(prefix="exam_api_tests_")
+# Database, caches and scan files default to paths relative to the working directory
+os.chdir(TEST_DIR)
+os.environ["LLM_BACKEND"] = "fake"
+os.environ["FAKE_LLM_LATENCY_MS"] = "5"
+os.environ["FAKE_LLM_LATENCY_SIGMA"] = "0"
+os.environ["LLM_MAX_RETRIES"] = "1"
+os.environ["LLM_BACKOFF_BASE_SECONDS"] = "0.01"
+os.environ["SCAN_JOB_POLL_SECONDS"] = "0.1"
+os.environ["SCAN_PROCESS_WORKERS"] = "2"
+os.environ["SCORING_BATCH_WAIT_MS"] = "20"
+
+
+def pytest_unconfigure(config):
+    os.chdir(ROOT)
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """The app with its lifespan running: job runners, worker pool, migrations."""
+    from fastapi.testclient import TestClient
+    from apps.api.main import app
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def teacher(client) -> dict:
+    """A freshly registered user: {"email", "token", "headers"}."""
+    email = f"teacher-{uuid.uuid4().hex[:8]}@example.com"
+    assert client.post("/auth/register", json={"email": email, "password": "pw", "full_name": "Teacher"}).status_code == 200
+    token = client.post("/auth/token", data={"username": email, "password": "pw"}).json()["access_token"]
+    return {"email": email, "token": token, "headers": {"Authorization": f"Bearer {token}"}}
+
+
+@pytest.fixture
+def graded_assessment(client, teacher) -> int:
+    """An assessment with a rubric of its own, so its grades never come from another test's cache entries."""
+    headers = teacher["headers"]
+    classroom = client.post("/classes/", json={"name": "Biology 1", "subject": "Biology"}, headers=headers).json()
+    rubric = client.post("/rubrics/", json={
+        "title": "Cells",
+        "criteria": [{"description": f"Names the organelles ({uuid.uuid4().hex[:8]})", "weight": 100}],
+    }, headers=headers).json()
+    assessment = client.post("/assessments/", json={
+        "title": "Quiz", "classroom_id": classroom["id"], "rubric_id": rubric["id"]
+    }, headers=headers).json()
+    return assessment["id"]
+
+
+@pytest.fixture
+def page_image():
+    """Factory for a JPEG photo of a written page; different text gives a different image."""
+    import cv2
+    import numpy as np
+
+    def make(text: str = "") -> bytes:
+        image = np.full((1200, 900, 3), 60, np.uint8)
+        cv2.rectangle(image, (100, 100), (800, 1100), (245, 245, 245), -1)
+        for line in range(6):
+            cv2.putText(image, f"{line + 1}. Answer {text} {line}", (130, 180 + line * 120),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, (20, 20, 20), 2)
+        return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+    return make
+
+
+@pytest.fixture
+def wait_for_job(client):
+    """Polls a scan / regrade job until it is done or failed and returns its full status."""
+    def wait(job_id: str, timeout: float = 60) -> dict:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = client.get(f"/api/v1/scan/jobs/{job_id}").json()
+            if job["status"] in ("done", "failed"):
+                return job
+            time.sleep(0.1)
+        raise AssertionError(f"job {job_id} still {job['status']} after {timeout}s")
+
+    return wait
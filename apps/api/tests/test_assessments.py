@@ -0,0 +1,73 @@
+"""Keyset-paginated exam listings."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session
+
+from apps.api.database import engine
+from apps.api.models import Exam
+
+
+@pytest.fixture
+def assessment(client, teacher) -> int:
+    headers = teacher["headers"]
+    classroom = client.post("/classes/", json={"name": "History", "subject": "History"}, headers=headers).json()
+    assessment = client.post("/assessments/", json={"title": "Essay", "classroom_id": classroom["id"]}, headers=headers).json()
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        # Three exams per timestamp exercise the id tiebreak of the cursor
+        session.add_all([
+            Exam(title=f"e{index}", image_url="", feedback="f" * 100, ocr_content="o" * 500, score=index,
+                 created_at=now - timedelta(seconds=index // 3), assessment_id=assessment["id"])
+            for index in range(95)
+        ])
+        session.commit()
+    return assessment["id"]
+
+
+def test_cursor_pages_cover_every_exam_once_in_order(client, teacher, assessment):
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 20, "fields": "summary", **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/assessments/{assessment}/exams", params=params, headers=teacher["headers"])
+        assert response.status_code == 200
+        seen += response.json()
+        pages += 1
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+
+    assert pages == 5
+    assert len(seen) == 95
+    assert len({exam["id"] for exam in seen}) == 95
+    keys = [(exam["created_at"], exam["id"]) for exam in seen]
+    assert keys == sorted(keys, reverse=True)
+    assert "ocr_content" not in seen[0]
+
+
+def test_rows_added_meanwhile_do_not_shift_pages(client, teacher, assessment):
+    first = client.get(f"/assessments/{assessment}/exams", params={"limit": 10}, headers=teacher["headers"])
+    with Session(engine) as session:
+        session.add(Exam(title="late", image_url="", feedback="", score=0, assessment_id=assessment))
+        session.commit()
+    second = client.get(f"/assessments/{assessment}/exams",
+                        params={"limit": 10, "cursor": first.headers["x-next-cursor"]}, headers=teacher["headers"])
+
+    # The newer row sorts before the cursor: page two continues exactly where page one ended
+    listing = client.get(f"/assessments/{assessment}/exams", params={"limit": 100}, headers=teacher["headers"]).json()
+    assert listing[0]["title"] == "late"
+    assert [exam["id"] for exam in first.json()] == [exam["id"] for exam in listing[1:11]]
+    assert [exam["id"] for exam in second.json()] == [exam["id"] for exam in listing[11:21]]
+
+
+def test_bad_cursor_and_fields(client, teacher, assessment):
+    headers = teacher["headers"]
+    assert client.get(f"/assessments/{assessment}/exams", params={"cursor": "zzz"}, headers=headers).status_code == 400
+    assert client.get(f"/assessments/{assessment}/exams", params={"fields": "nope"}, headers=headers).status_code == 400
+
+
+def test_other_teachers_cannot_list(client, assessment):
+    client.post("/auth/register", json={"email": "outsider@example.com", "password": "pw"})
+    token = client.post("/auth/token", data={"username": "outsider@example.com", "password": "pw"}).json()["access_token"]
+    response = client.get(f"/assessments/{assessment}/exams", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code in (403, 404)
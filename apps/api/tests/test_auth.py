@@ -0,0 +1,41 @@
+"""Bearer token -> user cache and its invalidation."""
+from sqlmodel import Session, select
+
+from apps.api import auth
+from apps.api.database import engine
+from apps.api.models import User
+
+
+def load_user(email: str, session: Session) -> User:
+    return session.exec(select(User).where(User.email == email)).one()
+
+
+def test_repeat_requests_hit_the_cache(client, teacher):
+    assert client.get("/auth/me", headers=teacher["headers"]).status_code == 200
+    hits = auth.user_cache.stats()["hits"]
+    for _ in range(3):
+        assert client.get("/auth/me", headers=teacher["headers"]).json()["email"] == teacher["email"]
+    assert auth.user_cache.stats()["hits"] == hits + 3
+
+
+def test_user_update_invalidates_cached_token(client, teacher):
+    assert client.get("/auth/me", headers=teacher["headers"]).json()["full_name"] == "Teacher"
+    with Session(engine) as session:
+        user = load_user(teacher["email"], session)
+        user.full_name = "Renamed"
+        session.add(user)
+        session.commit()
+    assert client.get("/auth/me", headers=teacher["headers"]).json()["full_name"] == "Renamed"
+
+
+def test_user_delete_invalidates_cached_token(client, teacher):
+    assert client.get("/auth/me", headers=teacher["headers"]).status_code == 200
+    assert client.get("/classes/", headers=teacher["headers"]).status_code == 200
+    with Session(engine) as session:
+        session.delete(load_user(teacher["email"], session))
+        session.commit()
+    assert client.get("/auth/me", headers=teacher["headers"]).status_code == 401
+
+
+def test_invalid_token(client):
+    assert client.get("/classes/", headers={"Authorization": "Bearer not-a-token"}).status_code == 401
@@ -0,0 +1,163 @@
+"""ScoringAgent: batched vs single grading, the result cache, and model outages."""
+import asyncio
+import uuid
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+from sqlmodel import Session
+
+from apps.api import workers
+from apps.api.agents.llm_client import llm_client, LLMUnavailableError
+from apps.api.agents.scoring_agent import ScoringAgent, GradingError
+from apps.api.cache import grading_cache
+from apps.api.compiled_rubrics import compile_rubric
+from apps.api.database import engine
+from apps.api.models import Rubric
+
+RESPONSES = [f"Q1: The mitochondria is the powerhouse of the cell, answer {index}" for index in range(5)]
+
+
+@pytest.fixture
+def rubric() -> dict:
+    # A unique criterion gives every test its own cache tag
+    return {
+        "title": "Cells",
+        "criteria": [{"description": f"Names the organelles {uuid.uuid4().hex[:8]}", "weight": 100}],
+        "handwriting_weight": 20,
+    }
+
+
+@pytest.fixture
+def no_cache(monkeypatch):
+    monkeypatch.setattr(grading_cache, "enabled", False)
+
+
+def grades(results):
+    return [(result["content_score"], result["handwriting_score"], result["final_score"], result["feedback"]) for result in results]
+
+
+def test_batch_matches_single_grading(rubric, no_cache):
+    agent = ScoringAgent()
+
+    async def grade():
+        batch = await agent.evaluate_batch(RESPONSES, rubric, api_key="offline")
+        single = [await agent.evaluate_submission(response, rubric, api_key="offline") for response in RESPONSES]
+        return batch, single
+
+    batch, single = asyncio.run(grade())
+    assert grades(batch) == grades(single)
+
+
+def test_concurrent_grading_is_batched_and_matches_single(rubric, no_cache):
+    compiled = compile_rubric(rubric)
+    calls_before = llm_client.backend.calls
+
+    async def grade():
+        return await asyncio.gather(*[workers.run_grading(response, compiled, api_key="offline") for response in RESPONSES])
+
+    batched = asyncio.run(grade())
+    assert llm_client.backend.calls - calls_before < len(RESPONSES)
+
+    async def grade_singly():
+        return [await ScoringAgent().evaluate_submission(response, compiled, api_key="offline") for response in RESPONSES]
+
+    assert grades(batched) == grades(asyncio.run(grade_singly()))
+
+
+def test_repeat_grading_is_served_from_cache(rubric):
+    agent = ScoringAgent()
+    calls_before = llm_client.backend.calls
+    hits_before = grading_cache.stats()["hits"]
+
+    first = asyncio.run(agent.evaluate_submission(RESPONSES[0], rubric, api_key="offline"))
+    again = asyncio.run(agent.evaluate_submission(RESPONSES[0], rubric, api_key="offline"))
+
+    assert again == first
+    assert llm_client.backend.calls - calls_before == 1
+    assert grading_cache.stats()["hits"] == hits_before + 1
+
+
+def test_cache_misses_for_changed_response_or_rubric(rubric):
+    agent = ScoringAgent()
+    asyncio.run(agent.evaluate_submission(RESPONSES[0], rubric, api_key="offline"))
+    calls_before = llm_client.backend.calls
+
+    asyncio.run(agent.evaluate_submission(RESPONSES[1], rubric, api_key="offline"))
+    changed = dict(rubric, handwriting_weight=50)
+    asyncio.run(agent.evaluate_submission(RESPONSES[0], changed, api_key="offline"))
+
+    assert llm_client.backend.calls - calls_before == 2
+
+
+def test_whitespace_only_changes_still_hit(rubric):
+    agent = ScoringAgent()
+    asyncio.run(agent.evaluate_submission(RESPONSES[0], rubric, api_key="offline"))
+    calls_before = llm_client.backend.calls
+    asyncio.run(agent.evaluate_submission("  " + RESPONSES[0].replace(" ", "   ") + "\n", rubric, api_key="offline"))
+    assert llm_client.backend.calls == calls_before
+
+
+def test_invalidating_a_rubric_tag_drops_its_entries(rubric):
+    agent = ScoringAgent()
+    asyncio.run(agent.evaluate_batch(RESPONSES[:3], rubric, api_key="offline"))
+
+    assert grading_cache.invalidate_tag(compile_rubric(rubric).tag) == 3
+
+    calls_before = llm_client.backend.calls
+    asyncio.run(agent.evaluate_submission(RESPONSES[0], rubric, api_key="offline"))
+    assert llm_client.backend.calls - calls_before == 1
+
+
+def test_editing_a_rubric_drops_its_cached_grades(client, teacher, rubric):
+    created = client.post("/rubrics/", json=rubric, headers=teacher["headers"]).json()
+    agent = ScoringAgent()
+
+    def grade():
+        with Session(engine) as session:
+            stored = session.get(Rubric, created["id"])
+        return asyncio.run(agent.evaluate_submission(RESPONSES[0], stored, api_key="offline"))
+
+    grade()
+    calls_before = llm_client.backend.calls
+    grade()
+    assert llm_client.backend.calls == calls_before # cached
+
+    edited = dict(rubric, handwriting_weight=40)
+    assert client.put(f"/rubrics/{created['id']}", json=edited, headers=teacher["headers"]).status_code == 200
+    grade()
+    assert llm_client.backend.calls - calls_before == 1
+
+    # The pre-edit entries are gone, not just unreachable: reverting the edit regrades
+    assert client.put(f"/rubrics/{created['id']}", json=rubric, headers=teacher["headers"]).status_code == 200
+    grade()
+    assert llm_client.backend.calls - calls_before == 2
+
+
+def test_malformed_criteria_entries_are_skipped():
+    compiled = compile_rubric({"title": "Mixed", "criteria": ["Spelling", 40, None, {"description": "Grammar", "weight": 60}]})
+    assert [(c.description, c.weight) for c in compiled.criteria] == [("Grammar", 60.0)]
+    assert compiled.criteria_text == "- Grammar (Weight: 60%)"
+
+
+def test_outage_raises_instead_of_scoring_zero(rubric, monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise api_exceptions.ServiceUnavailable("model down")
+
+    monkeypatch.setattr(llm_client.backend, "generate_once", unavailable)
+    agent = ScoringAgent()
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(agent.evaluate_submission(RESPONSES[0], rubric, api_key="offline"))
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(agent.evaluate_batch(RESPONSES, rubric, api_key="offline"))
+
+
+def test_unusable_answer_raises_grading_error(rubric, monkeypatch):
+    async def garbled(*args, **kwargs):
+        return "I cannot grade this."
+
+    monkeypatch.setattr(llm_client.backend, "generate_once", garbled)
+    agent = ScoringAgent()
+    with pytest.raises(GradingError):
+        asyncio.run(agent.evaluate_submission(RESPONSES[0], rubric, api_key="offline"))
+    results = asyncio.run(agent.evaluate_batch(RESPONSES[:2], rubric, api_key="offline"))
+    assert all(isinstance(result, GradingError) for result in results)
@@ -0,0 +1,124 @@
+"""
+Query plans of the hot list / stats / queue queries, checked with EXPLAIN QUERY
+PLAN against a seeded SQLite database built with create_all plus migrations.py,
+like production. A query fails if it scans a whole table or sorts in a temp
+B-tree instead of reading an index in order.
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from apps.api import jobs, migrations, stats
+from apps.api.models import Assessment, Classroom, Exam, Rubric, ScanJob, Student, User
+from apps.api.routers.assessments import exam_fields, exam_listing_query
+
+SEED_EXAMS = 5000
+
+
+def seed(engine, exams: int) -> dict:
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        teachers = [User(email=f"t{i}@example.com", hashed_password="x") for i in range(20)]
+        session.add_all(teachers)
+        session.flush()
+        classes = [Classroom(name=f"C{i}", subject="Biology", teacher_id=teachers[i % 20].id) for i in range(100)]
+        session.add_all(classes)
+        session.flush()
+        students = [Student(name=f"S{i}", roll_number=str(i), classroom_id=classes[i % 100].id) for i in range(3000)]
+        assessments = [Assessment(title=f"A{i}", classroom_id=classes[i % 100].id, date=now - timedelta(days=i))
+                       for i in range(500)]
+        session.add_all(students + assessments)
+        session.add_all([Rubric(title=f"R{i}", teacher_id=teachers[i % 20].id) for i in range(100)])
+        session.flush()
+        session.add_all([
+            Exam(title="seed", image_url="", feedback="", score=rng.randint(0, 100),
+                 created_at=now - timedelta(minutes=i), student_id=students[i % 3000].id,
+                 classroom_id=classes[i % 100].id, assessment_id=assessments[i % 500].id)
+            for i in range(exams)
+        ])
+        session.add_all([ScanJob(id=f"job-{i}", status="done" if i % 100 else rng.choice(["queued", "running", "failed"]))
+                         for i in range(5000)])
+        session.commit()
+        return {"teacher_id": teachers[0].id, "class_id": classes[0].id, "assessment_id": assessments[0].id}
+
+
+def hot_queries(ids: dict) -> dict:
+    """The statements behind the routers and the job queue, by name."""
+    return {
+        "classes of a teacher": select(Classroom).where(Classroom.teacher_id == ids["teacher_id"]),
+        "rubrics of a teacher": select(Rubric).where(Rubric.teacher_id == ids["teacher_id"]),
+        "assessments of a class": select(Assessment)
+            .where(Assessment.classroom_id == ids["class_id"])
+            .order_by(Assessment.date.desc()).limit(100),
+        "exams of an assessment": exam_listing_query(ids["assessment_id"], exam_fields("summary")).limit(101),
+        "exams of an assessment, next page": exam_listing_query(
+            ids["assessment_id"], exam_fields("summary"), (datetime.utcnow() - timedelta(days=7), 10**9)
+        ).limit(101),
+        "class roster": select(Student.id, Student.roll_number).where(Student.classroom_id == ids["class_id"]),
+        "job claim": jobs.claim_candidates_query(datetime.utcnow()),
+    }
+
+
+QUERY_NAMES = list(hot_queries({"teacher_id": 0, "class_id": 0, "assessment_id": 0})) + ["class stats", "student stats"]
+
+
+def captured(engine, fn) -> list:
+    """SQL statements (with parameters) issued by fn(session)."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        with Session(engine) as session:
+            fn(session)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    return statements
+
+
+def problems(plan: list) -> list:
+    bad = []
+    for row in plan:
+        detail = row[-1]
+        if detail.startswith("SCAN ") and "INDEX" not in detail and "SUBQUERY" not in detail:
+            bad.append(detail)
+        if "USE TEMP B-TREE" in detail:
+            bad.append(detail)
+    return bad
+
+
+@pytest.fixture(scope="module")
+def plans(tmp_path_factory):
+    """EXPLAIN QUERY PLAN rows of every statement each hot query issues, by name."""
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}")
+    SQLModel.metadata.create_all(engine)
+    ids = seed(engine, SEED_EXAMS)
+    migrations.upgrade(engine) # also ANALYZEs the seeded data
+
+    statements = {}
+    for name, query in hot_queries(ids).items():
+        statements[name] = captured(engine, lambda session: session.execute(query).all())
+    statements["class stats"] = captured(engine, lambda session: stats.classes_with_stats(session, ids["teacher_id"]))
+    statements["student stats"] = captured(engine, lambda session: stats.students_with_stats(session, ids["class_id"]))
+
+    with engine.connect() as connection:
+        result = {
+            name: [connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+                   for statement, parameters in issued]
+            for name, issued in statements.items()
+        }
+    engine.dispose()
+    return result
+
+
+@pytest.mark.parametrize("name", QUERY_NAMES)
+def test_query_reads_an_index(plans, name):
+    assert plans[name], f"{name} issued no statement"
+    for plan in plans[name]:
+        assert not problems(plan), f"{name}: " + "; ".join(row[-1] for row in plan)
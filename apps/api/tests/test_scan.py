@@ -0,0 +1,197 @@
+"""Upload -> job -> graded, model outages on the way, bulk uploads, and serving the stored scan images."""
+import io
+import json
+import zipfile
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+from apps.api import archives, jobs
+from apps.api.agents.llm_client import llm_client
+
+
+def upload(client, image: bytes, assessment_id=None) -> str:
+    data = {"assessment_id": str(assessment_id)} if assessment_id else {}
+    response = client.post("/api/v1/scan/upload", files={"file": ("page.jpg", image, "image/jpeg")}, data=data)
+    assert response.status_code == 202
+    # A runner may already have claimed it
+    assert response.json()["status"] in ("queued", "running")
+    return response.json()["job_id"]
+
+
+@pytest.fixture
+def graded_job(client, graded_assessment, page_image, wait_for_job) -> dict:
+    return wait_for_job(upload(client, page_image("graded"), graded_assessment))
+
+
+def test_upload_is_graded(client, graded_job):
+    assert graded_job["status"] == "done", graded_job["error"]
+    result = graded_job["result"]
+    assert result["status"] == "graded"
+    assert result["exam_id"] == graded_job["exam_id"]
+    assert 0 <= result["score"] <= 100
+    assert result["feedback"].startswith("[fake]")
+
+    progress = client.get(f"/api/v1/scan/jobs/{graded_job['job_id']}/progress").json()
+    assert progress == {"job_id": graded_job["job_id"], "status": "done", "stage": None, "progress": 1.0}
+
+
+def test_upload_without_assessment_is_not_graded(client, page_image, wait_for_job):
+    job = wait_for_job(upload(client, page_image("ungraded")))
+    assert job["status"] == "done", job["error"]
+    assert job["result"]["status"] == "processed_no_grading"
+
+
+def test_unknown_job(client):
+    assert client.get("/api/v1/scan/jobs/nope").status_code == 404
+
+
+def test_llm_outage_requeues_then_fails_without_a_score(client, graded_assessment, page_image, wait_for_job, monkeypatch):
+    calls = []
+
+    async def unavailable(*args, **kwargs):
+        calls.append(1)
+        raise api_exceptions.ServiceUnavailable("model down")
+
+    monkeypatch.setattr(llm_client.backend, "generate_once", unavailable)
+    job = wait_for_job(upload(client, page_image("outage"), graded_assessment))
+
+    assert job["status"] == "failed"
+    assert job["attempts"] == jobs.MAX_ATTEMPTS # requeued after each outage, not given up on the first
+    assert "unavailable" in job["error"]
+    assert job["exam_id"] is None # no exam saved with a zero score
+    assert len(calls) >= jobs.MAX_ATTEMPTS
+
+
+def test_evaluate_returns_503_when_llm_unavailable(client, graded_job, monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise api_exceptions.TooManyRequests("quota exhausted")
+
+    monkeypatch.setattr(llm_client.backend, "generate_once", unavailable)
+    rubric = {"title": "Ad hoc", "criteria": [{"description": "Fresh criterion for 503", "weight": 100}]}
+    response = client.post(f"/api/v1/evaluate/{graded_job['job_id']}", json={"rubric": rubric})
+    assert response.status_code == 503
+
+
+def test_evaluate_grades_a_processed_submission(client, graded_job):
+    rubric = {"title": "Ad hoc", "criteria": [{"description": "Spelling", "weight": 100}]}
+    response = client.post(f"/api/v1/evaluate/{graded_job['job_id']}", json={"rubric": rubric})
+    assert response.status_code == 200
+    assert 0 <= response.json()["final_score"] <= 100
+
+
+class TestBatchUpload:
+    @pytest.fixture
+    def roster(self, client, teacher) -> dict:
+        """An assessment in a class of two students: {"assessment_id", "students": roll number -> id}."""
+        headers = teacher["headers"]
+        classroom = client.post("/classes/", json={"name": "Biology 2", "subject": "Biology"}, headers=headers).json()
+        students = {
+            roll: client.post(f"/classes/{classroom['id']}/students", json={"name": roll, "roll_number": roll},
+                              headers=headers).json()["id"]
+            for roll in ("B-101", "B-102")
+        }
+        rubric = client.post("/rubrics/", json={"title": "Cells", "criteria": [{"description": "Batch", "weight": 100}]},
+                             headers=headers).json()
+        assessment = client.post("/assessments/", json={
+            "title": "Batch quiz", "classroom_id": classroom["id"], "rubric_id": rubric["id"]
+        }, headers=headers).json()
+        return {"assessment_id": assessment["id"], "students": students}
+
+    def post_batch(self, client, filename: str, contents: bytes, assessment_id=None):
+        data = {"assessment_id": str(assessment_id)} if assessment_id else {}
+        return client.post("/api/v1/scan/batch", files={"file": (filename, contents, "application/octet-stream")}, data=data)
+
+    def test_zip_pages_map_to_students_by_file_name(self, client, roster, page_image):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("scans/B-102.jpg", page_image("batch two"))
+            archive.writestr("scans/B-101.jpg", page_image("batch one"))
+            archive.writestr("scans/notes.txt", "not a page")
+            archive.writestr("scans/B-103.jpg", b"not an image")
+
+        response = self.post_batch(client, "class.zip", buffer.getvalue(), roster["assessment_id"])
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+
+        *pages, summary = lines
+        assert summary == {"done": True, "pages": 3, "failed": 1}
+        by_source = {line["source"]: line for line in pages}
+        assert sorted(by_source) == ["scans/B-101.jpg", "scans/B-102.jpg", "scans/B-103.jpg"]
+        assert sorted(line["page"] for line in pages) == [1, 2, 3]
+        for roll in ("B-101", "B-102"):
+            line = by_source[f"scans/{roll}.jpg"]
+            assert line["status"] == "graded", line
+            assert line["student_id"] == roster["students"][roll]
+            assert line["exam_id"] and 0 <= line["score"] <= 100
+        assert by_source["scans/B-103.jpg"]["status"] == "failed"
+        assert by_source["scans/B-103.jpg"]["error"]
+
+    def test_unsupported_upload_is_rejected(self, client):
+        response = self.post_batch(client, "notes.txt", b"just some text")
+        assert response.status_code == 400
+        assert "PDF or ZIP" in response.json()["detail"]
+
+    def test_detect_kind(self):
+        assert archives.detect_kind(io.BytesIO(b"%PDF-1.7 ..."), "scan.bin") == "pdf"
+        assert archives.detect_kind(io.BytesIO(b"PK\x03\x04..."), None) == "zip"
+        assert archives.detect_kind(io.BytesIO(b"????"), "class.ZIP") == "zip"
+        with pytest.raises(ValueError):
+            archives.detect_kind(io.BytesIO(b"GIF89a"), "page.gif")
+
+    def test_pdf_pages_are_rendered_in_order(self):
+        pdfium = pytest.importorskip("pypdfium2")
+        document = pdfium.PdfDocument.new()
+        for _ in range(2):
+            document.new_page(200, 300)
+        buffer = io.BytesIO()
+        document.save(buffer)
+        document.close()
+
+        buffer.seek(0)
+        pages = list(archives.iter_pages(buffer, "class.pdf"))
+        assert [name for name, _ in pages] == ["page-1", "page-2"]
+        assert all(image.startswith(b"\x89PNG") for _, image in pages)
+
+
+class TestImageRanges:
+    @pytest.fixture
+    def image(self, client, graded_job):
+        url = graded_job["result"]["image_url"]
+        full = client.get(url)
+        assert full.status_code == 200
+        return url, full.content
+
+    def test_full_download(self, client, image):
+        url, content = image
+        response = client.get(url)
+        assert response.headers["accept-ranges"] == "bytes"
+        assert int(response.headers["content-length"]) == len(content)
+        assert "immutable" in response.headers["cache-control"]
+
+    def test_byte_range(self, client, image):
+        url, content = image
+        response = client.get(url, headers={"Range": "bytes=10-19"})
+        assert response.status_code == 206
+        assert response.content == content[10:20]
+        assert response.headers["content-range"] == f"bytes 10-19/{len(content)}"
+
+    def test_open_ended_and_suffix_ranges(self, client, image):
+        url, content = image
+        tail = client.get(url, headers={"Range": f"bytes={len(content) - 5}-"})
+        assert tail.status_code == 206 and tail.content == content[-5:]
+        suffix = client.get(url, headers={"Range": "bytes=-7"})
+        assert suffix.status_code == 206 and suffix.content == content[-7:]
+        past_end = client.get(url, headers={"Range": f"bytes=0-{len(content) + 100}"})
+        assert past_end.status_code == 206 and past_end.content == content
+
+    def test_unsatisfiable_range(self, client, image):
+        url, content = image
+        response = client.get(url, headers={"Range": f"bytes={len(content)}-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{len(content)}"
+
+    def test_missing_and_invalid_keys(self, client):
+        assert client.get("/api/v1/scan/images/" + "0" * 64 + ".jpg").status_code == 404
+        assert client.get("/api/v1/scan/images/not-a-key").status_code == 404
@@ -0,0 +1,116 @@
+"""S3ObjectStore against an in-memory stand-in for boto3."""
+import io
+import os
+import re
+import sys
+import types
+
+import pytest
+
+from apps.api import storage
+
+JPEG = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 4
+
+
+class ClientError(Exception):
+    pass
+
+
+class FakeBody:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def iter_chunks(self, chunk_size: int):
+        for offset in range(0, len(self.data), chunk_size):
+            yield self.data[offset:offset + chunk_size]
+
+
+class FakeS3Client:
+    """The handful of S3 calls S3ObjectStore makes, with S3's Range semantics."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = 0
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.uploads += 1
+        self.objects[(Bucket, Key)] = (bytes(Body), ContentType)
+
+    def upload_file(self, path, bucket, key, ExtraArgs):
+        with open(path, "rb") as f:
+            self.put_object(Bucket=bucket, Key=key, Body=f.read(), ContentType=ExtraArgs["ContentType"])
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError("404")
+        return {"ContentLength": len(self.objects[(Bucket, Key)][0])}
+
+    def get_object(self, Bucket, Key, Range):
+        data = self.objects[(Bucket, Key)][0]
+        start, end = re.match(r"bytes=(\d+)-(\d*)$", Range).groups()
+        return {"Body": FakeBody(data[int(start):int(end) + 1 if end else None])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    client = FakeS3Client()
+    boto3 = types.ModuleType("boto3")
+    boto3.client = lambda service, **kwargs: client
+    exceptions = types.ModuleType("botocore.exceptions")
+    exceptions.ClientError = ClientError
+    botocore = types.ModuleType("botocore")
+    botocore.exceptions = exceptions
+    monkeypatch.setitem(sys.modules, "boto3", boto3)
+    monkeypatch.setitem(sys.modules, "botocore", botocore)
+    monkeypatch.setitem(sys.modules, "botocore.exceptions", exceptions)
+    store = storage.S3ObjectStore("scans", prefix="/exams/", spool_dir=str(tmp_path))
+    return store, client
+
+
+def test_object_store_is_abstract():
+    with pytest.raises(TypeError):
+        storage.ObjectStore()
+
+
+def test_put_bytes_is_content_addressed(s3):
+    store, client = s3
+    stored = store.put_bytes(JPEG)
+    assert stored.key.endswith(".jpg") and storage.is_valid_key(stored.key)
+    assert stored.size == len(JPEG)
+    assert client.objects[("scans", "exams/" + storage.shard_path(stored.key))] == (JPEG, "image/jpeg")
+
+    assert store.put_bytes(JPEG) == stored
+    assert client.uploads == 1 # already stored: no second upload
+
+
+def test_put_stream_spools_then_uploads(s3, tmp_path):
+    store, client = s3
+    stored = store.put_stream(io.BytesIO(JPEG), "application/octet-stream")
+    assert stored == store.put_bytes(JPEG)
+    assert client.uploads == 1
+    assert os.listdir(tmp_path) == [] # spool file removed
+
+    with pytest.raises(storage.UploadTooLarge):
+        store.put_stream(io.BytesIO(JPEG), max_bytes=100)
+    assert os.listdir(tmp_path) == []
+
+
+def test_get_and_ranges(s3):
+    store, _ = s3
+    key = store.put_bytes(JPEG).key
+    assert store.head(key) == storage.StoredObject(key, len(JPEG), "image/jpeg")
+    assert store.read_bytes(key) == JPEG
+    assert b"".join(store.get_range(key, 10, 19)) == JPEG[10:20]
+    assert b"".join(store.get_range(key, len(JPEG) - 5)) == JPEG[-5:]
+
+
+def test_missing_invalid_and_deleted_keys(s3):
+    store, _ = s3
+    key = store.put_bytes(JPEG).key
+    assert store.head("0" * 64 + ".jpg") is None
+    assert store.head("not-a-key") is None
+    store.delete(key)
+    assert store.head(key) is None
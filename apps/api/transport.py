@@ -0,0 +1,231 @@
+"""
+Shared-memory transport for page images between the API process and the
+vision / OCR pool processes.
+
+Instead of pickling multi-megabyte arrays through the pool's pipes, a stage
+puts its output into a multiprocessing.shared_memory segment and returns a
+small ShmRef descriptor; the next stage attaches to the segment and works on a
+numpy view of it without copying. Uploaded page bytes travel the same way.
+
+Lifetime: the API process owns every segment. It declares itself with
+set_owner() at startup and pool processes are told its pid by their
+initializer; ownership is not inferred from the process tree, because under
+uvicorn --reload or --workers the API process is itself a child. Segments are
+named after the owner's pid. Segments created in a pool process are handed
+over with the returned ShmRef and registered with track(); whoever started a
+page releases its segments in a finally block (release()). Segments still
+alive after IMAGE_TRANSPORT_LEAK_SECONDS are reported as leaks, release_all()
+unlinks whatever is left at shutdown, and sweep_orphans() removes segments
+left in /dev/shm by API processes that died.
+
+Configuration (env):
+    IMAGE_TRANSPORT               shm | pickle (default: shm)
+    IMAGE_TRANSPORT_LEAK_SECONDS  age after which a live segment is reported (default: 600)
+"""
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+ENABLED = os.getenv("IMAGE_TRANSPORT", "shm") == "shm"
+LEAK_SECONDS = float(os.getenv("IMAGE_TRANSPORT_LEAK_SECONDS", 600))
+PREFIX = "examimg_"
+SHM_DIR = "/dev/shm"
+
+_live: Dict[str, Tuple[float, str, int]] = {} # name -> (created, label, nbytes)
+_lock = threading.Lock()
+_tracked = 0
+_owner: Optional[int] = None # pid of the API process; unset means this process
+_in_worker = False
+
+
+@dataclass(frozen=True)
+class ShmRef:
+    """Descriptor of an array in shared memory; cheap to pickle."""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+def set_owner(pid: Optional[int] = None):
+    """
+    Called by the API process at startup without a pid, and by every pool process with
+    the API process's pid, which then owns and tracks the segments the worker creates.
+    """
+    global _owner, _in_worker
+    _owner = pid or os.getpid()
+    _in_worker = _owner != os.getpid()
+
+
+def owner_pid() -> int:
+    # Segments are named after the API process, so orphans can be matched to a dead owner
+    return _owner if _owner is not None else os.getpid()
+
+
+def put(data: Any, label: str = "image") -> Any:
+    """
+    Copies an array (or bytes) into a new segment and returns its ShmRef. With the
+    transport disabled, or when /dev/shm is full, the data is returned as is and
+    travels by pickle.
+    """
+    if not ENABLED:
+        return data
+    array = np.frombuffer(data, np.uint8) if isinstance(data, (bytes, bytearray, memoryview)) else np.asarray(data)
+    name = f"{PREFIX}{owner_pid()}_{uuid.uuid4().hex[:16]}"
+    try:
+        segment = shared_memory.SharedMemory(name=name, create=True, size=max(1, array.nbytes))
+    except OSError as e:
+        print(f"Warning: shared memory unavailable ({e}). Sending {label} by pickle.")
+        return data
+    try:
+        view = np.ndarray(array.shape, array.dtype, buffer=segment.buf)
+        view[...] = array
+        del view
+    except BaseException:
+        segment.close()
+        segment.unlink()
+        raise
+    segment.close()
+    ref = ShmRef(name, tuple(array.shape), array.dtype.str)
+    if not _in_worker:
+        track(ref, label)
+    return ref
+
+
+def track(ref: Any, label: str = "image") -> Any:
+    """Registers a segment handed over from a pool process with the owner's leak tracking."""
+    global _tracked
+    if isinstance(ref, ShmRef):
+        with _lock:
+            _live[ref.name] = (time.monotonic(), label, ref.nbytes)
+            _tracked += 1
+            check = _tracked % 100 == 0
+        if check:
+            check_leaks()
+    return ref
+
+
+def release(*refs: Any):
+    """Unlinks segments once no stage needs them. Safe to call twice and with plain data."""
+    for ref in refs:
+        if not isinstance(ref, ShmRef):
+            continue
+        with _lock:
+            _live.pop(ref.name, None)
+        try:
+            segment = shared_memory.SharedMemory(name=ref.name)
+        except FileNotFoundError:
+            continue
+        segment.close()
+        segment.unlink()
+
+
+def _close(segment: shared_memory.SharedMemory):
+    try:
+        segment.close()
+    except BufferError:
+        # A view escaped the caller; the mapping goes away with it. The segment itself
+        # is still unlinked by its owner, so nothing leaks.
+        pass
+
+
+def apply(data: Any, fn: Callable, *args, **kwargs):
+    """
+    Calls fn(array, *args) on the data behind a ShmRef (a zero-copy view) or on plain
+    data. The view must not outlive fn: copy anything that has to be kept.
+    """
+    if not isinstance(data, ShmRef):
+        return fn(data, *args, **kwargs)
+    segment = shared_memory.SharedMemory(name=data.name)
+    try:
+        array = np.ndarray(data.shape, np.dtype(data.dtype), buffer=segment.buf)
+        return fn(array, *args, **kwargs)
+    finally:
+        array = None
+        _close(segment)
+
+
+def apply_many(items: List[Any], fn: Callable, *args, **kwargs):
+    """apply() for a batch: fn receives the list of views / plain data in order."""
+    segments = []
+    arrays = []
+    try:
+        for item in items:
+            if isinstance(item, ShmRef):
+                segment = shared_memory.SharedMemory(name=item.name)
+                segments.append(segment)
+                arrays.append(np.ndarray(item.shape, np.dtype(item.dtype), buffer=segment.buf))
+            else:
+                arrays.append(item)
+        return fn(arrays, *args, **kwargs)
+    finally:
+        arrays.clear()
+        for segment in segments:
+            _close(segment)
+
+
+def check_leaks(older_than: float = None) -> List[str]:
+    """Reports (and returns) segments alive for longer than any stage should take."""
+    older_than = LEAK_SECONDS if older_than is None else older_than
+    now = time.monotonic()
+    with _lock:
+        leaked = [(name, label, nbytes, now - created) for name, (created, label, nbytes) in _live.items()
+                  if now - created > older_than]
+    for name, label, nbytes, age in leaked:
+        print(f"Warning: shared memory segment {name} ({label}, {nbytes} bytes) alive for {age:.0f}s; possible leak.")
+    return [name for name, *_ in leaked]
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "enabled": ENABLED,
+            "live_segments": len(_live),
+            "live_bytes": sum(nbytes for _, _, nbytes in _live.values()),
+            "tracked_total": _tracked
+        }
+
+
+def release_all():
+    """Shutdown: unlinks every segment still owned by this process and reports them."""
+    with _lock:
+        names = list(_live)
+    if names:
+        print(f"Warning: releasing {len(names)} shared memory segment(s) still in use at shutdown.")
+    for name in names:
+        release(ShmRef(name, (0,), "|u1"))
+
+
+def sweep_orphans() -> int:
+    """Unlinks segments left behind by API processes that are no longer running."""
+    if not os.path.isdir(SHM_DIR):
+        return 0
+    removed = 0
+    for entry in os.listdir(SHM_DIR):
+        if not entry.startswith(PREFIX):
+            continue
+        try:
+            owner = int(entry[len(PREFIX):].split("_", 1)[0])
+            os.kill(owner, 0)
+            continue # owner still alive
+        except ProcessLookupError:
+            pass
+        except (ValueError, PermissionError):
+            continue
+        try:
+            os.unlink(os.path.join(SHM_DIR, entry))
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        print(f"Removed {removed} orphaned shared memory segment(s).")
+    return removed
@@ -0,0 +1,370 @@
+"""
+Worker pools for the scan pipeline.
+
+Vision (OpenCV) and OCR (Tesseract) are CPU bound and run in a process pool so
+they scale with cores and never block the event loop. Each pool process keeps
+its own agents, including a loaded Tesseract engine, for its whole lifetime.
+Page bytes and images move between processes through shared memory
+(transport.py) rather than being pickled. Grading is I/O bound and
+awaits the shared async Gemini client (agents/llm_client.py), which applies its
+own rate limits. Every stage also has its own concurrency limit so a burst of
+uploads cannot starve the other stages.
+
+Configuration (env):
+    SCAN_PROCESS_WORKERS      processes for vision/OCR (default: CPU count)
+    SCAN_VISION_CONCURRENCY   max in-flight vision jobs (default: process workers)
+    SCAN_OCR_CONCURRENCY      max in-flight OCR jobs (default: process workers)
+    SCAN_GRADING_CONCURRENCY  max in-flight grading calls (default: 8)
+    SCORING_BATCH_SIZE        submissions packed into one grading call (default: 8, 1 disables)
+    SCORING_BATCH_WAIT_MS     how long to wait for a batch to fill (default: 200)
+    VISION_BATCH_SIZE         pages per VisionAgent.process_batch call on bulk paths (default: 4)
+    VISION_BATCH_WAIT_MS      how long to wait for a vision batch to fill (default: 50)
+"""
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from apps.api import transport
+
+if TYPE_CHECKING:
+    from apps.api.compiled_rubrics import CompiledRubric
+
+PROCESS_WORKERS = int(os.getenv("SCAN_PROCESS_WORKERS", os.cpu_count() or 2))
+
+STAGE_LIMITS = {
+    "vision": int(os.getenv("SCAN_VISION_CONCURRENCY", PROCESS_WORKERS)),
+    "ocr": int(os.getenv("SCAN_OCR_CONCURRENCY", PROCESS_WORKERS)),
+    "grading": int(os.getenv("SCAN_GRADING_CONCURRENCY", 8)),
+}
+
+SCORING_BATCH_SIZE = int(os.getenv("SCORING_BATCH_SIZE", 8))
+SCORING_BATCH_WAIT_MS = int(os.getenv("SCORING_BATCH_WAIT_MS", 200))
+VISION_BATCH_SIZE = int(os.getenv("VISION_BATCH_SIZE", 4))
+VISION_BATCH_WAIT_MS = int(os.getenv("VISION_BATCH_WAIT_MS", 50))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+_batchers: Dict[Tuple[str, str], "GradingBatcher"] = {}
+_batch_tasks: set = set()
+_vision_batcher: Optional["VisionBatcher"] = None
+
+# Agents living inside each pool process (created once by the initializer)
+_vision_agent = None
+_ocr_agent = None
+
+
+def _init_process(owner_pid: int):
+    global _vision_agent, _ocr_agent
+    # Shared-memory segments created here belong to the API process that started the pool
+    transport.set_owner(owner_pid)
+    # Parallelism comes from the pool: Tesseract's OpenMP threads in every process
+    # would oversubscribe the cores and stop throughput scaling with workers
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    from apps.api.agents.vision_agent import VisionAgent
+    from apps.api.agents.ocr_agent import OCRAgent
+    _vision_agent = VisionAgent()
+    _ocr_agent = OCRAgent()
+    # Load the OCR engine and language data once per process, before the first page
+    _ocr_agent.engine
+
+
+def _store_page_images(warped, processed) -> Dict[str, Any]:
+    """
+    Saves the warped page (JPEG) and the binarized page (PNG, compresses well) to
+    storage from inside the worker. Returns StoredObjects by kind.
+    """
+    import cv2
+    from apps.api import storage
+    if not storage.PAGE_IMAGES:
+        return {}
+    images = {}
+    for kind, image, ext, params in (
+        ("warped", warped, ".jpg", [cv2.IMWRITE_JPEG_QUALITY, 90]),
+        ("processed", processed, ".png", []),
+    ):
+        ok, encoded = cv2.imencode(ext, image, params)
+        if ok:
+            images[kind] = storage.store.put_bytes(encoded.tobytes())
+    return images
+
+
+def _vision_task(image: Any):
+    """
+    Returns the binarized page as a transport handle plus the stored page images.
+    The warped color image itself never leaves this process.
+    """
+    def run(image_bytes):
+        processed, warped = _vision_agent.process_image(image_bytes)
+        images = _store_page_images(warped, processed)
+        return transport.put(processed, "processed"), images
+    return transport.apply(image, run)
+
+
+def _fingerprint_task(image: Any):
+    return transport.apply(image, _vision_agent.fingerprint)
+
+
+def _page_difference_task(image: Any, original_key: str) -> float:
+    from apps.api import storage
+    other = storage.store.read_bytes(original_key)
+    return transport.apply(image, _vision_agent.page_difference, other)
+
+
+def _ocr_task(image: Any) -> Dict[str, Any]:
+    return transport.apply(image, _ocr_agent.extract_structured_data)
+
+
+def _vision_ocr_batch_task(images: List[Any]) -> List[Any]:
+    """
+    Vision + OCR for a batch of pages in one pool process. OCR runs on each page as
+    process_batch yields it, while the next pages decode in its threads; only the OCR
+    output and storage keys travel back to the parent, never the page images.
+    Returns one (extracted_data, stored images) pair (or the exception) per page.
+    """
+    def run(arrays):
+        results = []
+        for page in _vision_agent.process_batch(arrays, return_exceptions=True):
+            if isinstance(page, Exception):
+                results.append(page)
+                continue
+            processed, warped = page
+            try:
+                stored = _store_page_images(warped, processed)
+                results.append((_ocr_agent.extract_structured_data(processed), stored))
+            except Exception as e:
+                results.append(e)
+        return results
+    return transport.apply_many(images, run)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn: never fork a process that already runs an event loop and threads
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process,
+            initargs=(transport.owner_pid(),),
+        )
+    return _process_pool
+
+
+def _stage_semaphore(stage: str) -> asyncio.Semaphore:
+    sem = _semaphores.get(stage)
+    if sem is None:
+        sem = asyncio.Semaphore(STAGE_LIMITS[stage])
+        _semaphores[stage] = sem
+    return sem
+
+
+async def run_stage(stage: str, executor, fn: Callable, *args, on_discard: Optional[Callable] = None, **kwargs):
+    """
+    Runs fn in the given executor while holding the stage's concurrency slot.
+    If the caller is cancelled while fn is already running, on_discard receives fn's
+    result once it arrives (e.g. to release shared memory nobody will read).
+    """
+    async with _stage_semaphore(stage):
+        future = executor.submit(partial(fn, *args, **kwargs))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if on_discard is not None:
+                future.add_done_callback(
+                    lambda done: on_discard(done.result()) if not done.cancelled() and done.exception() is None else None
+                )
+            raise
+
+
+async def run_vision(image: Any):
+    """
+    Returns (binarized page as a transport handle, stored page images).
+    The caller releases the handle.
+    """
+    processed, images = await run_stage(
+        "vision", get_process_pool(), _vision_task, image, on_discard=lambda result: transport.release(result[0])
+    )
+    return transport.track(processed, "processed"), images
+
+
+async def run_fingerprint(image: Any):
+    return await run_stage("vision", get_process_pool(), _fingerprint_task, image)
+
+
+async def run_page_difference(image: Any, original_key: str) -> float:
+    """VisionAgent.page_difference between an upload and a stored original, in the pool."""
+    return await run_stage("vision", get_process_pool(), _page_difference_task, image, original_key)
+
+
+async def run_ocr(image: Any) -> Dict[str, Any]:
+    return await run_stage("ocr", get_process_pool(), _ocr_task, image)
+
+
+async def run_vision_ocr(image: Any) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Vision + OCR for one page of a bulk upload; returns (extracted_data, stored images).
+    Concurrent pages are collected into batches of VISION_BATCH_SIZE and run through
+    VisionAgent.process_batch together.
+    """
+    global _vision_batcher
+    if VISION_BATCH_SIZE <= 1:
+        processed, images = await run_vision(image)
+        try:
+            return await run_ocr(processed), images
+        finally:
+            transport.release(processed)
+    if _vision_batcher is None:
+        _vision_batcher = VisionBatcher()
+    return await _vision_batcher.submit(image)
+
+
+class VisionBatcher:
+    """
+    Collects pages from concurrent bulk-upload requests and sends them to one pool process
+    as a batch once VISION_BATCH_SIZE pages are waiting or VISION_BATCH_WAIT_MS has passed.
+    """
+    def __init__(self):
+        self.pending: List[Tuple[Any, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, page: Any) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((page, future))
+        if len(self.pending) >= VISION_BATCH_SIZE:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(VISION_BATCH_WAIT_MS / 1000.0, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        items, self.pending = self.pending, []
+        if items:
+            task = asyncio.get_running_loop().create_task(self._run(items))
+            _batch_tasks.add(task)
+            task.add_done_callback(_batch_tasks.discard)
+
+    async def _run(self, items: List[Tuple[Any, asyncio.Future]]):
+        try:
+            # One vision and one OCR slot per batch: the batch occupies one pool process
+            # and runs OCR there too, so it counts against SCAN_OCR_CONCURRENCY as well.
+            # No other path holds one of these slots while waiting for the other.
+            async with _stage_semaphore("ocr"):
+                results = await run_stage("vision", get_process_pool(), _vision_ocr_batch_task, [page for page, _ in items])
+        except Exception as e:
+            results = [e] * len(items)
+        for (_, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class GradingBatcher:
+    """
+    Collects concurrent grading requests that share a rubric, reference answer and API key,
+    and sends them as one ScoringAgent.evaluate_batch call once the batch is full or
+    SCORING_BATCH_WAIT_MS has passed.
+    """
+    def __init__(self, key: Tuple[str, str], rubric: "CompiledRubric", api_key: str, reference_context: Optional[str]):
+        self.key = key
+        self.rubric = rubric
+        self.api_key = api_key
+        self.reference_context = reference_context
+        self.pending: List[Tuple[str, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, student_response: str) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((student_response, future))
+        if len(self.pending) >= SCORING_BATCH_SIZE:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(SCORING_BATCH_WAIT_MS / 1000.0, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        items, self.pending = self.pending, []
+        if _batchers.get(self.key) is self:
+            del _batchers[self.key]
+        if items:
+            task = asyncio.get_running_loop().create_task(self._run(items))
+            _batch_tasks.add(task)
+            task.add_done_callback(_batch_tasks.discard)
+
+    async def _run(self, items: List[Tuple[str, asyncio.Future]]):
+        from apps.api.agents.scoring_agent import ScoringAgent
+        try:
+            async with _stage_semaphore("grading"):
+                results = await ScoringAgent().evaluate_batch(
+                    [response for response, _ in items],
+                    self.rubric,
+                    api_key=self.api_key,
+                    reference_context=self.reference_context
+                )
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+def _batch_key(rubric: Any, api_key: str, reference_context: Optional[str]) -> Tuple[str, str]:
+    # A CompiledRubric is identified by its (id, version) key, no need to serialize it
+    identity = rubric if isinstance(rubric, dict) else list(rubric.key)
+    digest = hashlib.sha256(
+        json.dumps([identity, reference_context], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return (api_key, digest)
+
+
+async def run_grading(student_response: str, rubric: "CompiledRubric", api_key: str, reference_context: Optional[str] = None):
+    # Imported lazily so pool processes (which import this module) stay light
+    from apps.api.agents.scoring_agent import ScoringAgent
+    if SCORING_BATCH_SIZE <= 1:
+        async with _stage_semaphore("grading"):
+            return await ScoringAgent().evaluate_submission(
+                student_response,
+                rubric,
+                api_key=api_key,
+                reference_context=reference_context
+            )
+
+    key = _batch_key(rubric, api_key, reference_context)
+    batcher = _batchers.get(key)
+    if batcher is None:
+        batcher = GradingBatcher(key, rubric, api_key, reference_context)
+        _batchers[key] = batcher
+    return await batcher.submit(student_response)
+
+
+def shutdown():
+    global _process_pool, _vision_batcher
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+    transport.release_all()
+    _semaphores.clear()
+    _batchers.clear()
+    _vision_batcher = None